@@ -0,0 +1,305 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime
+from pathlib import Path
+from paths import BENCHMARK_DIR
+from generate_self_equiv_tests import CFunctionExtractor, SelfEquivalenceTester, SourceFile, ENGINES
+from run_self_equiv_tests import TestRunner
+
+'''
+Benchmarks for function extraction and self-equivalence testing.
+
+By default the benchmark runs over a generated corpus: one .c file per combination of size
+(number of functions) and include depth (length of the chain of headers it includes), so
+that changes in how parse time scales with either show up separately. A checked-in corpus or
+a cloned repo can be benchmarked instead with --corpus.
+
+Measured:
+- parse time of each file (best of --repeat parses)
+- functions extracted per second, with the extraction cache disabled
+- peak RSS of the benchmark process and of its child processes (gcc and the test binaries)
+- compile time of the test harnesses
+- tests executed per second by run_self_equiv_tests.TestRunner, checking each function
+  against itself
+
+Results are written as JSON to BENCHMARK_DIR. Two runs can be compared, which lists every
+metric that got worse by more than a threshold and exits with status 1 if there are any.
+
+Usage:
+python benchmark.py run [--corpus DIR] [--engine libclang|tree-sitter] [--repeat N] [--tests N] [--test-workers N] [--output FILE]
+python benchmark.py compare <old.json> <new.json> [--threshold 0.1]
+'''
+
+# Functions per file and include depths of the generated corpus
+CORPUS_SIZES = {'small': 10, 'medium': 100, 'large': 1000}
+CORPUS_INCLUDE_DEPTHS = (0, 4, 16)
+# Declarations in each header, so that every level of include depth costs something to parse
+DECLARATIONS_PER_HEADER = 50
+
+def generate_corpus(corpus_dir, sizes=CORPUS_SIZES, include_depths=CORPUS_INCLUDE_DEPTHS):
+    """Write the benchmark corpus to corpus_dir; the same arguments always produce the same files"""
+    corpus_dir = Path(corpus_dir)
+    for depth in include_depths:
+        header_dir = corpus_dir / 'include' / f'd{depth}'
+        header_dir.mkdir(parents=True, exist_ok=True)
+        for level in range(depth):
+            lines = [f'#ifndef BENCH_D{depth}_H{level}', f'#define BENCH_D{depth}_H{level}', '']
+            if level + 1 < depth:
+                lines.append(f'#include "h{level + 1}.h"')
+            lines.append(f'#define BENCH_D{depth}_SCALE{level} {level + 2}')
+            lines.append(f'typedef int bench_d{depth}_word{level};')
+            lines.extend(f'int bench_d{depth}_h{level}_decl{k}(int a, int b);' for k in range(DECLARATIONS_PER_HEADER))
+            lines.extend(['', '#endif', ''])
+            (header_dir / f'h{level}.h').write_text('\n'.join(lines))
+
+    for size, num_functions in sizes.items():
+        for depth in include_depths:
+            lines = []
+            if depth:
+                lines.append(f'#include "include/d{depth}/h0.h"')
+                # Types and macros from the deepest header, so every function depends on the whole chain
+                word, scale = f'bench_d{depth}_word{depth - 1}', f'BENCH_D{depth}_SCALE{depth - 1}'
+            else:
+                word, scale = 'int', '3'
+            lines.append('')
+            for i in range(num_functions):
+                lines.append(f"""int bench_{size}_d{depth}_{i}(int a, int b)
+{{
+    {word} x = a * {scale} + {i};
+    if (x > b)
+        return x - b;
+    return x + b;
+}}
+""")
+            (corpus_dir / f'{size}_d{depth}.c').write_text('\n'.join(lines))
+    return corpus_dir
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size so far, in MB (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def environment_info():
+    """Where a run happened, since timings are only comparable between runs on the same machine"""
+    def first_line(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True).stdout.splitlines()[0]
+        except (OSError, IndexError):
+            return None
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'gcc': first_line(['gcc', '--version']),
+        'commit': first_line(['git', 'rev-parse', 'HEAD']),
+    }
+
+class Benchmark:
+    def __init__(self, corpus_dir, engine='libclang', repeat=3, num_tests=20, test_workers=1):
+        self.corpus_dir = str(corpus_dir)
+        self.engine = engine
+        self.repeat = repeat
+        self.num_tests = num_tests
+        self.test_workers = test_workers
+        self.metrics = {}
+        self.counts = {}
+
+    def time_parse(self, extractor, c_file):
+        """Best time out of `repeat` parses of one file"""
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            if self.engine == 'libclang':
+                extractor.parse_file(c_file)
+            else:
+                extractor.tree_sitter.parser.parse(SourceFile(c_file).content.encode())
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def bench_parse(self):
+        extractor = CFunctionExtractor(engine=self.engine)
+        c_files = extractor.find_source_files(self.corpus_dir)
+        total = 0
+        for c_file in c_files:
+            seconds = self.time_parse(extractor, c_file)
+            self.metrics[f'parse_seconds/{os.path.relpath(c_file, self.corpus_dir)}'] = seconds
+            total += seconds
+        self.counts['files'] = len(c_files)
+        self.metrics['parse_seconds_mean'] = total / len(c_files) if c_files else 0
+
+    def bench_extraction(self):
+        """Extract every testable function of the corpus, without the extraction cache"""
+        extractor = CFunctionExtractor(num_tests=sys.maxsize, engine=self.engine)
+        start = time.perf_counter()
+        # Keep the per-function progress output out of the timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            functions = extractor.extract_from_repo(self.corpus_dir)
+        seconds = time.perf_counter() - start
+        self.counts['functions'] = len(functions)
+        self.metrics['extraction_seconds'] = seconds
+        self.metrics['functions_per_second'] = len(functions) / seconds if seconds else 0
+        self.metrics['peak_rss_mb'] = peak_rss_mb()
+        return functions
+
+    def bench_tests(self, functions):
+        """Compile the harnesses of the first num_tests functions, then run them through TestRunner"""
+        functions = functions[:self.num_tests]
+        tester = SelfEquivalenceTester()
+        tests = {}
+        for func in functions:
+            test_cases = tester.generate_test_cases(func)
+            tests[func['function_name']] = {'test_cases': test_cases,
+                                           'harness': tester.create_test_harness(func, test_cases)}
+        # Harnesses include the corpus' headers by their quoted names
+        include_flags = ['-I', self.corpus_dir]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            compile_times = []
+            compiled = 0
+            for name, test in tests.items():
+                source = os.path.join(tmp_dir, f'{name}.c')
+                with open(source, 'w') as f:
+                    f.write(test['harness'])
+                start = time.perf_counter()
+                result = subprocess.run(['gcc'] + tester.gcc_flags + include_flags + [source, '-o', source + '.exe'],
+                                        capture_output=True)
+                compile_times.append(time.perf_counter() - start)
+                compiled += result.returncode == 0
+            self.counts['harnesses'] = len(compile_times)
+            self.counts['harnesses_compiled'] = compiled
+            self.metrics['harness_compile_seconds_mean'] = sum(compile_times) / len(compile_times) if compile_times else 0
+
+            functions_file = os.path.join(tmp_dir, 'functions.json')
+            tests_file = os.path.join(tmp_dir, 'tests.json')
+            with open(functions_file, 'w') as f:
+                json.dump(functions, f)
+            with open(tests_file, 'w') as f:
+                json.dump(tests, f)
+            with contextlib.redirect_stdout(io.StringIO()):
+                # Without golden outputs, and with harness objects kept in this run's directory, so
+                # every run measures both compiles of each test and the build of each harness object
+                runner = TestRunner(functions_file, tests_file, output_dir=os.path.join(tmp_dir, 'results'),
+                                    golden_cache_path=None, object_cache_dir=os.path.join(tmp_dir, 'objects'),
+                                    reproducers_path=None, workers=self.test_workers)
+                runner.gcc_flags = runner.gcc_flags + include_flags
+                start = time.perf_counter()
+                # Every function against itself: the work of a real run, and all of it should pass
+                results = runner.run_all_tests(functions)
+                seconds = time.perf_counter() - start
+        self.counts['tests'] = len(results)
+        self.counts['tests_equivalent'] = sum(1 for r in results if r['status'] == 'equivalent')
+        self.metrics['test_run_seconds'] = seconds
+        self.metrics['tests_per_second'] = len(results) / seconds if seconds else 0
+        self.metrics['peak_rss_children_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+    def run(self):
+        print(f"Benchmarking {self.engine} on {self.corpus_dir}")
+        self.bench_parse()
+        print(f"Parsed {self.counts['files']} files, mean {self.metrics['parse_seconds_mean'] * 1000:.2f} ms per file")
+        functions = self.bench_extraction()
+        print(f"Extracted {len(functions)} functions at {self.metrics['functions_per_second']:.1f} functions/s")
+        self.bench_tests(functions)
+        print(f"Ran {self.counts['tests']} tests at {self.metrics['tests_per_second']:.2f} tests/s "
+              f"({self.counts['tests_equivalent']} equivalent)")
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'engine': self.engine,
+            'corpus': self.corpus_dir,
+            'repeat': self.repeat,
+            'test_workers': self.test_workers,
+            'environment': environment_info(),
+            'counts': self.counts,
+            'metrics': self.metrics,
+        }
+
+def higher_is_better(metric):
+    return metric.endswith('_per_second')
+
+def compare_results(old, new, threshold=0.1):
+    """
+    Compare the metrics two runs have in common. Returns one entry per metric with its
+    relative change (positive means worse), flagged as a regression if it got worse by more
+    than threshold.
+    """
+    comparison = []
+    for metric in sorted(set(old['metrics']) & set(new['metrics'])):
+        old_value, new_value = old['metrics'][metric], new['metrics'][metric]
+        if old_value == 0:
+            change = 0.0 if new_value == 0 else float('inf')
+        else:
+            change = (new_value - old_value) / old_value
+        if higher_is_better(metric):
+            change = -change
+        comparison.append({
+            'metric': metric,
+            'old': old_value,
+            'new': new_value,
+            'change': change,
+            'regression': change > threshold,
+        })
+    return comparison
+
+def compare_main(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old.get('counts') != new.get('counts') or old.get('engine') != new.get('engine'):
+        print(f"Warning: the runs differ in engine or corpus ({old.get('engine')} {old.get('counts')} vs "
+              f"{new.get('engine')} {new.get('counts')}), so their metrics may not be comparable")
+
+    comparison = compare_results(old, new, args.threshold)
+    for entry in comparison:
+        flag = 'REGRESSION' if entry['regression'] else ''
+        print(f"{entry['metric']:<50} {entry['old']:>12.4g} {entry['new']:>12.4g} {entry['change'] * 100:>+8.1f}% {flag}")
+    regressions = [entry['metric'] for entry in comparison if entry['regression']]
+    print(f"\n{len(regressions)} of {len(comparison)} metrics regressed by more than {args.threshold * 100:.0f}%")
+    sys.exit(1 if regressions else 0)
+
+def run_main(args):
+    if args.corpus:
+        results = Benchmark(args.corpus, args.engine, args.repeat, args.tests, args.test_workers).run()
+    else:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            generate_corpus(corpus_dir)
+            results = Benchmark(corpus_dir, args.engine, args.repeat, args.tests, args.test_workers).run()
+            results['corpus'] = 'generated'
+
+    output = args.output or os.path.join(BENCHMARK_DIR, f"bench_{args.engine}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark function extraction and self-equivalence testing")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks and save their results")
+    run_parser.add_argument('--corpus', help="directory of C files to benchmark on (default: a generated corpus)")
+    run_parser.add_argument('--engine', choices=ENGINES, default='libclang')
+    run_parser.add_argument('--repeat', type=int, default=3, help="parses per file; the fastest one counts")
+    run_parser.add_argument('--tests', type=int, default=20, help="functions to compile and test")
+    run_parser.add_argument('--test-workers', type=int, default=1, help="tests TestRunner runs at the same time")
+    run_parser.add_argument('--output', help="results file (default: a timestamped file in BENCHMARK_DIR)")
+    run_parser.set_defaults(func=run_main)
+
+    compare_parser = subparsers.add_parser('compare', help="flag regressions between two saved runs")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="relative change that counts as a regression (default 0.1 = 10%%)")
+    compare_parser.set_defaults(func=compare_main)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import json
+import shlex
+import shutil
+import hashlib
+import threading
+import subprocess
+from paths import REPOS_DIR, ARTIFACT_DIR, BUILD_CHECKPOINT_DIR
+
+'''
+Link test harnesses against the objects a repo's own build produced (see install_repos.py),
+instead of compiling the function and its pasted context from source.
+
+The object a function was compiled into is looked up in the repo's compile_commands.json, then
+among the objects next to its source or in the build directory, then in every object and static
+library the build left in the repo. Nothing of the repo is recompiled: the harness is linked
+against a copy of that object and an archive of every other object in the repo, from which the
+linker pulls only what the function needs. Every repo object's main is made local in the
+archive so it doesn't clash with the harness's.
+
+A candidate replaces the original by symbol interposition. In the copy of the repo's object the
+candidate is linked with, the function is weak, and everything else the candidate's own object
+defines (its copies of globals, types' helpers and callees) is weak, so the candidate's function
+takes the original's place while the repo's definitions of everything else are kept.
+
+Functions whose object can't be found, or whose harness doesn't link against it, are compiled
+from source as before.
+'''
+
+# Libraries repo objects commonly need that a compilation database doesn't record
+LINK_LIBRARIES = ['-lm', '-lpthread', '-ldl']
+# Repo objects may not be position independent
+LINK_FLAGS = ['-no-pie']
+# Objects added to an archive per call to ar, to stay under the command line limit
+ARCHIVE_BATCH = 500
+
+def find_compilation_database(repo_path):
+    """
+    Directory holding a repo's compile_commands.json, either exported by CMake into the
+    build directory or captured by intercepting the compiler during install
+    """
+    for candidate in (repo_path, os.path.join(repo_path, 'build')):
+        if os.path.isfile(os.path.join(candidate, 'compile_commands.json')):
+            return candidate
+    return None
+
+def compiled_objects(db_dir):
+    """Map of each source file in a compilation database to the objects it was compiled into"""
+    with open(os.path.join(db_dir, 'compile_commands.json')) as f:
+        entries = json.load(f)
+    outputs = {}
+    for entry in entries:
+        directory = entry.get('directory', db_dir)
+        output = entry.get('output')
+        if output is None:
+            arguments = entry.get('arguments') or shlex.split(entry.get('command', ''))
+            if '-o' in arguments[:-1]:
+                output = arguments[arguments.index('-o') + 1]
+        if output is None:
+            continue
+        source = os.path.realpath(os.path.join(directory, entry['file']))
+        outputs.setdefault(source, []).append(os.path.realpath(os.path.join(directory, output)))
+    return outputs
+
+def is_elf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == b'\x7fELF'
+
+def defined_symbols(path):
+    """
+    Global symbols defined in an object file or each member of a static library, as
+    (member, name) pairs; member is None for an object file
+    """
+    result = subprocess.run(['nm', '-A', '-g', '--defined-only', '--format=posix', path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return []
+    symbols = []
+    for line in result.stdout.splitlines():
+        where, _, rest = line.partition(': ')
+        member = where[len(path) + 1:-1] if where.startswith(f'{path}[') else None
+        symbols.append((member, rest.split(' ', 1)[0]))
+    return symbols
+
+class BuildArtifacts:
+    def __init__(self, repos_dir=REPOS_DIR, cache_dir=ARTIFACT_DIR, compiler='gcc', libraries=LINK_LIBRARIES,
+                 checkpoint_dir=BUILD_CHECKPOINT_DIR):
+        self.repos_dir = repos_dir
+        # Where install_repos.py checkpoints builds, which marks the directories that are repos
+        self.checkpoint_dir = checkpoint_dir
+        self.cache_dir = cache_dir
+        self.compiler = compiler
+        self.libraries = list(libraries)
+        # Per repo: objects and static libraries its build left, and the compiled objects of each source
+        self._repos = {}
+        self._lock = threading.Lock()
+
+    def is_repo_root(self, directory):
+        """Whether a directory is a built repo: it has a compilation database or a build checkpoint (see BuildCheckpoint)"""
+        checkpoint = os.path.join(self.checkpoint_dir, f'{os.path.basename(directory)}.json')
+        return find_compilation_database(directory) is not None or os.path.isfile(checkpoint)
+
+    def repo_root(self, file_path):
+        """
+        The repo a source file belongs to: the nearest directory above it that is a built repo,
+        not going above repos_dir. Failing that, its top directory in repos_dir, or its own directory.
+        """
+        path = os.path.realpath(file_path)
+        repos_dir = os.path.realpath(self.repos_dir)
+        directory = os.path.dirname(path)
+        while directory != repos_dir and os.path.dirname(directory) != directory:
+            if self.is_repo_root(directory):
+                return directory
+            directory = os.path.dirname(directory)
+        if path.startswith(repos_dir + os.sep):
+            return os.path.join(repos_dir, os.path.relpath(path, repos_dir).split(os.sep)[0])
+        return os.path.dirname(path)
+
+    def scan(self, repo):
+        """Build outputs of a repo, found once and then reused"""
+        with self._lock:
+            if repo in self._repos:
+                return self._repos[repo]
+        objects, archives = [], []
+        for root, dirs, files in os.walk(repo):
+            dirs[:] = [d for d in dirs if d != '.git']
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if name.endswith('.o') and is_elf(path):
+                    objects.append(path)
+                elif name.endswith('.a') and os.path.isfile(path):
+                    archives.append(path)
+        db_dir = find_compilation_database(repo)
+        outputs = compiled_objects(db_dir) if db_dir else {}
+        found = {'objects': objects, 'archives': archives, 'outputs': outputs}
+        with self._lock:
+            return self._repos.setdefault(repo, found)
+
+    def locate(self, file_path, function_name):
+        """
+        Where a function was compiled to: (path, member) of the object defining it, member being
+        the object's name in a static library or None. None if the build left no such object.
+        """
+        repo = self.repo_root(file_path)
+        found = self.scan(repo)
+        source = os.path.realpath(file_path)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        # Likeliest first: what the compilation database says, then objects named after the source
+        candidates = [path for path in found['outputs'].get(source, []) if os.path.exists(path)]
+        candidates += [path for path in found['objects']
+                       if os.path.basename(path) in (f'{stem}.o', f'{stem}.c.o') and path not in candidates]
+        for path in candidates:
+            if (None, function_name) in defined_symbols(path):
+                return path, None
+        # The same name may be defined by several programs of a repo, so this is only the fallback
+        for path in found['objects'] + found['archives']:
+            for member, name in defined_symbols(path):
+                if name == function_name:
+                    return path, member
+        return None
+
+    def repo_archive(self, repo):
+        """
+        Static library of every object in a repo with main made local, rebuilt when any object
+        changes. None if the repo has no objects.
+        """
+        objects = self.scan(repo)['objects']
+        if not objects:
+            return None
+        stamp = hashlib.sha256()
+        for path in objects:
+            info = os.stat(path)
+            stamp.update(f'{path}\0{info.st_size}\0{info.st_mtime_ns}\0'.encode())
+        path = os.path.join(self.cache_dir, f'{os.path.basename(repo)}_{stamp.hexdigest()[:16]}.a')
+        if os.path.exists(path):
+            return path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            for start in range(0, len(objects), ARCHIVE_BATCH):
+                subprocess.run(['ar', 'qc', partial] + objects[start:start + ARCHIVE_BATCH], check=True, capture_output=True)
+            subprocess.run(['objcopy', '--localize-symbol=main', partial], check=True, capture_output=True)
+            subprocess.run(['ar', 's', partial], check=True, capture_output=True)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.unlink(partial)
+        return path
+
+    def function_artifact(self, file_path, function_name):
+        """
+        Objects to link a function's harness against instead of compiling the function: the
+        object it was compiled into ('original'), a copy of it with the function weak for
+        candidates to replace ('replaceable'), the archives and libraries the rest comes from
+        ('libraries') and a digest of the objects. None if it can't be found or copied.
+        """
+        location = self.locate(file_path, function_name)
+        if location is None:
+            return None
+        path, member = location
+        try:
+            if member is None:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            else:
+                content = subprocess.run(['ar', 'p', path, member], check=True, capture_output=True).stdout
+            digest = hashlib.sha256(content).hexdigest()
+            original = os.path.join(self.cache_dir, f'{digest[:16]}_{function_name}.o')
+            replaceable = os.path.join(self.cache_dir, f'{digest[:16]}_{function_name}.weak.o')
+            if not os.path.exists(replaceable):
+                os.makedirs(self.cache_dir, exist_ok=True)
+                partial = f'{original}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(partial, 'wb') as f:
+                    f.write(content)
+                os.replace(partial, original)
+                shutil.copyfile(original, partial)
+                subprocess.run(['objcopy', f'--weaken-symbol={function_name}', partial], check=True, capture_output=True)
+                os.replace(partial, replaceable)
+            repo = self.repo_root(file_path)
+            archive = self.repo_archive(repo)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        archives = ([archive] if archive else []) + self.scan(repo)['archives']
+        return {
+            'original': original,
+            'replaceable': replaceable,
+            'libraries': archives,
+            'link_flags': LINK_FLAGS + self.libraries,
+            'digest': hashlib.sha256(f"{digest}\0{archive}".encode()).hexdigest(),
+        }
+
+def link_objects(artifact, objects, replace):
+    """
+    Linker inputs of a harness built against a function's artifact. The repo's objects come
+    first, so where they define something strongly the weak copies in the harness (and in a
+    candidate's object, if replace) lose; the archives are searched again at the end for
+    anything only the harness or candidate needs.
+    """
+    function_object = artifact['replaceable'] if replace else artifact['original']
+    return [function_object] + artifact['libraries'] + list(objects) + artifact['libraries'] + artifact['link_flags']
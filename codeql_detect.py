@@ -2,72 +2,173 @@
 #SKIP.extend(['irungentoo___toxcore', 'chentao0707___qrcodescan', 'coolwanglu___vim.js', 'antirez___hping', 'amadvance___snapraid', 'stanfordnlp___glove', 'cisco___joy', 'stichting-minix-research-foundation___minix', 'yourtion___30daymakeos', 'jkornev___hidden', 'justinfrankel___licecap', 'kn007___silk-v3-decoder', 'koush___superuser', 'signal11___hidapi', 'leixiaohua1020___simplest_ffmpeg_mobile', 'zmap___zmap', 'alibaba___lvs', 'danielgtaylor___jpeg-archive', 'kangjianwei___data-structure', 'rewardone___oscprepo', 'yangchaojiang___yjplay', 'jp9000___obs', 'krakjoe___parallel', 'mabeijianxi___small-video-record', 'akopytov___sysbench', 'maratyszcza___nnpack', 'kbengine___kbengine', 'dlundquist___sniproxy', 'olimex___olinuxino', 'rubinius___rubinius', 'seclab-ucr___intang', 'cisco-talos___pyrebox', 'zedshaw___learn-c-the-hard-way-lectures', 'teamwin___team-win-recovery-project', 'shellinabox___shellinabox', 'secwiki___windows-kernel-exploits', 'achimdoebler___ugui', 'cundong___smartappupdates', 'secwiki___linux-kernel-exploits', 'fancycode___memorymodule', 'google___eddystone', 'vishnubob___python-midi', 'iliasam___opensimplelidar', 'mongrel2___mongrel2', 'julycoding___the-art-of-programming-by-july', 'mbebenita___broadway', 'shadowsocks___chinadns', 'attractivechaos___klib', 'rsms___markdown-wasm', 'xroche___httrack', 'kornelski___pngquant', 'proxmark___proxmark3', 'matz___streem', 'googlecreativelab___anypixel', 'apple___homekitadk', 'kevinlawler___kona', 'klange___nyancat', 'orangeduck___corange', 'tuanpmt___esp_mqtt', 'hnes___libaco', 'fix94___nintendont', 'termux___termux-x11', 'libimobiledevice___ideviceinstaller', 'iolanguage___io', 'wishstudio___flinux', 'aergoio___litetree', 'apple___darwin-xnu', 'go-gl___glfw', 'ngs-lang___ngs', 'loyinglin___learnopengles', 'sp4cerat___fast-quadric-mesh-simplification', 'neurobin___shc', 'id-software___quake-2', 'nkolban___esp32-snippets', 'bingoogolapple___bgaqrcode-android', 'yaoweibin___nginx_tcp_proxy_module', 'addy-dclxvi___almighty-dotfiles', 'vurtun___nuklear', 'agavrel___42_cheatsheet', 'nfc-tools___libnfc', 'fragglet___c-algorithms', 'openglredbook___examples', 'awesome-harmonyos___harmonyos', 'twitter___ios-twitter-image-pipeline', 'isometimes___rpi4-osdev', 'hfiref0x___syscalltables', 'blindmindstudios___starruler2-source', 'telegrammessenger___mtproxy', 'mofarrell___p2pvc', 'baskerville___sxhkd', 'dmajkic___redis', 'chiakge___linux-netspeed', 'mpenkov___ffmpeg-tutorial', 'minoca___os', 'allalgorithms___c', 'wine-mirror___wine', 'dekunukem___nintendo_switch_reverse_engineering', 'cleanflight___cleanflight', 'bztsrc___raspi3-tutorial', 'hashcat___hashcat-legacy', 'vlfeat___vlfeat', 'fossasia___pslab-bootloader', 'bugaevc___wl-clipboard', 'vanhoefm___krackattacks-scripts', 'linux-noah___noah', 's-macke___sam', 'corellium___projectsandcastle', 'facebookarchive___libphenom', 'saminiir___level-ip', 'squeaky-pl___japronto', 'imbushuo___mac-precision-touchpad', 'mcnopper___opengl', 'grahamdumpleton___mod_wsgi', 'lmdb___lmdb', 'pervognsen___bitwise', 'orangeduck___cello', 'cmatsuoka___figlet', 'openkinect___libfreenect', 'id-software___quake-iii-arena', 'valdikss___goodbyedpi', 'tomojitakasu___rtklib', 'conorpp___u2f-zero', 'cfenollosa___os-tutorial', 'linw7___skill-tree', 'quiet___org.quietmodem.quiet', 'ioi___isolate', 'torch___torch7', 'pellepl___spiffs', 'openresty___headers-more-nginx-module', 'chenyahui___annotatedcode', 'binbyu___reader', 'galkahana___hummusjs', 'tcurdt___iproxy', 'cloudwu___pbc', 'doctorwkt___acwj', 'christinaa___rpi-open-firmware', 'pytorch___qnnpack', 'cnlohr___espusb', 'wuxx___nanodap', 'hishamhm___htop', 'udp___json-parser', 'nuand___bladerf', 'rdesktop___rdesktop', 'christophejacquet___pifmrds', 'wizteam___wizqtclient', 'kdlucas___byte-unixbench', 'olikraus___u8glib', 'samypesse___how-to-make-a-computer-operating-system', 'mtcp-stack___mtcp', 'unpbook___unpv13e', 'x64dbg___gleebug', 'wireguard___wireguard-monolithic-historical', 'flame___how-to-optimize-gemm', 'sparklemotion___nokogiri', 'juhovh___shairplay', 'pipelinedb___pipelinedb', 'mntmn___interim', 'dtrace4linux___linux', 'torvalds___uemacs', 'ming1016___study', 'antirez___sds', 'guanshuicheng___invoice', 'whitecatboard___lua-rtos-esp32', 'jiangdongguo___androidusbcamera', 'tanersener___mobile-ffmpeg', 'mykter___afl-training', 'sunzxyong___tiny', 'getdnsapi___stubby', 'theofficialflow___adrenaline', 'jerryscript-project___iotjs', 'msysgit___msysgit', 'armink___sfud', 'madler___pigz', 'schismtracker___schismtracker', 'antimof___uxplay', 'riba2534___tcp-ip-networknote', 'samyk___pwnat', 'adrianlopezroche___fdupes', 'saghul___pyuv', 'ionescu007___simplevisor', 'traviscross___mtr', 'frickle___ngx_cache_purge', 'libfuse___sshfs', 'twitter___fatcache', 's-march___smarchwatch_public', 'kiukotsu___ucore', '0voice___algorithm-structure', 'spotify___sparkey', 'irtimmer___moonlight-embedded', 'armink___easyflash', 'pgaudit___pgaudit', '0x90___wifi-arsenal', 'nodejs___http-parser', 'tmate-io___tmate', 'abcminiuser___lufa', 'blinker-iot___blinker-esp-idf', 'projectne10___ne10', 'joedog___siege', 'teaonly___android-eye', 'dav___word2vec', 'lavabit___magma', 'nmikhailov___validity90', 'atomicobject___heatshrink', 'cx9208___bbrplus', 'snavely___bundler_sfm', 'karlstav___cava', 'nicholas3388___luanode', 'alibaba___tsar', 'jhawthorn___fzy', 'mpc-hc___mpc-hc', 'f5oeo___rpitx', 'pwmt___zathura', 'drh___lcc', 'anestisb___vdexextractor', 'nikhilm___uvbook', 'facebookresearch___darkforestgo', 'evanw___thinscript', 'gsass1___ntop', 'liexusong___php-beast', 'woai3c___mit6.828', 'sandboxie___sandboxie', 'google___google-authenticator-libpam', 'netsniff-ng___netsniff-ng', 'bumptech___stud', 'sqfmi___watchy', 'white-tiger___t-clock', 'jart___sectorlisp', 'yodaos-project___yodaos', 'zavg___linux-0.01', 'maxbube___mydumper', 'dekunukem___daytripper', 'a0rtega___pafish', 'networkprotocol___netcode', 'pelya___android-keyboard-gadget', 'bootchk___resynthesizer'])
 
 import os
-import subprocess
+import time
 import logging
-from pathlib import Path
-from paths import REPOS_DIR
-
-# Configure logger
-log_file = 'codeql_analysis.log'
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger()
-
-# Counters and lists for successes and failures
-total_success = 0
-total_failures = 0
-success_repos = []
-failure_repos = []
-
-# Iterate over all repositories in REPOS_DIR
-for repo_name in os.listdir(REPOS_DIR):
-    repo_path = Path(REPOS_DIR) / repo_name
-    '''
-    if repo_name in SKIP:
-        logger.info(f"Skipping {repo_name}")
-        continue
-    '''
-
-    if repo_path.is_dir():
-        logger.info(f"Processing repository: {repo_name}")
-
-        # Run the CodeQL database creation command
-        cmd = ['/home/vkethana/codeql/codeql', 'database', 'create', 'my-database', '--language=cpp', '--overwrite']
-        try:
-            result = subprocess.run(cmd, cwd=repo_path, capture_output=True, text=True)
-
-            # Output result of the CodeQL command
-            if result.returncode == 0:
-                logger.info(f"SUCCESS: {repo_name}\n{result.stdout}")
-                total_success += 1
-                success_repos.append(repo_name)
-            else:
-                logger.error(f"FAILED: {repo_name}\n{result.stderr}")
-                total_failures += 1
-                failure_repos.append(repo_name)
-
-        except Exception as e:
-            logger.error(f"Error running CodeQL for {repo_name}: {str(e)}")
-            total_failures += 1
-            failure_repos.append(repo_name)
-
-        # Print running totals after each iteration
-        logger.info(f"Running totals: Successes: {total_success}, Failures: {total_failures}")
-        logger.info(f"Success repos: {success_repos}")
-        logger.info(f"Failed repos: {failure_repos}")
-
-# Final summary
-logger.info("Script completed.")
-logger.info(f"Total successes: {total_success}")
-logger.info(f"Total failures: {total_failures}")
-logger.info(f"Repos that succeeded: {success_repos}")
-logger.info(f"Repos that failed: {failure_repos}")
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from paths import REPOS_DIR, LOGGER_DIR, CODEQL_DB_DIR
+from install_repos import successful_build_system
+
+'''
+Create a CodeQL database for every repo in REPOS_DIR, several at once.
+
+Jobs share a global budget of CPU threads and MB of RAM: each one is given an explicit
+--threads and --ram, and only as many run at a time as fit in the budget. Instead of
+CodeQL's autobuild rediscovering how to build each project, a repo that install_repos.py
+built successfully is traced while its build system compiles every source again (see
+BuildSystem.rebuild_commands); only repos without a finished build fall back to autobuild.
+Each job's output goes to its own log, and databases to CODEQL_DB_DIR/<repo_name>.
+
+The codeql executable is taken from --codeql or the CODEQL environment variable, so a stub
+can stand in for the real CLI.
+
+Usage:
+python codeql_detect.py [repos_dir] [--threads N] [--ram MB] [--job-threads N] [--job-ram MB] [--codeql PATH]
+'''
+
+CODEQL = os.environ.get('CODEQL', '/home/vkethana/codeql/codeql')
+# Resources each database creation gets by default
+JOB_THREADS = 2
+JOB_RAM_MB = 2048
+
+logger = logging.getLogger(__name__)
+
+def available_ram_mb():
+    """RAM that can be used without swapping, from /proc/meminfo, or all physical RAM elsewhere"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+def plan_jobs(threads, ram, job_threads, job_ram):
+    """
+    (concurrent jobs, threads per job, MB of RAM per job) that fit in the budget. A job bigger
+    than the whole budget is cut down to it, so at least one always runs.
+    """
+    job_threads = max(1, min(job_threads, threads))
+    job_ram = max(1, min(job_ram, ram))
+    return max(1, min(threads // job_threads, ram // job_ram)), job_threads, job_ram
+
+def database_command(codeql, repo_path, database, threads, ram, build_commands):
+    """codeql command line creating a C/C++ database of a repo, traced while build_commands run"""
+    cmd = [codeql, 'database', 'create', database, '--language=cpp', '--overwrite',
+           f'--source-root={repo_path}', f'--threads={threads}', f'--ram={ram}']
+    # Several commands run in order; with none, CodeQL falls back to autobuild
+    cmd += [f'--command={command}' for command in build_commands]
+    return cmd
+
+class CodeQLRunner:
+    def __init__(self, codeql=CODEQL, output_dir=CODEQL_DB_DIR, threads=None, ram=None, job_threads=JOB_THREADS,
+                 job_ram=JOB_RAM_MB, timeout=None, log_dir=LOGGER_DIR, checkpoint_dir=None):
+        self.codeql = codeql
+        self.output_dir = output_dir
+        # Global budget, the whole machine by default
+        self.threads = threads or os.cpu_count() or 1
+        self.ram = ram or available_ram_mb()
+        self.workers, self.job_threads, self.job_ram = plan_jobs(self.threads, self.ram, job_threads, job_ram)
+        self.timeout = timeout
+        self.log_dir = log_dir
+        # Where install_repos.py's build checkpoints are, BUILD_CHECKPOINT_DIR if None
+        self.checkpoint_dir = checkpoint_dir
+
+    def create_database(self, repo_path):
+        """Create one repo's database, returning a dict with its status and how it was built"""
+        repo_name = os.path.basename(os.path.normpath(repo_path))
+        build_system = successful_build_system(repo_path, self.checkpoint_dir)
+        build_commands = build_system.rebuild_commands(repo_path, self.job_threads) if build_system else []
+        database = os.path.abspath(os.path.join(self.output_dir, repo_name))
+        cmd = database_command(self.codeql, os.path.abspath(repo_path), database, self.job_threads, self.job_ram,
+                               build_commands)
+        log_path = os.path.join(self.log_dir, f'{repo_name}_codeql.log')
+        os.makedirs(self.log_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        returncode = None
+        with open(log_path, 'w') as log:
+            try:
+                returncode = subprocess.run(cmd, cwd=repo_path, stdout=log, stderr=subprocess.STDOUT,
+                                            timeout=self.timeout).returncode
+                status = 'success' if returncode == 0 else 'failed'
+            except subprocess.TimeoutExpired:
+                status = 'timeout'
+            except OSError as e:
+                log.write(f"Error running CodeQL: {e}\n")
+                status = 'error'
+        return {
+            'repo': repo_name,
+            'status': status,
+            'returncode': returncode,
+            'build': build_system.__class__.__name__ if build_system else 'autobuild',
+            'commands': build_commands,
+            'threads': self.job_threads,
+            'ram': self.job_ram,
+            'seconds': time.perf_counter() - start,
+            'database': database,
+            'log': log_path,
+        }
+
+    def run(self, repos):
+        """Create every repo's database, as many at a time as the budget allows. Results are in repo order."""
+        logger.info(f"Creating {len(repos)} databases, {self.workers} at a time with "
+                    f"{self.job_threads} threads and {self.job_ram} MB each")
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.create_database, repo_path): repo_path for repo_path in repos}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if result['status'] == 'success':
+                    logger.info(f"SUCCESS: {result['repo']} ({result['build']}, {result['seconds']:.1f} s)")
+                else:
+                    logger.error(f"FAILED: {result['repo']} ({result['status']}, {result['build']}), see {result['log']}")
+                done = list(results.values())
+                logger.info(f"Running totals: Successes: {sum(r['status'] == 'success' for r in done)}, "
+                            f"Failures: {sum(r['status'] != 'success' for r in done)}, Remaining: {len(repos) - len(done)}")
+        return [results[repo_path] for repo_path in repos]
+
+def main():
+    parser = argparse.ArgumentParser(description="Create CodeQL databases for many repos at once within CPU and RAM budgets")
+    parser.add_argument('repos_dir', nargs='?', default=REPOS_DIR)
+    parser.add_argument('--threads', type=int, help="threads all jobs together may use (default: every CPU)")
+    parser.add_argument('--ram', type=int, help="MB of RAM all jobs together may use (default: the available RAM)")
+    parser.add_argument('--job-threads', type=int, default=JOB_THREADS, help="threads each database creation gets")
+    parser.add_argument('--job-ram', type=int, default=JOB_RAM_MB, help="MB of RAM each database creation gets")
+    parser.add_argument('--timeout', type=float, help="seconds after which a database creation is stopped")
+    parser.add_argument('--codeql', default=CODEQL, help="codeql executable")
+    parser.add_argument('--output-dir', default=CODEQL_DB_DIR, help="directory databases are created in")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('codeql_analysis.log'),
+            logging.StreamHandler()
+        ]
+    )
 
+    repos = [os.path.join(args.repos_dir, name) for name in sorted(os.listdir(args.repos_dir))
+             if os.path.isdir(os.path.join(args.repos_dir, name))]
+    runner = CodeQLRunner(args.codeql, args.output_dir, args.threads, args.ram, args.job_threads, args.job_ram,
+                          args.timeout)
+    results = runner.run(repos)
 
+    # Final summary
+    success_repos = [r['repo'] for r in results if r['status'] == 'success']
+    failure_repos = [r['repo'] for r in results if r['status'] != 'success']
+    logger.info("Script completed.")
+    logger.info(f"Total successes: {len(success_repos)}")
+    logger.info(f"Total failures: {len(failure_repos)}")
+    logger.info(f"Built with the known build command: {sum(r['build'] != 'autobuild' for r in results)}, "
+                f"with autobuild: {sum(r['build'] == 'autobuild' for r in results)}")
+    logger.info(f"Repos that succeeded: {success_repos}")
+    logger.info(f"Repos that failed: {failure_repos}")
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import uuid
+import hashlib
+import tempfile
+import threading
+import subprocess
+from paths import CACHE_DIR
+from harness_table import render_coverage_harness
+
+'''
+Coverage-guided minimization of a function's test cases.
+
+A large pool of inputs is generated for the function, and the original is compiled once with
+gcc's -fsanitize-coverage=trace-pc into a harness that records which control flow edges each
+test case takes (see coverage_runtime.c). A greedy set cover then picks a small subset of the
+pool that takes every edge the whole pool took, and only that subset goes into the function's
+test harness. Every later candidate is run on the subset, so it costs less to test while still
+going down every path the pool reached in the original.
+
+If the coverage harness doesn't build, crashes or times out, nothing is minimized and the caller
+falls back to its usual test cases.
+'''
+
+RUNTIME_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coverage_runtime.c')
+RUNTIME_DIR = os.path.join(CACHE_DIR, 'coverage_runtime')
+COVERAGE_FLAGS = ['-O0', '-w', '-fsanitize-coverage=trace-pc']
+
+# Inputs generated per function before minimizing
+POOL_SIZE = 256
+
+_build_lock = threading.Lock()
+
+def build_runtime(compiler='gcc', runtime_dir=RUNTIME_DIR):
+    """Path of the compiled coverage runtime, building it if its source changed since the last build"""
+    with open(RUNTIME_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    path = os.path.join(runtime_dir, f'coverage_runtime_{digest}.o')
+    with _build_lock:
+        if not os.path.exists(path):
+            os.makedirs(runtime_dir, exist_ok=True)
+            subprocess.run([compiler, '-O2', '-c', RUNTIME_SOURCE, '-o', path + '.tmp'], check=True)
+            os.replace(path + '.tmp', path)
+    return path
+
+def greedy_cover(coverage):
+    """
+    Indices of a small set of test cases that together cover every edge any of them covers,
+    in test case order. Repeatedly takes the case covering the most edges not covered yet.
+    """
+    uncovered = set().union(*coverage)
+    chosen = []
+    while uncovered:
+        best = max(range(len(coverage)), key=lambda i: (len(coverage[i] & uncovered), -i))
+        chosen.append(best)
+        uncovered -= coverage[best]
+    # A function with no instrumented edges still needs one case
+    return sorted(chosen) or [0]
+
+class CoverageMinimizer:
+    def __init__(self, compiler='gcc', pool_size=POOL_SIZE, timeout=10, build_dir=None):
+        self.compiler = compiler
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.build_dir = build_dir or tempfile.gettempdir()
+        # Totals over every function minimized, for reporting
+        self.stats = {'functions': 0, 'failed': 0, 'pool_cases': 0, 'kept_cases': 0}
+
+    def case_coverage(self, code, function_info, test_cases):
+        """Set of edges each test case takes in the original, or None if the coverage run failed"""
+        harness = render_coverage_harness(code, function_info, test_cases)
+        name = uuid.uuid4().hex
+        executable = os.path.join(self.build_dir, f'{name}.cov')
+        coverage_file = os.path.join(self.build_dir, f'{name}.edges')
+        try:
+            compiled = subprocess.run([self.compiler] + COVERAGE_FLAGS + ['-x', 'c', '-', '-x', 'none',
+                                       build_runtime(self.compiler), '-o', executable],
+                                      input=harness, capture_output=True, text=True)
+            if compiled.returncode != 0:
+                return None
+            result = subprocess.run([executable], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, timeout=self.timeout,
+                                    env=dict(os.environ, HARNESS_COVERAGE_FILE=coverage_file))
+            if result.returncode != 0:
+                return None
+            coverage = [frozenset()] * len(test_cases)
+            with open(coverage_file) as f:
+                for line in f:
+                    index, *edges = line.split()
+                    coverage[int(index)] = frozenset(edges)
+            return coverage
+        except (OSError, subprocess.SubprocessError):
+            return None
+        finally:
+            for path in (executable, coverage_file):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def minimize(self, code, function_info, test_cases):
+        """
+        The test cases, out of the given pool, that keep the pool's edge coverage of the
+        function in code, each marked with its 'pool_index'. None if coverage couldn't be measured.
+        """
+        self.stats['functions'] += 1
+        coverage = self.case_coverage(code, function_info, test_cases)
+        if coverage is None:
+            self.stats['failed'] += 1
+            return None
+        kept = [dict(test_cases[i], pool_index=i) for i in greedy_cover(coverage)]
+        self.stats['pool_cases'] += len(test_cases)
+        self.stats['kept_cases'] += len(kept)
+        return kept
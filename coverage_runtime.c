@@ -0,0 +1,65 @@
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+// Edge coverage runtime for harnesses compiled with -fsanitize-coverage=trace-pc (see
+// coverage_minimizer.py). The compiler inserts a call to __sanitizer_cov_trace_pc in every
+// basic block of the instrumented code; this file is compiled without instrumentation and linked
+// in. Between harness_cov_begin and harness_cov_end each distinct edge (pair of consecutive
+// blocks) is recorded once, and harness_cov_end writes them as one line
+// "<test case> <from>:<to> <from>:<to> ..." to the file named by HARNESS_COVERAGE_FILE.
+
+#define TABLE_SIZE (1 << 16)
+
+struct edge {
+    uintptr_t from, to;
+};
+
+static struct edge edges[TABLE_SIZE];
+static size_t used[TABLE_SIZE / 2];
+static size_t num_used;
+static uintptr_t previous;
+static int recording;
+static FILE *out;
+
+void __sanitizer_cov_trace_pc(void) {
+    if (!recording)
+        return;
+    uintptr_t pc = (uintptr_t)__builtin_return_address(0);
+    uintptr_t from = previous;
+    previous = pc;
+    size_t slot = (size_t)(((from * 31) ^ pc) * 0x9E3779B97F4A7C15ull >> 48) & (TABLE_SIZE - 1);
+    while (edges[slot].to && (edges[slot].from != from || edges[slot].to != pc))
+        slot = (slot + 1) & (TABLE_SIZE - 1);
+    // A test case that covers more edges than half the table only records the first ones
+    if (edges[slot].to || num_used == TABLE_SIZE / 2)
+        return;
+    edges[slot].from = from;
+    edges[slot].to = pc;
+    used[num_used++] = slot;
+}
+
+void harness_cov_begin(void) {
+    if (!out) {
+        const char *path = getenv("HARNESS_COVERAGE_FILE");
+        out = path ? fopen(path, "w") : stderr;
+        if (!out)
+            exit(2);
+    }
+    previous = 0;
+    recording = 1;
+}
+
+void harness_cov_end(size_t test_case) {
+    recording = 0;
+    fprintf(out, "%zu", test_case);
+    for (size_t i = 0; i < num_used; i++) {
+        struct edge *e = &edges[used[i]];
+        fprintf(out, " %lx:%lx", (unsigned long)e->from, (unsigned long)e->to);
+        e->from = e->to = 0;
+    }
+    fprintf(out, "\n");
+    // Lines of the test cases before one that crashes are kept
+    fflush(out);
+    num_used = 0;
+}
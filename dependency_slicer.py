@@ -0,0 +1,503 @@
+import os
+import re
+import sys
+import json
+import bisect
+import hashlib
+from pathlib import Path
+import clang.cindex
+from extraction_cache import ExtractionCache
+from generate_self_equiv_tests import CFunctionExtractor, SourceFile, find_compilation_database
+
+'''
+Dependency slicing: cut a function out of its repo together with exactly what it needs to
+compile on its own.
+
+The slicer parses every .c file of a repo once and splits the repo's code (the .c files and any
+headers of the repo they include) into units: top-level definitions and declarations, and
+macro definitions. For each unit it records what the unit refers to: callees, global variables,
+struct/union/enum/typedef definitions, enum constants, macros, and the external headers that
+declare whatever comes from outside the repo. Callees and globals defined in another .c file
+are resolved through their USR once the whole repo is indexed.
+
+A function's slice is the transitive closure of its unit, emitted as external #includes, the
+macros, types and globals it uses, prototypes, and then the function definitions with the
+function itself last. Closures are computed on the strongly connected components of the unit
+graph and memoized, so a repo's functions share them instead of each walking the graph again.
+
+index_repo() can save the finished index to a file and load it from there as long as none of
+the repo's .c and .h files and none of their parse arguments changed, so a resumed extraction
+run doesn't parse the whole repo again.
+
+Usage:
+python dependency_slicer.py <repo_path> <function_name>
+'''
+
+# Bump whenever what a saved index holds changes, so indexes saved by older versions are rebuilt
+SLICER_VERSION = 1
+
+REFERENCE_KINDS = {
+    clang.cindex.CursorKind.DECL_REF_EXPR,
+    clang.cindex.CursorKind.MEMBER_REF_EXPR,
+    clang.cindex.CursorKind.TYPE_REF,
+}
+TYPE_KINDS = {
+    clang.cindex.CursorKind.STRUCT_DECL,
+    clang.cindex.CursorKind.UNION_DECL,
+    clang.cindex.CursorKind.ENUM_DECL,
+    clang.cindex.CursorKind.TYPEDEF_DECL,
+}
+# Top-level cursors that become units
+UNIT_KINDS = TYPE_KINDS | {
+    clang.cindex.CursorKind.FUNCTION_DECL,
+    clang.cindex.CursorKind.VAR_DECL,
+    clang.cindex.CursorKind.MACRO_DEFINITION,
+}
+
+CONDITIONAL_START = re.compile(r'^\s*#\s*if')
+CONDITIONAL_CONTINUE = re.compile(r'^\s*#\s*(else|elif)')
+CONDITIONAL_END = re.compile(r'^\s*#\s*endif')
+
+def balance_unit_text(text):
+    """
+    Make a unit's lines stand on their own: a unit can start inside an #if block (an attribute
+    wrapped in #if ... #endif just above a declaration) or end in the middle of a comment that
+    runs on past a macro definition.
+    """
+    lines = []
+    depth = 0
+    for line in text.split('\n'):
+        if CONDITIONAL_START.match(line):
+            depth += 1
+        elif CONDITIONAL_CONTINUE.match(line) and depth == 0:
+            continue
+        elif CONDITIONAL_END.match(line):
+            if depth == 0:
+                continue
+            depth -= 1
+        lines.append(line)
+    lines.extend(['#endif'] * depth)
+    text = '\n'.join(lines)
+    if text.rfind('/*') > text.rfind('*/'):
+        text += ' */'
+    return text
+
+class DependencySlicer:
+    def __init__(self, repo_path, extractor=None):
+        self.repo_path = os.path.abspath(repo_path)
+        self.extractor = extractor or CFunctionExtractor()
+        if self.extractor.engine != 'libclang':
+            raise ValueError("Dependency slicing needs the libclang engine")
+        # unit key -> {'kind', 'names', 'file', 'start_line', 'end_line', 'prototype', 'deps', 'includes'}
+        self.units = {}
+        # Units of each repo file and the lines they start on, in source order
+        self.file_units = {}
+        self.file_starts = {}
+        # USR of each function or global variable -> key of the unit defining it
+        self.definitions = {}
+        self._sources = {}
+        self._sccs = None
+        self._members = None
+        self._closures = {}
+
+    def in_repo(self, filename):
+        return filename.startswith(self.repo_path + os.sep)
+
+    def get_source(self, filename):
+        if filename not in self._sources:
+            self._sources[filename] = SourceFile(filename)
+        return self._sources[filename]
+
+    def unit_key(self, filename, line):
+        return f"{os.path.relpath(filename, self.repo_path)}:{line}"
+
+    def find_unit(self, filename, line):
+        """Key of the unit of a repo file covering a line, if any"""
+        starts = self.file_starts.get(filename)
+        if not starts:
+            return None
+        i = bisect.bisect_right(starts, line) - 1
+        if i >= 0 and self.units[self.file_units[filename][i]]['end_line'] >= line:
+            return self.file_units[filename][i]
+        return None
+
+    def index_repo(self, cache_path=None):
+        """
+        Parse every .c file of the repo once, then resolve calls and globals across files. With a
+        cache_path, the finished index is saved there, and loaded instead while the repo is unchanged.
+        """
+        self.extractor.use_compilation_database(find_compilation_database(self.repo_path))
+        key = self.index_key() if cache_path else None
+        if key is not None and self.load(cache_path, key):
+            return self
+        for c_file in self.extractor.find_source_files(self.repo_path):
+            tu = self.extractor.parse_file(c_file)
+            if not tu:
+                print(f"Failed to parse {c_file}")
+                continue
+            self.index_tu(tu)
+        self.finish()
+        if key is not None:
+            self.save(cache_path, key)
+        return self
+
+    def index_key(self):
+        """Hash of everything the index depends on: the repo's .c and .h files and how the .c files are parsed"""
+        root = Path(self.repo_path)
+        files = sorted(str(p) for pattern in ('*.c', '*.h') for p in root.rglob(pattern))
+        state = {
+            'version': SLICER_VERSION,
+            'files': [[path, ExtractionCache.hash_file(path)] for path in files],
+            'args': [self.extractor.get_parse_args(c_file) for c_file in self.extractor.find_source_files(self.repo_path)],
+            'options': self.extractor.parse_options,
+        }
+        return hashlib.sha256(json.dumps(state).encode()).hexdigest()
+
+    def save(self, path, key):
+        """Write the finished index to path, tagged with its index_key"""
+        units = {unit_key: dict(unit, includes=sorted(unit['includes'])) for unit_key, unit in self.units.items()}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'key': key, 'units': units, 'file_units': self.file_units, 'file_starts': self.file_starts}, f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path, key):
+        """Load an index saved by save(); False if there is none or it was saved for another key"""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get('key') != key:
+            return False
+        self.units = {unit_key: dict(unit, includes=set(unit['includes'])) for unit_key, unit in saved['units'].items()}
+        self.file_units = saved['file_units']
+        self.file_starts = saved['file_starts']
+        self.build_components()
+        return True
+
+    def external_includes(self, tu):
+        """The #include spelling, in a repo file, through which each file outside the repo got into the TU"""
+        parents = {}
+        spellings = {}
+        for inclusion in tu.get_includes():
+            source, include = os.path.abspath(inclusion.source.name), os.path.abspath(inclusion.include.name)
+            if self.in_repo(include):
+                continue
+            if self.in_repo(source):
+                line = self.get_source(source).lines(inclusion.location.line - 1, inclusion.location.line)
+                match = re.search(r'#\s*include\s*([<"][^>"]+[>"])', line)
+                if match:
+                    spellings.setdefault(include, match.group(1))
+            else:
+                parents.setdefault(include, source)
+
+        def spelling_of(filename):
+            seen = set()
+            while filename not in spellings and filename in parents and filename not in seen:
+                seen.add(filename)
+                filename = parents[filename]
+            return spellings.get(filename)
+        return spelling_of
+
+    def index_tu(self, tu):
+        """Add the units of a TU's repo files that aren't indexed yet, with their direct dependencies"""
+        spelling_of = self.external_includes(tu)
+        new_files = set()
+        cursors = []
+        macro_uses = []
+        # Macros defined in this TU, by name; the last definition wins, as in the preprocessor
+        macros = {}
+
+        for node in tu.cursor.get_children():
+            location_file = node.location.file
+            if location_file is None:
+                continue
+            # Headers reached through ../ are spelled differently from TU to TU
+            filename = os.path.abspath(location_file.name)
+            if node.kind == clang.cindex.CursorKind.MACRO_INSTANTIATION:
+                macro_uses.append((filename, node.location.line, node))
+                continue
+            if node.kind not in UNIT_KINDS:
+                continue
+            if node.kind == clang.cindex.CursorKind.MACRO_DEFINITION:
+                macros[node.spelling] = (filename, node.location.line)
+            if filename not in new_files:
+                # Headers are shared between TUs; the first TU to include one indexes it
+                if filename in self.file_units or not self.in_repo(filename):
+                    continue
+                new_files.add(filename)
+                self.file_units[filename] = []
+                self.file_starts[filename] = []
+            cursors.append((filename, node))
+
+        # Cursors that share lines (typedef struct {...} name; int a, b;) become one unit
+        new_units = []
+        cursors.sort(key=lambda item: (item[0], item[1].extent.start.line, item[1].extent.end.line))
+        for filename, node in cursors:
+            start_line, end_line = node.extent.start.line, node.extent.end.line
+            units = self.file_units[filename]
+            if units and self.units[units[-1]]['end_line'] >= start_line:
+                unit = self.units[units[-1]]
+                unit['end_line'] = max(unit['end_line'], end_line)
+                unit['cursors'].append(node)
+                continue
+            unit_key = self.unit_key(filename, start_line)
+            self.units[unit_key] = {'file': filename, 'start_line': start_line, 'end_line': end_line, 'cursors': [node]}
+            units.append(unit_key)
+            self.file_starts[filename].append(start_line)
+            new_units.append(unit_key)
+
+        for unit_key in new_units:
+            self.finish_unit(unit_key, spelling_of, macros)
+        for filename, line, node in macro_uses:
+            if filename in new_files:
+                self.add_macro_use(filename, line, node, spelling_of)
+
+    def finish_unit(self, unit_key, spelling_of, macros):
+        """Work out a new unit's kind, names, prototype and direct dependencies, then drop its cursors"""
+        unit = self.units[unit_key]
+        cursors = unit.pop('cursors')
+        unit['names'] = [node.spelling for node in cursors if node.spelling]
+        unit['deps'] = set()
+        unit['includes'] = set()
+        unit['prototype'] = None
+
+        kinds = {node.kind for node in cursors}
+        definitions = [node for node in cursors if node.kind == clang.cindex.CursorKind.FUNCTION_DECL and node.is_definition()]
+        if definitions:
+            unit['kind'] = 'function'
+            if len(definitions) == 1:
+                unit['prototype'] = self.prototype(definitions[0])
+        elif kinds == {clang.cindex.CursorKind.MACRO_DEFINITION}:
+            unit['kind'] = 'macro'
+        else:
+            unit['kind'] = 'declaration'
+
+        for node in cursors:
+            if node.kind == clang.cindex.CursorKind.MACRO_DEFINITION:
+                # Macro bodies are only expanded where they are used; look for other macros by name
+                for token in list(node.get_tokens())[1:]:
+                    if token.kind == clang.cindex.TokenKind.IDENTIFIER and token.spelling in macros:
+                        self.add_dep(unit_key, self.location_dep(*macros[token.spelling], spelling_of))
+                continue
+            if node.is_definition() and node.kind != clang.cindex.CursorKind.TYPEDEF_DECL:
+                self.definitions[node.get_usr()] = unit_key
+            for child in node.walk_preorder():
+                if child.kind in REFERENCE_KINDS:
+                    referenced = child.referenced
+                    if referenced is not None:
+                        self.add_reference(unit_key, referenced, spelling_of)
+                elif child.kind in TYPE_KINDS and not child.is_definition():
+                    # typedef struct foo foo_t; names struct foo without a TYPE_REF
+                    self.add_reference(unit_key, child, spelling_of)
+
+    def add_reference(self, unit_key, referenced, spelling_of):
+        kind = referenced.kind
+        if kind in (clang.cindex.CursorKind.FIELD_DECL, clang.cindex.CursorKind.ENUM_CONSTANT_DECL):
+            # A member or enum constant needs the record or enum it belongs to
+            referenced = referenced.semantic_parent
+            kind = referenced.kind
+        if kind in (clang.cindex.CursorKind.FUNCTION_DECL, clang.cindex.CursorKind.VAR_DECL):
+            if referenced.semantic_parent.kind != clang.cindex.CursorKind.TRANSLATION_UNIT:
+                return  # locals and parameters
+        elif kind not in TYPE_KINDS:
+            return
+
+        definition = referenced.get_definition()
+        if definition is None and kind != clang.cindex.CursorKind.TYPEDEF_DECL:
+            # Defined in another file, or not in the TU that indexed this header (a struct only
+            # defined in an internal header): resolved by USR once the whole repo is indexed
+            self.units[unit_key]['deps'].add(('usr', referenced.get_usr(), self.declaration_dep(referenced, spelling_of)))
+            return
+        self.add_dep(unit_key, self.declaration_dep(definition or referenced, spelling_of))
+
+    def add_dep(self, unit_key, dep):
+        if isinstance(dep, tuple):
+            self.units[unit_key]['includes'].add(dep[1])
+        elif dep is not None and dep != unit_key:
+            self.units[unit_key]['deps'].add(dep)
+
+    def location_dep(self, filename, line, spelling_of):
+        """The unit at a location, ('include', spelling) for a location outside the repo, or None"""
+        if self.in_repo(filename):
+            return self.find_unit(filename, line)
+        spelling = spelling_of(filename)
+        return ('include', spelling) if spelling else None
+
+    def declaration_dep(self, cursor, spelling_of):
+        location_file = cursor.location.file
+        if location_file is None:
+            return None
+        return self.location_dep(os.path.abspath(location_file.name), cursor.location.line, spelling_of)
+
+    def add_macro_use(self, filename, line, node, spelling_of):
+        unit_key = self.find_unit(filename, line)
+        definition = node.referenced
+        if unit_key is not None and definition is not None:
+            self.add_dep(unit_key, self.declaration_dep(definition, spelling_of))
+
+    def prototype(self, cursor):
+        """Declaration of a function definition: its text up to the body"""
+        body = next((c for c in cursor.get_children() if c.kind == clang.cindex.CursorKind.COMPOUND_STMT), None)
+        if body is None:
+            return None
+        source = self.get_source(cursor.location.file.name)
+        start = source.line_offsets[cursor.extent.start.line - 1] + cursor.extent.start.column - 1
+        end = source.line_offsets[body.extent.start.line - 1] + body.extent.start.column - 1
+        return ' '.join(source.content[start:end].split()) + ';'
+
+    def unit_text(self, unit_key):
+        unit = self.units[unit_key]
+        return balance_unit_text(self.get_source(unit['file']).lines(unit['start_line'] - 1, unit['end_line']))
+
+    def finish(self):
+        """Resolve cross-file references by USR and split the unit graph into strongly connected components"""
+        for unit_key, unit in self.units.items():
+            deps = set()
+            for dep in unit['deps']:
+                if isinstance(dep, tuple):
+                    _, usr, fallback = dep
+                    dep = self.definitions.get(usr, fallback)
+                    if isinstance(dep, tuple):
+                        unit['includes'].add(dep[1])
+                        continue
+                if dep is not None and dep != unit_key:
+                    deps.add(dep)
+            unit['deps'] = sorted(deps)
+        self.build_components()
+
+    def build_components(self):
+        """Split the resolved unit graph into strongly connected components, and link those"""
+        self._sccs = self.strongly_connected_components()
+        self._members = {}
+        for unit_key in sorted(self.units, key=lambda key: (self.units[key]['file'], self.units[key]['start_line'])):
+            self._members.setdefault(self._sccs[unit_key], []).append(unit_key)
+        # Components each component depends on, in the order its members reference them
+        self._component_deps = {}
+        for root, members in self._members.items():
+            deps = {}
+            for member in members:
+                for dep in self.units[member]['deps']:
+                    if self._sccs[dep] != root:
+                        deps[self._sccs[dep]] = None
+            self._component_deps[root] = list(deps)
+        self._closures = {}
+
+    def strongly_connected_components(self):
+        """Map each unit to the id of its strongly connected component (iterative Tarjan)"""
+        index, lowlink, on_stack, component = {}, {}, set(), {}
+        stack = []
+        counter = 0
+        for root in self.units:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                unit_key, i = work.pop()
+                if i == 0:
+                    index[unit_key] = lowlink[unit_key] = counter
+                    counter += 1
+                    stack.append(unit_key)
+                    on_stack.add(unit_key)
+                deps = self.units[unit_key]['deps']
+                while i < len(deps):
+                    dep = deps[i]
+                    if dep not in index:
+                        work.append((unit_key, i + 1))
+                        work.append((dep, 0))
+                        break
+                    if dep in on_stack:
+                        lowlink[unit_key] = min(lowlink[unit_key], index[dep])
+                    i += 1
+                else:
+                    if lowlink[unit_key] == index[unit_key]:
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component[member] = unit_key
+                            if member == unit_key:
+                                break
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[unit_key])
+        return component
+
+    def closure(self, unit_key):
+        """
+        (units in dependency order, external includes) a unit needs, memoized per component.
+        Components are visited depth first with an explicit stack, so a long chain of calls
+        can't exhaust Python's recursion limit; each one's members go after everything they need.
+        """
+        root = self._sccs[unit_key]
+        if root in self._closures:
+            return self._closures[root]
+
+        order, includes = [], set()
+        visited = {root}
+        work = [(root, iter(self._component_deps[root]))]
+        while work:
+            component, deps = work[-1]
+            dep = next(deps, None)
+            if dep is None:
+                work.pop()
+                # Members of a component are kept in source order
+                for member in self._members[component]:
+                    order.append(member)
+                    includes |= self.units[member]['includes']
+            elif dep not in visited:
+                visited.add(dep)
+                work.append((dep, iter(self._component_deps[dep])))
+
+        self._closures[root] = (order, includes)
+        return self._closures[root]
+
+    def slice_function(self, file_path, start_line):
+        """Self-contained source of the function defined at file_path:start_line, or None if it isn't indexed"""
+        unit_key = self.find_unit(os.path.abspath(file_path), start_line)
+        if unit_key is None:
+            return None
+
+        order, includes = self.closure(unit_key)
+        # The function under test goes last, after everything it needs
+        order = [key for key in order if key != unit_key and 'main' not in self.units[key]['names']] + [unit_key]
+        # A macro in one file can stand for a function defined in another (#define FSE_isError ERR_isError);
+        # when the function is in the slice it does the macro's job
+        defined = {name for key in order if self.units[key]['kind'] != 'macro' for name in self.units[key]['names']}
+        macros = [key for key in order if self.units[key]['kind'] == 'macro' and not defined & set(self.units[key]['names'])]
+        declarations = [key for key in order if self.units[key]['kind'] == 'declaration']
+        functions = [key for key in order if self.units[key]['kind'] == 'function']
+
+        parts = [f'#include {include}' for include in sorted(includes)]
+        parts += [self.unit_text(key) for key in macros + declarations]
+        # Prototypes first, so mutually recursive callees compile in any order
+        parts += [self.units[key]['prototype'] for key in functions if self.units[key]['prototype']]
+        parts += [self.unit_text(key) for key in functions]
+        return {
+            'code': '\n'.join(parts) + '\n',
+            'includes': sorted(includes),
+            'units': order,
+        }
+
+    def slice_record(self, func):
+        """Slice of an extracted function record"""
+        return self.slice_function(func['file_path'], func['start_line'])
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python dependency_slicer.py <repo_path> <function_name>")
+        sys.exit(1)
+
+    repo_path, function_name = sys.argv[1:]
+    slicer = DependencySlicer(repo_path).index_repo()
+    for unit_key, unit in slicer.units.items():
+        if unit['kind'] == 'function' and function_name in unit['names']:
+            res = slicer.slice_function(unit['file'], unit['start_line'])
+            print(f"// {unit_key}: {len(res['units'])} units, {len(res['includes'])} external includes")
+            print(res['code'])
+            return
+    print(f"No definition of {function_name} found in {repo_path}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
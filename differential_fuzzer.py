@@ -0,0 +1,392 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import tempfile
+import subprocess
+from jsonl_store import load_records
+from harness_build import split_harness, replace_function, function_prototype, isolate_function
+from harness_table import (QUALIFIERS, SIGNED_VALUES, UNSIGNED_VALUES, FLOAT_VALUES, RANDOM_INT_BITS,
+                           type_kind, split_params, member_declaration)
+
+'''
+Differential fuzzing of a generated function against the original.
+
+The original and the candidate are each compiled with the function's context, and every symbol
+they define except the function itself is made local. The function is renamed to
+fuzz_original in one and to fuzz_candidate in the other (see isolate_function), so both can be
+linked into one fuzz target, each with its own globals and helpers. The target's driver draws
+inputs in process from a fast PRNG, from the same type-aware ranges as the harness's test
+cases. It calls both functions on every input and compares their results, until one differs,
+the candidate crashes or the time budget runs out.
+
+A diverging input is shrunk towards zero one argument at a time, replaying each smaller input
+in a fresh process, until no smaller one diverges. The result can be added to the function's
+test cases, so later candidates are tested on it too.
+
+Usage:
+python differential_fuzzer.py <functions_file> <tests_file> <function_name> <candidate.c> [budget_seconds]
+'''
+
+ORIGINAL_NAME = 'fuzz_original'
+CANDIDATE_NAME = 'fuzz_candidate'
+# Seconds a fuzz target may run past its budget before it is killed
+GRACE_SECONDS = 5
+
+def strip_qualifiers(type_text):
+    return ' '.join(w for w in type_text.split(' ') if w not in QUALIFIERS)
+
+def renamed_prototype(prototype, name, new_name):
+    """A function's declaration (see function_prototype) under a new name, without storage class specifiers"""
+    prototype = re.sub(rf'\b{re.escape(name)}\s*\(', f'{new_name}(', prototype, count=1)
+    return ' '.join(w for w in prototype.split(' ') if w not in ('static', 'inline', '__inline', '__inline__'))
+
+def value_source(kind, j):
+    """C statement drawing a random value for parameter j, or None for kinds left zero"""
+    if kind[0] == 'int':
+        _, bits, signed = kind
+        if bits == 1:
+            return f'in->a{j} = fuzz_next() & 1;'
+        low, high = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+        span = 1 << RANDOM_INT_BITS
+        random_low, random_high = max(low, -span // 2 if signed else 0), min(high, span // 2 if signed else span)
+        fixed = [v for v in (SIGNED_VALUES if signed else UNSIGNED_VALUES) if low <= v <= high]
+        return (f'{{ static const long long fixed[] = {{{", ".join(map(str, fixed))}}}; '
+                f'in->a{j} = fuzz_int({random_low}LL, {random_high}LL, fixed, {len(fixed)}); }}')
+    if kind[0] == 'float':
+        return f'in->a{j} = fuzz_float();'
+    return None
+
+def compare_source(return_kind):
+    """C expression telling whether results r0 and r1 of the two functions match, as the harness prints them"""
+    if return_kind[0] == 'void':
+        return '1'
+    if return_kind[0] == 'float':
+        return '(r0 == r1 || (r0 != r0 && r1 != r1))'
+    if return_kind[0] == 'pointer':
+        # The harness only prints whether there is an address
+        return '(!r0 == !r1)'
+    if return_kind[0] == 'int':
+        return '(r0 == r1)'
+    return '(memcmp(&r0, &r1, sizeof r0) == 0)'
+
+def render_fuzz_driver(code, function_info, prototype):
+    """
+    Source of the fuzz target's driver: the function's context (for its types), declarations of
+    both renamed copies (from the function's prototype), and a main that either fuzzes for a
+    time budget or replays one input
+    """
+    name = function_info['function_name']
+    return_type, params = split_params(function_info['signature'], name)
+    kinds = [type_kind(p) for p in params]
+    return_kind = type_kind(return_type)
+    return_type = strip_qualifiers(return_type)
+
+    members = [f'    {member_declaration(strip_qualifiers(p), f"a{j}")};' for j, p in enumerate(params)]
+    draws = [value_source(kind, j) for j, kind in enumerate(kinds)]
+    parses, formats, values = [], [], []
+    for j, kind in enumerate(kinds):
+        if kind[0] == 'int':
+            parses.append(f'in->a{j} = strtoll(argv[{j + 3}], NULL, 10);')
+            formats.append('%lld')
+            values.append(f'(long long)in->a{j}')
+        elif kind[0] == 'float':
+            parses.append(f'in->a{j} = strtod(argv[{j + 3}], NULL);')
+            formats.append('%.17g')
+            values.append(f'(double)in->a{j}')
+        else:
+            formats.append('0')
+    args = ', '.join(f'in->a{j}' for j in range(len(params)))
+    if return_kind[0] == 'void':
+        calls = f'fuzz_side = 0; {ORIGINAL_NAME}({args}); fuzz_side = 1; {CANDIDATE_NAME}({args});'
+    else:
+        calls = (f'fuzz_side = 0; {return_type} r0 = {ORIGINAL_NAME}({args}); '
+                 f'fuzz_side = 1; {return_type} r1 = {CANDIDATE_NAME}({args});')
+    input_format = ' '.join(formats)
+    input_values = ''.join(', ' + v for v in values)
+
+    return f"""{code}
+
+// Fuzz target driver: {ORIGINAL_NAME} and {CANDIDATE_NAME} are the two renamed copies of {name}
+#include <signal.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <fcntl.h>
+
+{renamed_prototype(prototype, name, ORIGINAL_NAME)}
+{renamed_prototype(prototype, name, CANDIDATE_NAME)}
+
+struct fuzz_input {{
+{chr(10).join(members) or '    char unused;'}
+}};
+
+static struct fuzz_input fuzz_current;
+static volatile sig_atomic_t fuzz_side = -1;
+static unsigned long long fuzz_execs;
+static int fuzz_report = -1;
+static uint64_t fuzz_state;
+static const double fuzz_fixed_floats[] = {{{', '.join(repr(v) for v in FLOAT_VALUES)}}};
+
+static uint64_t fuzz_next(void) {{
+    uint64_t z = (fuzz_state += 0x9E3779B97F4A7C15ull);
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ull;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBull;
+    return z ^ (z >> 31);
+}}
+
+static long long fuzz_int(long long low, long long high, const long long *fixed, size_t num_fixed) {{
+    uint64_t r = fuzz_next();
+    if ((r & 3) == 0 && num_fixed)
+        return fixed[(r >> 2) % num_fixed];
+    return low + (long long)((r >> 2) % (uint64_t)(high - low + 1));
+}}
+
+static double fuzz_float(void) {{
+    uint64_t r = fuzz_next();
+    if ((r & 3) == 0)
+        return fuzz_fixed_floats[(r >> 2) % (sizeof fuzz_fixed_floats / sizeof fuzz_fixed_floats[0])];
+    return -1e4 + (double)(r >> 11) * (2e4 / 9007199254740992.0);
+}}
+
+static long long fuzz_now_ns(void) {{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}}
+
+// Writes "<status> <executions> <inputs...>" to the report file
+static void fuzz_write_report(const char *status) {{
+    const struct fuzz_input *in = &fuzz_current;
+    char line[4096];
+    int length = snprintf(line, sizeof line, "%s %llu {input_format}\\n", status, fuzz_execs{input_values});
+    if (length > (int)sizeof line - 1)
+        length = sizeof line - 1;
+    write(fuzz_report, line, length);
+}}
+
+static void fuzz_crashed(int sig) {{
+    (void)sig;
+    fuzz_write_report(fuzz_side == 0 ? "original_crashed" : "candidate_crashed");
+    _exit(2);
+}}
+
+static void fuzz_draw(struct fuzz_input *in) {{
+    {(chr(10) + '    ').join(d for d in draws if d) or '(void)in;'}
+}}
+
+static int fuzz_check(const struct fuzz_input *in) {{
+    {calls}
+    fuzz_side = -1;
+    return {compare_source(return_kind)};
+}}
+
+// fuzz <report file> <budget ms> <seed> | replay <report file> <inputs...>
+int main(int argc, char **argv) {{
+    if (argc < 3)
+        return 3;
+    fuzz_report = open(argv[2], O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (fuzz_report < 0)
+        return 3;
+    int signals[] = {{SIGSEGV, SIGBUS, SIGFPE, SIGILL, SIGABRT}};
+    for (size_t i = 0; i < sizeof signals / sizeof signals[0]; i++)
+        signal(signals[i], fuzz_crashed);
+
+    struct fuzz_input *in = &fuzz_current;
+    if (strcmp(argv[1], "replay") == 0) {{
+        if (argc < 3 + {len(params)})
+            return 3;
+        {' '.join(parses)}
+        fuzz_execs = 1;
+        int same = fuzz_check(in);
+        fuzz_write_report(same ? "same" : "diverged");
+        return !same;
+    }}
+
+    if (argc < 5)
+        return 3;
+    long long deadline = fuzz_now_ns() + strtoll(argv[3], NULL, 10) * 1000000LL;
+    fuzz_state = strtoull(argv[4], NULL, 10);
+    for (;;) {{
+        // The clock is read every 16 inputs, to keep its cost out of the loop
+        if ((fuzz_execs & 15) == 0 && fuzz_now_ns() >= deadline)
+            break;
+        fuzz_draw(in);
+        fuzz_execs++;
+        if (!fuzz_check(in)) {{
+            fuzz_write_report("diverged");
+            return 1;
+        }}
+    }}
+    fuzz_write_report("same");
+    return 0;
+}}
+"""
+
+def shrink_steps(kind, value):
+    """Smaller values to try in place of one argument of a diverging input, most promising first"""
+    if kind[0] == 'int':
+        steps = [0, 1] + ([-1] if kind[2] else []) + [int(value / 2), value - 1 if value > 0 else value + 1]
+    elif kind[0] == 'float':
+        steps = [0.0, 1.0, float(int(value)), value / 2]
+    else:
+        return []
+    seen = []
+    for step in steps:
+        if abs(step) < abs(value) and step not in seen:
+            seen.append(step)
+    return seen
+
+class DifferentialFuzzer:
+    def __init__(self, compiler='gcc', flags=('-O0', '-w'), budget=1.0, seed=0, max_replays=200, build_dir=None):
+        self.compiler = compiler
+        # Same flags as the harnesses, so a divergence found here shows up in a harness too
+        self.flags = list(flags)
+        # Seconds of fuzzing per candidate
+        self.budget = budget
+        self.seed = seed
+        # Replays spent shrinking one diverging input
+        self.max_replays = max_replays
+        # Where fuzz targets are built, the system's temporary directory if None
+        self.build_dir = build_dir
+
+    def _build_path(self, suffix):
+        return os.path.join(self.build_dir or tempfile.gettempdir(), uuid.uuid4().hex + suffix)
+
+    def _compile_object(self, source, object_file):
+        return subprocess.run([self.compiler] + self.flags + ['-c', '-x', 'c', '-', '-o', object_file],
+                              input=source, capture_output=True, text=True)
+
+    def build(self, harness, function_info, original_source, generated_source):
+        """
+        Fuzz target linking the original and the candidate. Returns (path, error); path is None
+        if the build failed.
+        """
+        name = function_info['function_name']
+        prototype = function_prototype(original_source, function_info.get('body_offset'))
+        if prototype is None:
+            return None, f"No body was recorded for {name}, so its copies can't be declared"
+        code = split_harness(harness)
+        objects = [self._build_path('.o') for _ in range(3)]
+        executable = self._build_path('.fuzz')
+        try:
+            for source, object_file, new_name in ((code, objects[0], ORIGINAL_NAME),
+                                                  (replace_function(code, original_source, generated_source), objects[1], CANDIDATE_NAME)):
+                result = self._compile_object(source, object_file)
+                if result.returncode == 0:
+                    result = isolate_function(object_file, name, new_name)
+                if result.returncode != 0:
+                    return None, result.stderr
+            result = self._compile_object(render_fuzz_driver(code, function_info, prototype), objects[2])
+            if result.returncode == 0:
+                # The driver's copy of the context (and of the function) stays out of the way too
+                result = subprocess.run(['objcopy', '--keep-global-symbol=main', objects[2]], capture_output=True, text=True)
+            if result.returncode == 0:
+                result = subprocess.run([self.compiler] + objects + ['-o', executable], capture_output=True, text=True)
+            if result.returncode != 0:
+                return None, result.stderr
+            return executable, None
+        finally:
+            for path in objects:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def run(self, executable, mode, args, timeout):
+        """Status, number of executions and last input reported by one run of a fuzz target"""
+        report = self._build_path('.report')
+        try:
+            subprocess.run([executable, mode, report] + [str(a) for a in args], stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+            with open(report) as f:
+                fields = f.read().split()
+        except subprocess.TimeoutExpired:
+            return 'timeout', 0, []
+        except OSError:
+            return 'error', 0, []
+        finally:
+            if os.path.exists(report):
+                os.unlink(report)
+        if len(fields) < 2:
+            # The function exited the process, or the report couldn't be written
+            return 'error', 0, []
+        return fields[0], int(fields[1]), fields[2:]
+
+    def diverges(self, executable, inputs):
+        status, _, _ = self.run(executable, 'replay', inputs, timeout=GRACE_SECONDS)
+        return status in ('diverged', 'candidate_crashed')
+
+    def shrink(self, executable, kinds, inputs):
+        """A diverging input with its arguments made as small as possible, and whether it diverges on its own"""
+        if not self.diverges(executable, inputs):
+            # The divergence depends on state left by earlier inputs
+            return inputs, False
+        replays = 0
+        improved = True
+        while improved and replays < self.max_replays:
+            improved = False
+            for j, kind in enumerate(kinds):
+                for step in shrink_steps(kind, inputs[j]):
+                    trial = inputs[:j] + [step] + inputs[j + 1:]
+                    replays += 1
+                    if self.diverges(executable, trial):
+                        inputs = trial
+                        improved = True
+                        break
+        return inputs, True
+
+    def fuzz(self, harness, function_info, original_source, generated_source):
+        """
+        Fuzz a candidate against the original for the time budget. Returns a dict with the
+        status ('same', 'diverged', 'original_crashed', 'timeout' or 'error'), the number of
+        inputs tried and their rate, and for a divergence the shrunk input as a 'reproducer'
+        test case.
+        """
+        executable, error = self.build(harness, function_info, original_source, generated_source)
+        if executable is None:
+            return {'status': 'error', 'error': f"Fuzz target failed to build: {error}"}
+        try:
+            start = time.perf_counter()
+            status, executions, values = self.run(executable, 'fuzz', [int(self.budget * 1000), self.seed],
+                                                  timeout=self.budget + GRACE_SECONDS)
+            seconds = time.perf_counter() - start
+            result = {
+                'status': 'diverged' if status == 'candidate_crashed' else status,
+                'executions': executions,
+                'seconds': seconds,
+                'executions_per_second': executions / seconds if seconds else 0.0,
+            }
+            if result['status'] == 'diverged':
+                _, params = split_params(function_info['signature'], function_info['function_name'])
+                kinds = [type_kind(p) for p in params]
+                inputs = [(int(v) if kind[0] == 'int' else float(v) if kind[0] == 'float' else 0)
+                          for v, kind in zip(values, kinds)]
+                inputs, reproducible = self.shrink(executable, kinds, inputs)
+                result['reason'] = 'candidate crashed' if status == 'candidate_crashed' else 'results differ'
+                result['reproducer'] = {'inputs': inputs, 'expected_output': None, 'source': 'fuzz'}
+                # False if the input only diverges after the inputs tried before it
+                result['reproducible'] = reproducible
+            return result
+        finally:
+            os.unlink(executable)
+
+def main():
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python differential_fuzzer.py <functions_file> <tests_file> <function_name> <candidate.c> [budget_seconds]")
+        sys.exit(1)
+
+    functions_file, tests_file, function_name, candidate_file = sys.argv[1:5]
+    function_info = next(f for f in load_records(functions_file) if f['function_name'] == function_name)
+    test_info = next(t for t in load_records(tests_file) if t['function_name'] == function_name)
+    with open(candidate_file) as f:
+        candidate_source = f.read().strip()
+
+    fuzzer = DifferentialFuzzer(budget=float(sys.argv[5]) if len(sys.argv) == 6 else 1.0)
+    result = fuzzer.fuzz(test_info['harness'], function_info, function_info['source'], candidate_source)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import math
+import random
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from paths import REPOS_DIR, CORPUS_OUTPUT_DIR, EXTRACTION_CACHE_PATH
+from generate_self_equiv_tests import CFunctionExtractor, SelfEquivalenceTester, ENGINES, find_compilation_database
+from jsonl_store import StreamCheckpoint
+from dependency_slicer import DependencySlicer
+
+'''
+Extract functions from a whole corpus of repos instead of a single one.
+
+Every repo gets the same quota of functions, and no file contributes more than a few of them,
+so big repos don't drown out small ones. Each repo's files are shuffled with a fixed seed
+before extraction, so the sample comes from all over its tree rather than from whatever
+directory rglob happens to list first. Functions and test harnesses are written to one shard
+per repo (CORPUS_OUTPUT_DIR/<repo_id>/functions.jsonl and tests.jsonl), each with its own
+checkpoint, so an interrupted run picks up where it stopped.
+
+Files from several repos are interleaved round-robin over a pool of worker processes. A
+repo's shard only depends on its own files, the seed and the quotas, not on the number of
+workers or the other repos in the run.
+
+Usage:
+python extract_corpus.py [repos_dir | repo_list.json] [--per-repo N] [--per-file N] [--workers N] [--slice]
+'''
+
+def repo_id_from_url(url):
+    """Directory name clone_repos.py clones a GitHub URL into"""
+    author, name = url.rstrip('/').split('/')[-2:]
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    return f"{author}___{name}"
+
+def list_repos(source=REPOS_DIR):
+    """Repo paths from a repo list JSON of GitHub URLs, or every directory in a repos directory"""
+    if str(source).endswith('.json'):
+        with open(source) as f:
+            urls = json.load(f)
+        repos = []
+        for url in urls:
+            repo_path = os.path.join(REPOS_DIR, repo_id_from_url(url))
+            if os.path.isdir(repo_path):
+                repos.append(repo_path)
+            else:
+                print(f"Skipping {url}, not cloned to {repo_path}")
+        return repos
+    return [os.path.join(source, name) for name in sorted(os.listdir(source))
+            if os.path.isdir(os.path.join(source, name))]
+
+class RepoShard:
+    """Extraction state of one repo: the files still to submit and the shard its functions go to"""
+    def __init__(self, repo_path, files, checkpoint):
+        self.repo_path = repo_path
+        self.repo_id = os.path.basename(os.path.normpath(repo_path))
+        self.files = deque(files)
+        self.checkpoint = checkpoint
+        self.count = checkpoint.counters.get('functions', 0)
+        self.files_scanned = checkpoint.counters.get('files_scanned', 0)
+        self.in_flight = 0
+        self.active = True
+        self.slicer = None
+
+class CorpusScheduler:
+    def __init__(self, extractor, output_dir=CORPUS_OUTPUT_DIR, per_repo=50, per_file=3, seed=0, workers=1,
+                 slice_dependencies=False):
+        self.extractor = extractor
+        # Cut each function out with its dependencies (see dependency_slicer.py)
+        self.slice_dependencies = slice_dependencies
+        self.tester = SelfEquivalenceTester()
+        self.output_dir = output_dir
+        self.per_repo = per_repo
+        self.per_file = per_file
+        self.seed = seed
+        self.workers = workers
+        # Enough repos in rotation to keep every worker busy, without an open shard per repo in the corpus
+        self.max_active = max(2, 2 * workers)
+        self.window = 2 * workers
+        self.summary = {}
+
+    def sample_files(self, repo_path):
+        """A repo's .c files in a seeded random order, as paths relative to the repo"""
+        files = [os.path.relpath(c_file, repo_path) for c_file in self.extractor.find_source_files(repo_path)]
+        random.Random(f'{self.seed}:{os.path.basename(os.path.normpath(repo_path))}').shuffle(files)
+        return files
+
+    def sample_functions(self, rel_path, records):
+        """At most per_file of a file's testable functions, picked with a seeded RNG and kept in source order"""
+        if len(records) <= self.per_file:
+            return records
+        picked = random.Random(f'{self.seed}:{rel_path}').sample(range(len(records)), self.per_file)
+        return [records[i] for i in sorted(picked)]
+
+    def open_shard(self, repo_path):
+        """Start (or resume) a repo's shard; None if an earlier run already finished it"""
+        repo_id = os.path.basename(os.path.normpath(repo_path))
+        checkpoint = StreamCheckpoint(os.path.join(self.output_dir, repo_id),
+                                      {'functions': 'functions.jsonl', 'tests': 'tests.jsonl'})
+        if checkpoint.is_done('repos', repo_id):
+            print(f"Skipping {repo_id}, already extracted")
+            self.summary[repo_id] = {'functions': checkpoint.counters.get('functions', 0),
+                                     'files_scanned': checkpoint.counters.get('files_scanned', 0)}
+            checkpoint.close()
+            return None
+
+        done = checkpoint.done.get('files', set())
+        files = [rel for rel in self.sample_files(repo_path) if rel not in done]
+        shard = RepoShard(repo_path, files, checkpoint)
+        if self.slice_dependencies:
+            shard.slicer = DependencySlicer(repo_path, self.extractor).index_repo()
+        return shard
+
+    def finish_shard(self, shard):
+        shard.checkpoint.mark_done('repos', shard.repo_id)
+        shard.checkpoint.close()
+        self.summary[shard.repo_id] = {'functions': shard.count, 'files_scanned': shard.files_scanned}
+        print(f"Finished {shard.repo_id}: {shard.count} functions from {shard.files_scanned} files")
+
+    def next_task(self, pending, active):
+        """The next (shard, file) to extract, taking turns between the active repos"""
+        while True:
+            while len(active) < self.max_active and pending:
+                shard = self.open_shard(pending.popleft())
+                if shard is not None:
+                    active.append(shard)
+            if not active:
+                return None
+
+            shard = active.popleft()
+            if shard.files and shard.count < self.per_repo:
+                active.append(shard)
+                return shard, shard.files.popleft()
+
+            # Out of files or quota: the repo leaves the rotation and is finished once its last files are in
+            shard.active = False
+            if shard.in_flight == 0:
+                self.finish_shard(shard)
+
+    def accept(self, shard, rel_path, records):
+        """Write a file's sampled functions to its repo's shard, up to the repo's quota"""
+        shard.in_flight -= 1
+        # Files submitted before the quota filled up are dropped, so the shard doesn't depend on timing
+        if shard.count < self.per_repo:
+            shard.files_scanned += 1
+            for func in self.sample_functions(rel_path, records)[:self.per_repo - shard.count]:
+                sliced = shard.slicer.slice_record(func) if shard.slicer is not None else None
+                if sliced is not None:
+                    func['slice'] = sliced['code']
+                test_cases = self.tester.generate_test_cases(func)
+                shard.checkpoint.write('functions', func)
+                shard.checkpoint.write('tests', {
+                    'function_name': func['function_name'],
+                    'test_cases': test_cases,
+                    'harness': self.tester.create_test_harness(func, test_cases)
+                })
+                shard.count += 1
+            shard.checkpoint.counters.update(functions=shard.count, files_scanned=shard.files_scanned)
+            shard.checkpoint.mark_done('files', rel_path)
+
+        if not shard.active and shard.in_flight == 0:
+            self.finish_shard(shard)
+
+    def run(self, repos):
+        """Extract every repo's quota of functions into its shard and return a per-repo summary"""
+        pending = deque(repos)
+        active = deque()
+        in_flight = deque()
+
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_corpus_worker,
+                                       initargs=(self.extractor.worker_settings(),))
+        try:
+            while True:
+                while len(in_flight) < self.window:
+                    task = self.next_task(pending, active)
+                    if task is None:
+                        break
+                    shard, rel_path = task
+                    shard.in_flight += 1
+                    if pool is not None:
+                        future = pool.submit(_extract_records_in_worker, shard.repo_path, rel_path)
+                    else:
+                        future = Future()
+                        future.set_result(extract_repo_file(self.extractor, shard.repo_path, rel_path))
+                    in_flight.append((shard, rel_path, future))
+
+                if not in_flight:
+                    break
+                # Results are taken in submission order, so each repo sees its files in its sampled order
+                shard, rel_path, future = in_flight.popleft()
+                self.accept(shard, rel_path, future.result())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        self.write_manifest()
+        return self.summary
+
+    def write_manifest(self):
+        manifest = {
+            'per_repo': self.per_repo,
+            'per_file': self.per_file,
+            'seed': self.seed,
+            'repos': self.summary,
+        }
+        with open(os.path.join(self.output_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+def extract_repo_file(extractor, repo_path, rel_path):
+    """All testable functions of one file of a repo, with that repo's compilation database"""
+    db_dir = find_compilation_database(repo_path)
+    if extractor.compile_db_dir != db_dir:
+        extractor.use_compilation_database(db_dir)
+    c_file = os.path.join(repo_path, rel_path)
+    try:
+        print(f"Processing {c_file}")
+        return extractor.extract_file_records(c_file)
+    except Exception as e:
+        print(f"Error processing {c_file}: {e}")
+        return []
+
+_corpus_extractor = None
+
+def _init_corpus_worker(settings):
+    global _corpus_extractor
+    _corpus_extractor = CFunctionExtractor(**settings)
+
+def _extract_records_in_worker(repo_path, rel_path):
+    return extract_repo_file(_corpus_extractor, repo_path, rel_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a balanced sample of functions from every repo in a corpus")
+    parser.add_argument('source', nargs='?', default=REPOS_DIR, help="repos directory or repo list JSON")
+    parser.add_argument('--per-repo', type=int, default=50, help="functions to take from each repo")
+    parser.add_argument('--per-file', type=int, default=3, help="functions to take from each file")
+    parser.add_argument('--total', type=int, help="overall number of functions, split evenly between repos (overrides --per-repo)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--engine', choices=ENGINES, default='libclang')
+    parser.add_argument('--output-dir', default=CORPUS_OUTPUT_DIR)
+    parser.add_argument('--slice', action='store_true', help="add a self-contained dependency slice to each function (libclang only)")
+    args = parser.parse_args()
+
+    repos = list_repos(args.source)
+    if not repos:
+        print(f"No repos found in {args.source}")
+        sys.exit(1)
+    per_repo = math.ceil(args.total / len(repos)) if args.total else args.per_repo
+
+    extractor = CFunctionExtractor(cache_path=EXTRACTION_CACHE_PATH, engine=args.engine)
+    scheduler = CorpusScheduler(extractor, args.output_dir, per_repo=per_repo, per_file=args.per_file,
+                                seed=args.seed, workers=args.workers, slice_dependencies=args.slice)
+    print(f"Extracting up to {per_repo} functions from each of {len(repos)} repos with {args.workers} workers")
+    summary = scheduler.run(repos)
+
+    counts = [res['functions'] for res in summary.values()]
+    print(f"\nExtraction Summary:")
+    print(f"Extracted {sum(counts)} functions from {len(counts)} repos into {args.output_dir}")
+    print(f"Functions per repo: min {min(counts)}, max {max(counts)}, mean {sum(counts) / len(counts):.1f}")
+    short = [repo_id for repo_id, res in summary.items() if res['functions'] < per_repo]
+    if short:
+        print(f"{len(short)} repos had fewer than {per_repo} testable functions: {', '.join(sorted(short))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+from paths import EXTRACTION_CACHE_PATH
+
+'''
+On-disk cache of function extraction results, so that files which haven't changed since the
+last run skip libclang entirely.
+
+Entries are keyed on the file's content hash, the parse flags and the extractor version, and
+store the extracted function records for the whole file. Each entry also remembers the size and
+mtime of every header the file included, and is treated as a miss if any of them changed.
+
+Usage:
+python extraction_cache.py stats [cache_path]
+python extraction_cache.py clear [cache_path]
+'''
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+class ExtractionCache:
+    def __init__(self, path=EXTRACTION_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Several extraction worker processes can share one cache
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                records TEXT NOT NULL,
+                deps TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0), ('stale', 0), ('evictions', 0);
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def hash_file(filepath):
+        with open(filepath, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash, parse_settings, version):
+        """Cache key for a file's content under the given parse settings (any JSON-serialisable value)"""
+        settings = json.dumps(parse_settings, sort_keys=True)
+        return hashlib.sha256(f'{version}\0{content_hash}\0{settings}'.encode()).hexdigest()
+
+    @staticmethod
+    def snapshot_deps(paths):
+        """Size and mtime of each dependency, to detect header changes without rehashing them"""
+        deps = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                deps[path] = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                deps[path] = None
+        return deps
+
+    def _bump(self, name, amount=1):
+        self.conn.execute('UPDATE stats SET value = value + ? WHERE name = ?', (amount, name))
+
+    def get(self, key):
+        """Cached records for key, or None on a miss or if one of the entry's headers has changed"""
+        row = self.conn.execute('SELECT records, deps FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._bump('misses')
+            self.conn.commit()
+            return None
+
+        records, deps = row
+        deps = json.loads(deps)
+        if self.snapshot_deps(deps) != deps:
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._bump('stale')
+            self._bump('misses')
+            self.conn.commit()
+            return None
+
+        self.conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._bump('hits')
+        self.conn.commit()
+        return json.loads(records)
+
+    def put(self, key, records, dep_paths=()):
+        records = json.dumps(records)
+        deps = json.dumps(self.snapshot_deps(dep_paths))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+            (key, records, deps, len(records) + len(deps), time.time())
+        )
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes"""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in self.conn.execute('SELECT key, size FROM entries ORDER BY last_used').fetchall():
+            if total <= target:
+                break
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        self._bump('evictions', evicted)
+
+    def stats(self):
+        stats = dict(self.conn.execute('SELECT name, value FROM stats').fetchall())
+        entries, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+        })
+        return stats
+
+    def clear(self):
+        self.conn.execute('DELETE FROM entries')
+        self.conn.execute('UPDATE stats SET value = 0')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def main():
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('stats', 'clear'):
+        print("Usage: python extraction_cache.py <stats|clear> [cache_path]")
+        sys.exit(1)
+
+    cache = ExtractionCache(sys.argv[2] if len(sys.argv) == 3 else EXTRACTION_CACHE_PATH)
+    if sys.argv[1] == 'clear':
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    else:
+        stats = cache.stats()
+        print(f"Cache: {cache.path}")
+        print(f"Entries: {stats['entries']} ({stats['bytes'] / 1024 / 1024:.1f} / {stats['max_bytes'] / 1024 / 1024:.0f} MB)")
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']} (stale: {stats['stale']})")
+        print(f"Hit rate: {stats['hit_rate'] * 100:.2f}%")
+        print(f"Evictions: {stats['evictions']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#include <dlfcn.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+// Fork server for test harnesses built as shared libraries (see fork_server.py).
+// Reads requests "<timeout_ms> <library path>\n" from stdin. For each one, a forked child
+// dlopens the library and calls harness_main with its stdout going to a pipe. The output is
+// passed on as it arrives, in chunks of "data <length>\n" followed by that many bytes, so it
+// is never held whole. The reply ends with "<status> <returncode>\n", where status is ok,
+// crashed, timeout or error (the library or its entry point couldn't be loaded).
+
+#define LOAD_ERROR 127
+
+static long now_ms(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+}
+
+// Runs in the forked child and never returns
+static void run_child(const char *path, int output_fd) {
+    int null_fd = open("/dev/null", O_RDWR);
+    // The harness must not read the requests meant for the server
+    dup2(null_fd, 0);
+    dup2(output_fd, 1);
+    dup2(null_fd, 2);
+    close(output_fd);
+    close(null_fd);
+
+    void *library = dlopen(path, RTLD_NOW | RTLD_LOCAL);
+    int (*entry)(void) = library ? (int (*)(void))dlsym(library, "harness_main") : NULL;
+    if (!entry)
+        _exit(LOAD_ERROR);
+    int returncode = entry();
+    fflush(NULL);
+    _exit(returncode & 0xff);
+}
+
+int main(void) {
+    char line[8192];
+    char chunk[1 << 16];
+
+    while (fgets(line, sizeof line, stdin)) {
+        long timeout_ms;
+        char path[4096];
+        if (sscanf(line, "%ld %4095[^\n]", &timeout_ms, path) != 2) {
+            printf("error -1\n");
+            fflush(stdout);
+            continue;
+        }
+
+        int fds[2];
+        if (pipe(fds) != 0)
+            return 1;
+        pid_t pid = fork();
+        if (pid < 0)
+            return 1;
+        if (pid == 0) {
+            close(fds[0]);
+            run_child(path, fds[1]);
+        }
+        close(fds[1]);
+
+        // Pass the output on until the child closes its end of the pipe or runs out of time
+        int timed_out = 0;
+        long deadline = now_ms() + timeout_ms;
+        for (;;) {
+            long remaining = deadline - now_ms();
+            if (remaining <= 0) {
+                timed_out = 1;
+                kill(pid, SIGKILL);
+                break;
+            }
+            struct pollfd pfd = { fds[0], POLLIN, 0 };
+            if (poll(&pfd, 1, (int)remaining) <= 0)
+                continue;
+            ssize_t n = read(fds[0], chunk, sizeof chunk);
+            if (n <= 0)
+                break;
+            printf("data %zd\n", n);
+            fwrite(chunk, 1, n, stdout);
+        }
+        close(fds[0]);
+
+        // A child can close its stdout and keep running, so the deadline still holds after EOF
+        int status;
+        while (!timed_out && waitpid(pid, &status, WNOHANG) == 0) {
+            if (now_ms() >= deadline) {
+                timed_out = 1;
+                kill(pid, SIGKILL);
+                break;
+            }
+            struct timespec pause = { 0, 1000000 };
+            nanosleep(&pause, NULL);
+        }
+        if (timed_out)
+            waitpid(pid, &status, 0);
+        const char *state = timed_out ? "timeout"
+                          : WIFSIGNALED(status) ? "crashed"
+                          : WEXITSTATUS(status) == LOAD_ERROR ? "error" : "ok";
+        int returncode = WIFSIGNALED(status) ? -WTERMSIG(status) : WEXITSTATUS(status);
+        printf("%s %d\n", state, returncode);
+        fflush(stdout);
+    }
+    return 0;
+}
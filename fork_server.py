@@ -0,0 +1,89 @@
+import os
+import re
+import hashlib
+import subprocess
+import threading
+from paths import CACHE_DIR
+
+'''
+Run test harnesses without exec'ing a new program for each one.
+
+A harness is built as a shared library whose main is renamed to HARNESS_ENTRY. A fork server
+(fork_server.c, compiled on first use) is started once and waits for library paths on its
+stdin. For each one it forks a child, which sends its stdout down a pipe, dlopens the library
+and calls the entry point. There is no exec, program startup or loading of libc per test, only
+a fork of a small, already running process. The server kills children that run past their
+timeout and reports crashes, so a misbehaving candidate can't take the server down with it.
+'''
+
+SERVER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fork_server.c')
+SERVER_DIR = os.path.join(CACHE_DIR, 'fork_server')
+
+# Name main is given in harnesses built as shared libraries
+HARNESS_ENTRY = 'harness_main'
+# Flags that turn a harness into a library the server can load. -Bsymbolic binds the harness's
+# calls to its own functions, and -z defs makes a missing function a link error as it would be
+# for an executable.
+LIBRARY_FLAGS = ['-shared', '-fPIC', '-Wl,-Bsymbolic', '-Wl,-z,defs']
+
+_build_lock = threading.Lock()
+
+def library_source(harness):
+    """A harness's source with main renamed to the entry point the fork server calls"""
+    return re.sub(r'^int main\((void)?\)', f'int {HARNESS_ENTRY}(void)', harness, count=1, flags=re.MULTILINE)
+
+def build_server(compiler='gcc', server_dir=SERVER_DIR):
+    """Path of the compiled fork server, building it if its source changed since the last build"""
+    with open(SERVER_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    path = os.path.join(server_dir, f'fork_server_{digest}')
+    with _build_lock:
+        if not os.path.exists(path):
+            os.makedirs(server_dir, exist_ok=True)
+            subprocess.run([compiler, '-O2', SERVER_SOURCE, '-o', path + '.tmp', '-ldl'], check=True)
+            os.replace(path + '.tmp', path)
+    return path
+
+class ForkServer:
+    """Client of one fork server process, which runs one harness at a time"""
+    def __init__(self, compiler='gcc'):
+        self.process = subprocess.Popen([build_server(compiler)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lock = threading.Lock()
+
+    def run(self, library, timeout, consume):
+        """
+        Run a harness library, passing its output to consume in chunks as it arrives. Returns a
+        dict with its status ('ok', 'crashed', 'timeout' or 'error' if it couldn't be loaded)
+        and its return code. Raises RuntimeError or OSError if the server itself has died.
+        """
+        with self.lock:
+            self.process.stdin.write(f'{int(timeout * 1000)} {os.path.abspath(library)}\n'.encode())
+            self.process.stdin.flush()
+            while True:
+                header = self.process.stdout.readline().split()
+                if len(header) == 2 and header[0] == b'data':
+                    data = self.process.stdout.read(int(header[1]))
+                    if len(data) != int(header[1]):
+                        raise RuntimeError("Fork server exited")
+                    consume(data)
+                    continue
+                if len(header) != 2:
+                    raise RuntimeError("Fork server exited")
+                status, returncode = header
+                break
+        return {
+            'status': status.decode(),
+            'returncode': int(returncode),
+        }
+
+    def close(self, kill=False):
+        """Stop the server, killing it outright if kill, e.g. because it stopped responding"""
+        if kill:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            # The server already exited with a request unread
+            pass
+        self.process.wait()
+        self.process.stdout.close()
@@ -1,62 +1,320 @@
 import re
-import json
+import ctypes
 import clang.cindex
 from pathlib import Path
 import subprocess
 import tempfile
 import difflib
 import hashlib
-from datetime import datetime
-from paths import SELF_EQUIV_OUTPUT_DIR
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from paths import SELF_EQUIV_OUTPUT_DIR, EXTRACTION_CACHE_PATH, SLICE_INDEX_DIR
+from extraction_cache import ExtractionCache
+from jsonl_store import StreamCheckpoint, JsonlFile
+from harness_table import NUM_TEST_CASES, generate_inputs, render_harness
+from coverage_minimizer import CoverageMinimizer, POOL_SIZE
+from build_artifacts import find_compilation_database
 
 '''
 To run this script, makesure LLVM and Clang are installed on your system.
 Specifically, make sure llvm-10 is installed
 '''
 
-llvm_library_path = '/usr/lib/llvm-10/lib/libclang.so.1'
+llvm_library_path = os.environ.get('LIBCLANG_PATH', '/usr/lib/llvm-10/lib/libclang.so.1')
+
+# libclang parses with the preprocessor and full types; tree-sitter is purely syntactic but much faster
+ENGINES = ('libclang', 'tree-sitter')
+
+# Bump whenever the extracted records change, so cached results from older versions are ignored
+EXTRACTOR_VERSION = 2
+
+# Compiler flags that only control output files, and those of them that take a value
+OUTPUT_FLAGS = {'-c', '-M', '-MM', '-MD', '-MMD', '-MP', '-MG'}
+OUTPUT_FLAGS_WITH_VALUE = {'-o', '-MF', '-MT', '-MQ'}
+
+def compile_args_for_parse(arguments, directory, filename):
+    """Turn a compilation database command line (minus the compiler) into libclang parse arguments"""
+    args = [f'-working-directory={directory}']
+    source = os.path.normpath(os.path.join(directory, filename))
+    skip_value = False
+    for arg in arguments:
+        if skip_value:
+            skip_value = False
+            continue
+        if arg in OUTPUT_FLAGS:
+            continue
+        if arg in OUTPUT_FLAGS_WITH_VALUE:
+            skip_value = True
+            continue
+        if any(arg.startswith(flag) for flag in OUTPUT_FLAGS_WITH_VALUE):
+            continue
+        # libclang is given the source file separately
+        if os.path.normpath(os.path.join(directory, arg)) == source:
+            continue
+        args.append(arg)
+    return args
+
+class SourceFile:
+    """Source text of a file plus a table of line start offsets, so functions can be sliced out without re-splitting"""
+    def __init__(self, filepath):
+        with open(filepath, errors='replace') as f:
+            self.content = f.read()
+
+        self.line_offsets = [0]
+        pos = self.content.find('\n')
+        while pos != -1:
+            self.line_offsets.append(pos + 1)
+            pos = self.content.find('\n', pos + 1)
+
+    def lines(self, start_line, end_line):
+        """Text of the 0-based, end-exclusive line range [start_line, end_line)"""
+        start = self.line_offsets[min(start_line, len(self.line_offsets) - 1)]
+        # Stop before the newline that ends the last line
+        end = self.line_offsets[end_line] - 1 if end_line < len(self.line_offsets) else len(self.content)
+        return self.content[start:end]
+
+    def offset(self, line, column):
+        """Character offset in the file of a 0-based line and a 0-based byte column in it"""
+        return self.line_offsets[line] + len(self.lines(line, line + 1).encode()[:column].decode(errors='ignore'))
+
+_location_is_from_main_file = None
+
+def _load_main_file_check():
+    """
+    Bind clang_Location_isFromMainFile, which the Python bindings don't wrap. It's much cheaper
+    than resolving each cursor's file by name, and TUs with a precompiled header have a lot of
+    top-level cursors to filter.
+    """
+    global _location_is_from_main_file
+    try:
+        check = clang.cindex.conf.lib.clang_Location_isFromMainFile
+    except AttributeError:
+        return
+    check.argtypes = [clang.cindex.SourceLocation]
+    check.restype = ctypes.c_int
+    _location_is_from_main_file = check
 
 class CFunctionExtractor:
-    def __init__(self, num_tests=10):
-        # Initialize clang with the new library path
-        clang.cindex.Config.set_library_file(llvm_library_path)
-        self.index = clang.cindex.Index.create()
+    def __init__(self, num_tests=10, main_file_only=True, compile_db_dir=None,
+                 skip_function_bodies=False, precompiled_preamble=False, header_pch=False, cache_path=None,
+                 engine='libclang'):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown extraction engine {engine}, expected one of {ENGINES}")
+        self.engine = engine
+        self.index = None
+        self.tree_sitter = None
+        if engine == 'libclang':
+            # Initialize clang with the new library path. libclang can only be configured once per
+            # process, and forked workers inherit the parent's already loaded library.
+            if not clang.cindex.Config.loaded:
+                clang.cindex.Config.set_library_file(llvm_library_path)
+            self.index = clang.cindex.Index.create()
+            if _location_is_from_main_file is None:
+                _load_main_file_check()
+        else:
+            # Only needed for this engine, so tree-sitter stays an optional dependency
+            from tree_sitter_engine import TreeSitterEngine
+            self.tree_sitter = TreeSitterEngine()
         self.num_tests = num_tests
         self.extracted_count = 0
+        # Only look at cursors from the .c file itself, not the headers it includes
+        self.main_file_only = main_file_only
+        # Used for files the compilation database doesn't know about
+        self.parse_args = ['-I', '/usr/include', '-I', '/usr/local/include']
+        # Inclusion directives and macros are only reported with a detailed processing record.
+        # Skipping function bodies is only useful for declaration scans: definitions lose their bodies.
+        self.skip_function_bodies = skip_function_bodies
+        self.precompiled_preamble = precompiled_preamble
+        self.parse_options = clang.cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+        if skip_function_bodies:
+            self.parse_options |= clang.cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
+        if precompiled_preamble:
+            self.parse_options |= clang.cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE
+        # Share one precompiled header between files that start with the same includes
+        self.header_pch = header_pch
+        self._pch_dir = None
+        self._seen_header_sets = set()
+        self._header_pchs = {}
+        self._sources = {}
+        self.compile_db = None
+        self.compile_db_dir = None
+        self.use_compilation_database(compile_db_dir)
+        # Extraction results of unchanged files are reused from here
+        self.cache_path = cache_path
+        self.cache = ExtractionCache(cache_path) if cache_path else None
+
+    def use_compilation_database(self, db_dir):
+        """Take per-file flags from the compile_commands.json in db_dir, or go back to the defaults if None"""
+        self.compile_db = None
+        self.compile_db_dir = None
+        # tree-sitter doesn't preprocess, so it has no use for compiler flags
+        if db_dir is None or self.engine != 'libclang':
+            return
+
+        try:
+            self.compile_db = clang.cindex.CompilationDatabase.fromDirectory(db_dir)
+            self.compile_db_dir = db_dir
+            print(f"Using compilation database in {db_dir}")
+        except clang.cindex.CompilationDatabaseError:
+            print(f"Failed to load compilation database in {db_dir}")
+
+    def get_parse_args(self, c_file):
+        """Exact compiler flags for a file from the compilation database, or the default include paths"""
+        if self.compile_db is not None:
+            commands = self.compile_db.getCompileCommands(os.path.abspath(c_file))
+            if commands:
+                command = commands[0]
+                return compile_args_for_parse(list(command.arguments)[1:], command.directory, command.filename)
+        return list(self.parse_args)
+
+    def leading_includes(self, source):
+        """The #include lines at the top of a file, before any code or other preprocessor directive"""
+        includes = []
+        in_comment = False
+        for i in range(len(source.line_offsets)):
+            line = source.lines(i, i + 1).strip()
+            if in_comment:
+                if '*/' not in line:
+                    continue
+                line = line.split('*/', 1)[1].strip()
+                in_comment = False
+            if line.startswith('/*'):
+                if '*/' not in line:
+                    in_comment = True
+                    continue
+                line = line.split('*/', 1)[1].strip()
+            if not line or line.startswith('//'):
+                continue
+
+            match = re.match(r'#\s*include\s*([<"][^>"]+[>"])', line)
+            if not match:
+                break
+            includes.append(f'#include {match.group(1)}')
+        return includes
+
+    def get_header_pch(self, c_file, args):
+        """
+        Precompiled header for the includes a file starts with. It is built the second time a
+        header set (with the same flags and directory) turns up, and reused for every file after.
+        """
+        includes = self.leading_includes(self.get_source(c_file))
+        if not includes:
+            return None
+
+        file_dir = os.path.dirname(os.path.abspath(c_file))
+        key = hashlib.sha1(repr((file_dir, includes, args)).encode()).hexdigest()
+        if key not in self._seen_header_sets:
+            self._seen_header_sets.add(key)
+            return None
+
+        if key not in self._header_pchs:
+            if self._pch_dir is None:
+                self._pch_dir = tempfile.TemporaryDirectory(prefix='r2e_pch_')
+            header = os.path.join(self._pch_dir.name, f'{key}.h')
+            with open(header, 'w') as f:
+                f.write('\n'.join(includes) + '\n')
+
+            # Quoted includes are looked up next to the file that uses them
+            tu = self.index.parse(header, args=args + ['-x', 'c-header', '-I', file_dir])
+            if tu and not any(d.severity >= clang.cindex.Diagnostic.Fatal for d in tu.diagnostics):
+                pch = header + '.pch'
+                tu.save(pch)
+                self._header_pchs[key] = pch
+            else:
+                self._header_pchs[key] = None
+        return self._header_pchs[key]
+
+    def parse_file(self, c_file):
+        """Parse a file with its own flags, on top of a shared precompiled header when enabled"""
+        path = os.path.abspath(c_file)
+        args = self.get_parse_args(path)
+        if self.header_pch:
+            pch = self.get_header_pch(path, args)
+            if pch:
+                return self.index.parse(path, args=args + ['-include-pch', pch], options=self.parse_options)
+        return self.index.parse(path, args=args, options=self.parse_options)
+
+    def get_source(self, filepath):
+        """Read a source file once and reuse it for every function extracted from it"""
+        filepath = os.path.abspath(filepath)
+        if filepath not in self._sources:
+            self._sources[filepath] = SourceFile(filepath)
+        return self._sources[filepath]
+
+    def in_main_file(self, cursor, main_file):
+        location = cursor.location
+        if _location_is_from_main_file is not None:
+            return bool(_location_is_from_main_file(location))
+        location_file = location.file
+        return location_file is not None and location_file.name == main_file
+
+    def collect_tu_context(self, tu):
+        """Collect the includes, typedefs and macros of a translation unit in one pass over its top-level cursors"""
+        return self.visit_tu(tu)[0]
+
+    def visit_tu(self, tu):
+        """
+        Walk the top-level cursors of a translation unit once, collecting its context
+        (includes, typedefs, macros) and the function definitions in it.
+        """
+        main_file = tu.spelling
+        source = self.get_source(main_file)
+        # Dicts keep first-seen order while deduplicating in constant time
+        context = {'includes': {}, 'typedefs': {}, 'macros': {}}
+        functions = []
+
+        for node in tu.cursor.get_children():
+            if self.main_file_only and not self.in_main_file(node, main_file):
+                continue
+
+            kind = node.kind
+            if kind == clang.cindex.CursorKind.INCLUSION_DIRECTIVE:
+                # Keep the <...> or "..." spelling from the source so the include can be pasted back
+                line = source.lines(node.extent.start.line - 1, node.extent.start.line)
+                match = re.search(r'#\s*include\s*([<"][^>"]+[>"])', line)
+                include = match.group(1) if match else f'<{node.displayname}>'
+                context['includes'][include] = None
+            elif kind == clang.cindex.CursorKind.TYPEDEF_DECL:
+                context['typedefs'][node.displayname] = None
+            elif kind == clang.cindex.CursorKind.MACRO_DEFINITION:
+                # Builtin macros have no file
+                if node.location.file is not None:
+                    context['macros'][node.spelling] = None
+            elif kind == clang.cindex.CursorKind.FUNCTION_DECL and node.is_definition():
+                functions.append(node)
+
+        return {key: list(values) for key, values in context.items()}, functions
         
-    def extract_function_with_context(self, filepath, cursor, tu):
+    def extract_function_with_context(self, filepath, cursor, tu, context=None):
         """Extract function and its dependencies"""
-        with open(filepath) as f:
-            content = f.read()
+        source = self.get_source(filepath)
+        if context is None:
+            context = self.collect_tu_context(tu)
             
-        # Get function source using line-based extraction
+        # Get function source from the cached line-offset table
         start_line = cursor.extent.start.line - 1
         end_line = cursor.extent.end.line
-        function_source = "\n".join(content.splitlines()[start_line:end_line])
-        
-        # Get required includes and typedefs by traversing the full translation unit
-        includes = set()
-        typedefs = set()
-        
-        def collect_dependencies(node):
-            if node.kind == clang.cindex.CursorKind.INCLUSION_DIRECTIVE:
-                includes.add(node.displayname)
-            elif node.kind == clang.cindex.CursorKind.TYPEDEF_DECL:
-                typedefs.add(node.displayname)
-
-        # Traverse the translation unit using get_children()
-        for node in tu.cursor.get_children():
-            collect_dependencies(node)
+        function_source = source.lines(start_line, end_line)
+        # Where the body starts, so the function can be cut down to its prototype
+        body = next((c for c in cursor.get_children() if c.kind == clang.cindex.CursorKind.COMPOUND_STMT), None)
+        body_offset = None
+        if body is not None:
+            body_offset = (source.offset(body.extent.start.line - 1, body.extent.start.column - 1)
+                           - source.line_offsets[start_line])
         
         return {
             'function_name': cursor.spelling,
             'source': function_source,
-            'includes': list(includes),
-            'typedefs': list(typedefs),
+            'includes': list(context['includes']),
+            'typedefs': list(context['typedefs']),
+            'macros': list(context['macros']),
             'signature': self.get_function_signature(cursor),
             'file_path': str(filepath),
             'start_line': start_line + 1,
-            'end_line': end_line
+            'end_line': end_line,
+            'body_offset': body_offset
         }
     
     def get_function_signature(self, cursor):
@@ -82,148 +340,323 @@ class CFunctionExtractor:
             
         return True
     
-    def extract_from_repo(self, repo_path):
-        """Extract testable functions from a repository"""
+    def cache_key(self, c_file):
+        """Key of a file's extraction results: its content, everything that affects parsing, and the extractor version"""
+        path = os.path.abspath(c_file)
+        settings = {
+            'engine': self.engine,
+            'args': self.get_parse_args(path) if self.engine == 'libclang' else [],
+            'options': self.parse_options,
+            'main_file_only': self.main_file_only,
+            # Quoted includes are resolved relative to the file
+            'directory': os.path.dirname(path),
+        }
+        return ExtractionCache.make_key(ExtractionCache.hash_file(path), settings, EXTRACTOR_VERSION)
+
+    def extract_file_records(self, c_file):
+        """All testable functions of a file, from the cache if the file hasn't changed"""
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(c_file)
+            records = self.cache.get(key)
+            if records is not None:
+                for record in records:
+                    record['file_path'] = str(c_file)
+                return records
+
+        if self.engine == 'tree-sitter':
+            records = self.extract_file_records_tree_sitter(c_file)
+            if key is not None:
+                # Nothing is preprocessed, so the records only depend on the file itself
+                self.cache.put(key, records)
+            return records
+
+        tu = self.parse_file(c_file)
+        if not tu:
+            print(f"Failed to parse {c_file}")
+            return []
+
+        records = []
+        try:
+            context, functions = self.visit_tu(tu)
+            for cursor in functions:
+                if self.is_testable_function(cursor):
+                    records.append(self.extract_function_with_context(str(c_file), cursor, tu, context))
+        finally:
+            # Sources are only reused within a file, so don't let the cache grow with the repo
+            self._sources.clear()
+
+        if key is not None:
+            self.cache.put(key, records, [inclusion.include.name for inclusion in tu.get_includes()])
+        return records
+
+    def extract_file_records_tree_sitter(self, c_file):
+        """All testable functions of a file found syntactically by the tree-sitter engine"""
+        try:
+            source = self.get_source(c_file)
+            context, functions = self.tree_sitter.extract(source)
+            records = []
+            for info in functions:
+                if not self.tree_sitter.is_testable_function(info):
+                    continue
+                body_offset = None
+                if info['body_start'] is not None:
+                    body_offset = source.offset(*info['body_start']) - source.line_offsets[info['start_line'] - 1]
+                records.append({
+                    'function_name': info['name'],
+                    'source': source.lines(info['start_line'] - 1, info['end_line']),
+                    'includes': list(context['includes']),
+                    'typedefs': list(context['typedefs']),
+                    'macros': list(context['macros']),
+                    'signature': f"{info['return_type']} {info['name']}({', '.join(info['params'])})",
+                    'file_path': str(c_file),
+                    'start_line': info['start_line'],
+                    'end_line': info['end_line'],
+                    'body_offset': body_offset
+                })
+            return records
+        finally:
+            self._sources.clear()
+
+    def extract_from_file(self, c_file):
+        """Extract testable functions from a single .c file, parsing and walking it once"""
         testable_functions = []
-        
-        for c_file in Path(repo_path).rglob('*.c'):
+        for func_info in self.extract_file_records(c_file):
+            if self.extracted_count >= self.num_tests:
+                break
+
+            testable_functions.append(func_info)
+            self.extracted_count += 1
+            print(f"Found testable function ({self.extracted_count}/{self.num_tests}): {func_info['function_name']}")
+
+        return testable_functions
+    
+    def find_source_files(self, repo_path):
+        """All .c files in a repo, sorted so that extraction order doesn't depend on the filesystem"""
+        return sorted(Path(repo_path).rglob('*.c'))
+
+    def worker_settings(self):
+        """Constructor arguments that recreate this extractor's configuration in a worker process"""
+        return {
+            'num_tests': self.num_tests,
+            'main_file_only': self.main_file_only,
+            'compile_db_dir': self.compile_db_dir,
+            'skip_function_bodies': self.skip_function_bodies,
+            'precompiled_preamble': self.precompiled_preamble,
+            'header_pch': self.header_pch,
+            'cache_path': self.cache_path,
+            'engine': self.engine,
+        }
+
+    def extract_from_repo(self, repo_path, workers=1):
+        """Extract testable functions from a repository, optionally spreading files over worker processes"""
+        testable_functions = []
+        for _, functions in self.iter_extract_from_repo(repo_path, workers):
+            testable_functions.extend(functions)
+        return testable_functions
+
+    def iter_extract_from_repo(self, repo_path, workers=1, skip_files=()):
+        """
+        Yield (c_file, testable functions) for each file of a repo in sorted order, as soon as
+        it is done, until the num_tests budget is used up. Files in skip_files (e.g. already
+        written by an earlier run) are left out.
+        """
+        self.use_compilation_database(find_compilation_database(repo_path))
+        skip_files = set(skip_files)
+        c_files = [c_file for c_file in self.find_source_files(repo_path) if str(c_file) not in skip_files]
+        if workers > 1:
+            yield from self.iter_extract_parallel(c_files, workers)
+            return
+
+        for c_file in c_files:
             if self.extracted_count >= self.num_tests:
                 break
                 
             try:
                 print(f"Processing {c_file}")
-                # Parsing with optional include paths (add more paths if needed)
-                tu = self.index.parse(str(c_file), args=['-I', '/usr/include', '-I', '/usr/local/include'])
-                if not tu:
-                    print(f"Failed to parse {c_file}")
-                    continue
-
-                # Walk through all nodes in the translation unit
-                for cursor in tu.cursor.walk_preorder():
-                    if self.extracted_count >= self.num_tests:
-                        break
-                        
-                    if (cursor.kind == clang.cindex.CursorKind.FUNCTION_DECL and 
-                        self.is_testable_function(cursor)):
-                        func_info = self.extract_function_with_context(str(c_file), cursor, tu)
-                        testable_functions.append(func_info)
-                        self.extracted_count += 1
-                        print(f"Found testable function ({self.extracted_count}/{self.num_tests}): {func_info['function_name']}")
-                        
+                functions = self.extract_from_file(c_file)
             except Exception as e:
                 print(f"Error processing {c_file}: {e}")
-                
-        return testable_functions
+                functions = []
+            yield c_file, functions
+
+    def iter_extract_parallel(self, c_files, workers):
+        """
+        Extract testable functions with a pool of worker processes, each with its own clang Index.
+        Results are merged in file order, so the output is the same as a sequential run whatever
+        the worker count: the first num_tests testable functions of the sorted file list. Files
+        are handed to the pool a few at a time, and none is handed out once enough files at the
+        front of that list are done to fill the budget; workers skip those already handed out.
+        """
+        remaining = self.num_tests - self.extracted_count
+        if remaining <= 0 or not c_files:
+            return
+
+        # Index of the last file whose functions can still make it into the output
+        cutoff = multiprocessing.Value('i', len(c_files))
+        results = {}
+        next_file = 0
+        found = 0
+        submitted = 0
+        in_flight = set()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_extraction_worker,
+                                 initargs=(self.worker_settings(), remaining, cutoff)) as pool:
+            while found < remaining and (in_flight or submitted < len(c_files)):
+                # Keep every worker busy, but never run more than two files per worker ahead of
+                # the first file not handed out yet, however long that one takes
+                while submitted < min(len(c_files), next_file + 2 * workers):
+                    in_flight.add(pool.submit(_extract_file_in_worker, submitted, str(c_files[submitted])))
+                    submitted += 1
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_index, functions = future.result()
+                    results[file_index] = functions
+
+                # Hand out the contiguous prefix of finished files
+                while next_file in results and found < remaining:
+                    functions = (results.pop(next_file) or [])[:remaining - found]
+                    found += len(functions)
+                    self.extracted_count += len(functions)
+                    next_file += 1
+                    yield c_files[next_file - 1], functions
+
+            if found >= remaining:
+                with cutoff.get_lock():
+                    cutoff.value = next_file - 1
+                for pending in in_flight:
+                    pending.cancel()
+
+        print(f"Found {found} testable functions in {next_file} files using {workers} workers")
+
+_worker_extractor = None
+_worker_cutoff = None
+
+def _init_extraction_worker(settings, budget, cutoff):
+    """Give each worker process its own extractor (and clang Index)"""
+    global _worker_extractor, _worker_cutoff
+    settings = dict(settings, num_tests=budget)
+    _worker_extractor = CFunctionExtractor(**settings)
+    _worker_cutoff = cutoff
+
+def _extract_file_in_worker(file_index, c_file):
+    """Extract all testable functions of one file, up to the budget; None means the file was skipped"""
+    if file_index > _worker_cutoff.value:
+        return file_index, None
+
+    # A single file never needs to contribute more than the whole budget
+    _worker_extractor.extracted_count = 0
+    try:
+        print(f"Processing {c_file}")
+        return file_index, _worker_extractor.extract_from_file(c_file)
+    except Exception as e:
+        print(f"Error processing {c_file}: {e}")
+        return file_index, []
 
 class SelfEquivalenceTester:
-    def __init__(self):
+    def __init__(self, num_cases=NUM_TEST_CASES, minimizer=None):
         self.gcc_flags = ['-O0', '-Wall', '-Wextra']
+        self.num_cases = num_cases
+        # A CoverageMinimizer (see coverage_minimizer.py) picks test cases out of a larger pool of inputs
+        self.minimizer = minimizer
         
     def generate_test_cases(self, function_info):
-        """Generate test cases based on function signature"""
-        return_type = function_info['signature'].split()[0]
-        test_cases = []
-        
-        # Parse parameters from signature
-        params_str = function_info['signature'].split('(')[1].split(')')[0]
-        params = [p.strip() for p in params_str.split(',') if p.strip()]
-        
-        # Generate a few test cases with different parameter values
-        for i in range(3):  # Generate 3 test cases per function
-            test_case = {
-                'inputs': [],
-                'expected_output': None
-            }
-            
-            for param_type in params:
-                # Generate appropriate test values based on type
-                if 'int' in param_type:
-                    test_case['inputs'].append(i * 10)  # Simple integer progression
-                elif 'float' in param_type or 'double' in param_type:
-                    test_case['inputs'].append(i * 10.5)
-                else:
-                    test_case['inputs'].append(0)  # Default for unknown types
-                    
-            test_cases.append(test_case)
-            
-        return test_cases
+        """
+        Generate type-aware test inputs based on the function signature. With a minimizer, these
+        are the fewest of its pool of inputs that cover as much of the function as the whole pool.
+        """
+        if self.minimizer is not None:
+            pool = generate_inputs(function_info, self.minimizer.pool_size)
+            kept = self.minimizer.minimize(self.harness_code(function_info), function_info, pool)
+            if kept is not None:
+                return kept
+        return generate_inputs(function_info, self.num_cases)
         
+    def harness_code(self, function_info):
+        """The function and the context it needs to compile, which the harness is appended to"""
+        if function_info.get('slice'):
+            # A dependency slice already holds the function and everything it needs
+            code = function_info['slice']
+        else:
+            includes = '\n'.join(f'#include {inc}' for inc in function_info['includes'])
+            typedefs = '\n'.join(function_info['typedefs'])
+            code = f"{includes}\n{typedefs}\n{function_info['source']}"
+        if '#include <stdio.h>' not in code:
+            code = '#include <stdio.h>\n' + code
+        return code
+
     def create_test_harness(self, function_info, test_cases):
-        """Create a test harness for the function"""
-        includes = '\n'.join(f'#include {inc}' for inc in function_info['includes'])
-        typedefs = '\n'.join(function_info['typedefs'])
-        
-        test_code = []
-        for i, test in enumerate(test_cases):
-            params = ', '.join(str(p) for p in test['inputs'])
-            test_code.append(f"""
-    printf("Test case {i + 1}:\\n");
-    result = {function_info['function_name']}({params});
-    printf("Input: ({params}), Output: %d\\n", result);
-""")
-            
-        return f"""
-{includes}
-{typedefs}
-{function_info['source']}
-
-// Test harness
-int main() {{
-    {function_info['signature'].split()[0]} result;
-    
-    {''.join(test_code)}
-    return 0;
-}}
-"""
-
-def save_to_json(functions, test_cases, output_dir=SELF_EQUIV_OUTPUT_DIR):
-    """Save extracted functions and test cases to JSON files"""
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # Save functions
-    functions_file = Path(output_dir) / f"functions_{timestamp}.json"
-    with open(functions_file, 'w') as f:
-        json.dump(functions, f, indent=2)
-    print(f"Saved functions to {functions_file}")
-    
-    # Save test cases
-    tests_file = Path(output_dir) / f"tests_{timestamp}.json"
-    with open(tests_file, 'w') as f:
-        json.dump(test_cases, f, indent=2)
-    print(f"Saved test cases to {tests_file}")
+        """Create a test harness that runs every test case from one input table"""
+        return render_harness(self.harness_code(function_info), function_info, test_cases)
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract functions and generate their self-equivalence tests")
+    parser.add_argument('--minimize', type=int, nargs='?', const=POOL_SIZE, metavar='POOL_SIZE',
+                        help="keep the fewest of POOL_SIZE inputs that cover as much of each function as all of them")
+    args = parser.parse_args()
+
     num_tests = 10
-    extractor = CFunctionExtractor(num_tests=num_tests)
-    tester = SelfEquivalenceTester()
+    extractor = CFunctionExtractor(num_tests=num_tests, cache_path=EXTRACTION_CACHE_PATH)
+    minimizer = CoverageMinimizer(pool_size=args.minimize) if args.minimize else None
+    tester = SelfEquivalenceTester(minimizer=minimizer)
     
     # Run the function extractor on the provided repo path
     repo_path = "repos/repos_10/git___git"
-    functions = extractor.extract_from_repo(repo_path)
-    
-    # Generate test cases for each function
-    all_test_cases = {}
-    for func in functions:
-        test_cases = tester.generate_test_cases(func)
-        h = tester.create_test_harness(func, test_cases)
 
-        all_test_cases[func['function_name']] = {
-            'test_cases': test_cases,
-            'harness': h
-        }
-    
-    # Save results to JSON
-    save_to_json(functions, all_test_cases)
+    # Functions and their test harnesses are streamed to JSONL as each file is done. Finished
+    # files and repos are checkpointed, so a restarted run skips them.
+    checkpoint = StreamCheckpoint(SELF_EQUIV_OUTPUT_DIR, {'functions': 'functions.jsonl', 'tests': 'tests.jsonl'})
+    extractor.extracted_count = checkpoint.counters.get('extracted_count', 0)
+
+    if checkpoint.is_done('repos', repo_path):
+        print(f"Skipping {repo_path}, already extracted")
+    else:
+        # Index the repo once, so every function can be cut out with exactly the code it depends on.
+        # It is only built once there is a function to slice, and it is saved, so a resumed run
+        # over an unchanged repo loads it instead of parsing the repo again.
+        from dependency_slicer import DependencySlicer
+        slicer = None
+        slice_index = os.path.join(SLICE_INDEX_DIR, f'{os.path.basename(os.path.normpath(repo_path))}.json')
+
+        files = extractor.iter_extract_from_repo(repo_path, workers=os.cpu_count() or 1,
+                                                 skip_files=checkpoint.done.get('files', ()))
+        for c_file, functions in files:
+            # Generate test cases for each function
+            for func in functions:
+                if slicer is None:
+                    slicer = DependencySlicer(repo_path, extractor).index_repo(slice_index)
+                sliced = slicer.slice_record(func)
+                if sliced is not None:
+                    func['slice'] = sliced['code']
+                test_cases = tester.generate_test_cases(func)
+                h = tester.create_test_harness(func, test_cases)
+
+                checkpoint.write('functions', func)
+                checkpoint.write('tests', {
+                    'function_name': func['function_name'],
+                    'test_cases': test_cases,
+                    'harness': h
+                })
+            checkpoint.counters['extracted_count'] = extractor.extracted_count
+            checkpoint.mark_done('files', str(c_file))
+        checkpoint.mark_done('repos', repo_path)
+    checkpoint.close()
     
+    functions = JsonlFile(os.path.join(SELF_EQUIV_OUTPUT_DIR, 'functions.jsonl'))
+    print(f"\nSaved functions and test cases to {SELF_EQUIV_OUTPUT_DIR}")
     print(f"\nExtraction Summary:")
     print(f"Found {len(functions)} testable functions")
+    cache_stats = extractor.cache.stats()
+    print(f"Extraction cache hit rate: {cache_stats['hit_rate'] * 100:.2f}% ({cache_stats['hits']} hits, {cache_stats['misses']} misses)")
+    if minimizer is not None:
+        stats = minimizer.stats
+        print(f"Minimized test cases of {stats['functions'] - stats['failed']} functions "
+              f"({stats['failed']} failed): kept {stats['kept_cases']} of {stats['pool_cases']} inputs")
     for func in functions:
         print(f"\nFunction: {func['function_name']}")
         print(f"Signature: {func['signature']}")
         print(f"Source length: {len(func['source'])} bytes")
         print(f"File: {func['file_path']}:{func['start_line']}-{func['end_line']}")
-        print(f"Number of test cases: {len(all_test_cases[func['function_name']]['test_cases'])}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+import subprocess
+from paths import GOLDEN_CACHE_PATH
+
+'''
+On-disk store of the outputs of original functions' test harnesses ("golden outputs").
+Outputs are stored as their digests (see OutputDigest.summary), not as text.
+
+The original harness of a function prints the same thing every time, so it only has to be
+compiled and run once, no matter how many generated candidates it is compared against or how
+many evaluation runs there are. Entries are keyed on the harness source, the compiler (its
+path, version and target) and the compiler flags, so changing any of them compiles the
+original again.
+
+Only successful runs are stored: an original that failed to compile or timed out is retried
+next time.
+
+Usage:
+python golden_cache.py stats [cache_path]
+python golden_cache.py clear [cache_path]
+python golden_cache.py invalidate <function_name> [cache_path]
+'''
+
+# Bump whenever harness output changes meaning, so outputs stored by older versions are ignored
+GOLDEN_VERSION = 2
+
+_compiler_ids = {}
+
+def compiler_id(compiler):
+    """Path, version and target of a compiler, so upgrading it invalidates its outputs"""
+    if compiler not in _compiler_ids:
+        info = [shutil.which(compiler) or compiler]
+        for flag in ('-dumpfullversion', '-dumpmachine'):
+            try:
+                info.append(subprocess.run([compiler, flag], capture_output=True, text=True).stdout.strip())
+            except OSError:
+                info.append('')
+        _compiler_ids[compiler] = ' '.join(info)
+    return _compiler_ids[compiler]
+
+class GoldenOutputCache:
+    def __init__(self, path=GOLDEN_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # The test runner's threads share one connection, one statement at a time
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS outputs (
+                key TEXT PRIMARY KEY,
+                function_name TEXT NOT NULL,
+                output TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outputs_function_name ON outputs (function_name);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0);
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(harness, compiler, flags):
+        """Key of a harness's output when built with the given compiler and flags"""
+        settings = json.dumps([compiler_id(compiler), list(flags)])
+        return hashlib.sha256(f'{GOLDEN_VERSION}\0{settings}\0{harness}'.encode()).hexdigest()
+
+    def _bump(self, name):
+        self.conn.execute('UPDATE stats SET value = value + 1 WHERE name = ?', (name,))
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT output FROM outputs WHERE key = ?', (key,)).fetchone()
+            self._bump('hits' if row is not None else 'misses')
+            self.conn.commit()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key, function_name, output):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                              (key, function_name, json.dumps(output), time.time()))
+            self.conn.commit()
+
+    def invalidate(self, function_name):
+        """Forget every stored output of a function; returns how many there were"""
+        with self.lock:
+            deleted = self.conn.execute('DELETE FROM outputs WHERE function_name = ?', (function_name,)).rowcount
+            self.conn.commit()
+        return deleted
+
+    def stats(self):
+        stats = dict(self.conn.execute('SELECT name, value FROM stats').fetchall())
+        entries, functions = self.conn.execute('SELECT COUNT(*), COUNT(DISTINCT function_name) FROM outputs').fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': entries,
+            'functions': functions,
+            'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+        })
+        return stats
+
+    def clear(self):
+        self.conn.execute('DELETE FROM outputs')
+        self.conn.execute('UPDATE stats SET value = 0')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def main():
+    args = sys.argv[1:]
+    # invalidate takes a function name before the optional cache path
+    num_names = 1 if args and args[0] == 'invalidate' else 0
+    if not args or args[0] not in ('stats', 'clear', 'invalidate') or not 1 + num_names <= len(args) <= 2 + num_names:
+        print("Usage: python golden_cache.py <stats|clear> [cache_path]")
+        print("       python golden_cache.py invalidate <function_name> [cache_path]")
+        sys.exit(1)
+
+    command = args.pop(0)
+    function_name = args.pop(0) if command == 'invalidate' else None
+    cache = GoldenOutputCache(args[0] if args else GOLDEN_CACHE_PATH)
+    if command == 'clear':
+        cache.clear()
+        print(f"Cleared {cache.path}")
+    elif command == 'invalidate':
+        print(f"Removed {cache.invalidate(function_name)} outputs of {function_name}")
+    else:
+        stats = cache.stats()
+        print(f"Golden outputs: {cache.path}")
+        print(f"Entries: {stats['entries']} for {stats['functions']} functions")
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']}")
+        print(f"Hit rate: {stats['hit_rate'] * 100:.2f}%")
+
+if __name__ == "__main__":
+    main()
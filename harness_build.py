@@ -0,0 +1,74 @@
+import subprocess
+from harness_table import HARNESS_MARKER
+
+'''
+Helpers for building a harness in two parts: the function under test, compiled with its
+context for every candidate, and the rest of the harness (input table, main and the same
+context), compiled once into an object with weak definitions that candidates are linked against.
+Also helpers for linking copies of the same code into one program under different names.
+'''
+
+def split_harness(harness):
+    """The code under test of a harness, without its input table and main"""
+    return harness.split(f'\n{HARNESS_MARKER}', 1)[0]
+
+def replace_function(harness, original_source, replacement):
+    """
+    A harness with the function under test replaced by replacement. Only its definition is:
+    the last copy of its text in front of the input table and main, where the harness puts it,
+    so the same text anywhere else (e.g. a comment in its context) is left alone.
+    """
+    code, marker, rest = harness.partition(f'\n{HARNESS_MARKER}')
+    before, found, after = code.rpartition(original_source)
+    if not found:
+        return harness
+    return before + replacement + after + marker + rest
+
+def function_prototype(original_source, body_offset):
+    """
+    Declaration of a function: its source cut where the extractor found its body to start
+    (the record's body_offset). None if no body was recorded there.
+    """
+    if body_offset is None or not 0 < body_offset < len(original_source) or original_source[body_offset] != '{':
+        return None
+    return original_source[:body_offset].rstrip() + ';'
+
+def fixed_harness_source(harness, original_source, body_offset):
+    """A harness with the function under test cut down to its prototype, or None if it can't be split"""
+    if f'\n{HARNESS_MARKER}' not in harness or original_source not in split_harness(harness):
+        return None
+    prototype = function_prototype(original_source, body_offset)
+    if prototype is None:
+        return None
+    return replace_function(harness, original_source, prototype)
+
+def compile_weak_object(compiler, flags, source, object_file, keep=()):
+    """
+    Compile source (piped to the compiler) into object_file and make all its definitions weak
+    except those named in keep, so definitions linked in from elsewhere take their place.
+    Returns the completed process of the last step that ran, which failed if its returncode isn't 0.
+    """
+    result = subprocess.run([compiler] + flags + ['-c', '-x', 'c', '-', '-o', object_file],
+                            input=source, capture_output=True, text=True)
+    if result.returncode == 0:
+        # Only definitions are weakened: the function under test has to come from the candidate
+        result = subprocess.run(['nm', '--defined-only', '--extern-only', '--format=just-symbols', object_file],
+                                capture_output=True, text=True)
+    if result.returncode == 0:
+        weaken = [f'--weaken-symbol={name}' for name in result.stdout.split() if name not in keep]
+        result = subprocess.run(['objcopy'] + weaken + [object_file], capture_output=True, text=True)
+    return result
+
+def isolate_function(object_file, name, new_name):
+    """
+    Rename a function in an object file and make every other symbol it defines local, so that
+    several copies of the same code, globals and helpers included, can be linked into one
+    program side by side. A static function is made global first so it can be called at all.
+    Returns the completed process of the last step that ran.
+    """
+    result = subprocess.run(['objcopy', f'--globalize-symbol={name}', object_file], capture_output=True, text=True)
+    if result.returncode == 0:
+        # --keep-global-symbol applies to the name after renaming
+        result = subprocess.run(['objcopy', f'--redefine-sym={name}={new_name}', f'--keep-global-symbol={new_name}',
+                                 object_file], capture_output=True, text=True)
+    return result
@@ -0,0 +1,287 @@
+import re
+import random
+
+'''
+Table-driven test harnesses.
+
+Instead of one printf block per test case, a harness holds all of a function's inputs in one
+static table (an array of structs with one member per parameter) and calls the function in a
+single loop. The table is plain data, so a harness with thousands of test cases compiles about
+as fast as one with three, and all of them run in one process.
+
+Inputs are picked by parameter type: integers get small values of the right signedness and
+width, floating point parameters get a mix of signs and magnitudes, and pointers and types the
+harness can't see into (structs, opaque typedefs) are left zero.
+'''
+
+# Width in bits and signedness of the integer types the harness knows; long is 64 bits as on Linux
+INTEGER_TYPES = {
+    '_Bool': (1, False), 'bool': (1, False),
+    'char': (8, True), 'signed char': (8, True), 'unsigned char': (8, False),
+    'short': (16, True), 'short int': (16, True), 'signed short': (16, True), 'signed short int': (16, True),
+    'unsigned short': (16, False), 'unsigned short int': (16, False),
+    'int': (32, True), 'signed': (32, True), 'signed int': (32, True),
+    'unsigned': (32, False), 'unsigned int': (32, False),
+    'long': (64, True), 'long int': (64, True), 'signed long': (64, True), 'signed long int': (64, True),
+    'unsigned long': (64, False), 'unsigned long int': (64, False),
+    'long long': (64, True), 'long long int': (64, True), 'signed long long': (64, True),
+    'unsigned long long': (64, False), 'unsigned long long int': (64, False),
+    'int8_t': (8, True), 'uint8_t': (8, False), 'int16_t': (16, True), 'uint16_t': (16, False),
+    'int32_t': (32, True), 'uint32_t': (32, False), 'int64_t': (64, True), 'uint64_t': (64, False),
+    'size_t': (64, False), 'ssize_t': (64, True), 'ptrdiff_t': (64, True),
+    'intptr_t': (64, True), 'uintptr_t': (64, False),
+}
+FLOAT_TYPES = {'float', 'double', 'long double'}
+QUALIFIERS = {'const', 'volatile', 'restrict', '__restrict', '__restrict__'}
+
+# Values every integer parameter is tried with first. Extremes like INT_MAX are left out on
+# purpose: a parameter that turns out to be a loop bound would make the whole harness time out.
+SIGNED_VALUES = [0, 1, -1, 2, 10, -10, 100, 255]
+UNSIGNED_VALUES = [0, 1, 2, 10, 100, 255, 1000, 65535]
+FLOAT_VALUES = [0.0, 1.0, -1.0, 0.5, 10.5, -2.25, 1e6, 1e-6]
+# Random integers beyond the fixed values stay within 16 bits for the same reason
+RANDOM_INT_BITS = 16
+
+# Default number of test cases per function
+NUM_TEST_CASES = 16
+# Comment between the code under test and the harness's input table and main
+HARNESS_MARKER = '// Test harness'
+
+def type_kind(type_text):
+    """
+    How the harness treats a parameter or return type: ('int', bits, signed), ('float',),
+    ('pointer',), ('void',) or ('other',) for anything it can't generate values for
+    """
+    words = [w for w in re.sub(r'\s+', ' ', type_text).strip().split(' ') if w not in QUALIFIERS]
+    text = ' '.join(words)
+    if '*' in text or '[' in text or '(' in text:
+        return ('pointer',)
+    if text == 'void':
+        return ('void',)
+    if text in FLOAT_TYPES:
+        return ('float',)
+    if text in INTEGER_TYPES or text.startswith('enum '):
+        bits, signed = INTEGER_TYPES.get(text, (32, True))
+        return ('int', bits, signed)
+    return ('other',)
+
+def input_values(kind, count, rng):
+    """count values for a parameter of the given kind: the fixed values first, then random ones"""
+    if kind[0] == 'int':
+        _, bits, signed = kind
+        if bits == 1:
+            return [i % 2 for i in range(count)]
+        low, high = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+        values = [v for v in (SIGNED_VALUES if signed else UNSIGNED_VALUES) if low <= v <= high]
+        span = 1 << RANDOM_INT_BITS
+        random_low, random_high = max(low, -span // 2 if signed else 0), min(high, span // 2 if signed else span)
+        while len(values) < count:
+            values.append(rng.randint(random_low, random_high))
+        return values[:count]
+    if kind[0] == 'float':
+        values = list(FLOAT_VALUES)
+        while len(values) < count:
+            values.append(round(rng.uniform(-1e4, 1e4), 6))
+        return values[:count]
+    return [0] * count
+
+def split_params(signature, function_name):
+    """Return type and parameter types of a signature like 'int f(int, const char *)'"""
+    return_type, _, rest = signature.partition(f'{function_name}(')
+    params_str = rest[:rest.rfind(')')] if ')' in rest else rest
+    params = []
+    depth = 0
+    current = ''
+    # Split on top-level commas only, so function pointer parameters stay in one piece
+    for ch in params_str:
+        if ch == ',' and depth == 0:
+            params.append(current.strip())
+            current = ''
+            continue
+        depth += ch == '('
+        depth -= ch == ')'
+        current += ch
+    params.append(current.strip())
+    params = [p for p in params if p and p not in ('void', '...')]
+    return return_type.strip(), params
+
+def generate_inputs(function_info, num_cases=NUM_TEST_CASES):
+    """Test cases for a function, seeded by its name so the same function always gets the same inputs"""
+    _, params = split_params(function_info['signature'], function_info['function_name'])
+    rng = random.Random(function_info['function_name'])
+    columns = []
+    for j, param_type in enumerate(params):
+        values = input_values(type_kind(param_type), num_cases, rng)
+        # Rotate each column so that parameters don't all get the same value in the same test case
+        shift = j % len(values) if values else 0
+        columns.append(values[shift:] + values[:shift])
+    if not params:
+        num_cases = 1
+    return [{'inputs': [column[i] for column in columns], 'expected_output': None} for i in range(num_cases)]
+
+def member_declaration(type_text, name):
+    """Declare a struct member of a parameter's type: arrays decay to pointers, function pointers get the name inside"""
+    if '(*' in type_text:
+        return type_text.replace('(*', f'(*{name}', 1)
+    if '[' in type_text:
+        base, _, rest = type_text.partition('[')
+        rest = rest.partition(']')[2]
+        return f'{base.rstrip()} (*{name}){rest}' if rest else f'{base.rstrip()} *{name}'
+    return f'{type_text} {name}'
+
+def c_literal(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+def print_value(kind, expr):
+    """printf format and argument for a value of the given kind, or None if it can't be printed as a number"""
+    if kind[0] == 'int':
+        return ('%lld', f'(long long){expr}') if kind[2] else ('%llu', f'(unsigned long long){expr}')
+    if kind[0] == 'float':
+        return '%.17g', f'(double){expr}'
+    return None
+
+def input_table(params, kinds, test_cases):
+    """Lines declaring the input table of a harness, and the C expression for its number of rows"""
+    if not params:
+        return [], str(len(test_cases))
+    lines = ['struct harness_input {']
+    lines.extend(f'    {member_declaration(p, f"a{j}")};' for j, p in enumerate(params))
+    lines.append('};')
+    lines.append('')
+    lines.append('static const struct harness_input harness_inputs[] = {')
+    for test in test_cases:
+        # Pointers and opaque types are left out of the initializer, so they are zero
+        fields = [f'.a{j} = {c_literal(v)}' for j, (v, kind) in enumerate(zip(test['inputs'], kinds))
+                  if kind[0] in ('int', 'float')]
+        lines.append(f"    {{{', '.join(fields) or '0'}}},")
+    lines.append('};')
+    return lines, 'sizeof(harness_inputs) / sizeof(harness_inputs[0])'
+
+def render_harness(code, function_info, test_cases):
+    """A harness running every test case of a function from one input table in one loop"""
+    name = function_info['function_name']
+    return_type, params = split_params(function_info['signature'], name)
+    kinds = [type_kind(p) for p in params]
+    return_kind = type_kind(return_type)
+
+    lines = [code, '', f'{HARNESS_MARKER}: one row of arguments per test case, called in a single loop']
+    table, count = input_table(params, kinds, test_cases)
+    lines.extend(table)
+    args = ', '.join(f'in->a{j}' for j in range(len(params)))
+
+    formats, values = [], []
+    for j, kind in enumerate(kinds):
+        printed = print_value(kind, f'in->a{j}')
+        formats.append(printed[0] if printed else '?')
+        if printed:
+            values.append(printed[1])
+
+    lines.append('')
+    lines.append('int main(void) {')
+    lines.append(f'    for (size_t i = 0; i < {count}; i++) {{')
+    if params:
+        lines.append('        const struct harness_input *in = &harness_inputs[i];')
+    if return_kind[0] == 'void':
+        lines.append(f'        {name}({args});')
+    else:
+        lines.append(f'        {return_type} result = {name}({args});')
+    lines.append('        printf("Test case %zu:\\n", i + 1);')
+    lines.append(f'        printf("Input: ({", ".join(formats)}), Output: "{"".join(", " + v for v in values)});')
+    printed = print_value(return_kind, 'result')
+    if return_kind[0] == 'void':
+        lines.append('        printf("void\\n");')
+    elif printed:
+        lines.append(f'        printf("{printed[0]}\\n", {printed[1]});')
+    elif return_kind[0] == 'pointer':
+        # Addresses change from run to run, only whether there is one is comparable
+        lines.append('        printf("%s\\n", result ? "non-null" : "null");')
+    else:
+        lines.append('        const unsigned char *bytes = (const unsigned char *)&result;')
+        lines.append('        for (size_t b = 0; b < sizeof(result); b++)')
+        lines.append('            printf("%02x", bytes[b]);')
+        lines.append('        printf("\\n");')
+    lines.append('    }')
+    lines.append('    return 0;')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+def render_timing_harness(code, function_info, test_cases, repetitions, warmup, min_sample_ns=1000000):
+    """
+    A harness that times the function over its input table instead of printing its outputs.
+    Passes over the table are repeated until one sample takes at least min_sample_ns, then
+    it prints the number of calls per sample followed by `repetitions` sample times in ns,
+    after `warmup` untimed samples. Results go to a volatile so the calls can't be optimized away.
+    """
+    name = function_info['function_name']
+    return_type, params = split_params(function_info['signature'], name)
+    kinds = [type_kind(p) for p in params]
+    return_kind = type_kind(return_type)
+    return_type = ' '.join(w for w in return_type.split(' ') if w not in QUALIFIERS)
+
+    lines = [code, '', f'{HARNESS_MARKER}: timing runs over one input table', '#include <time.h>']
+    table, count = input_table(params, kinds, test_cases)
+    lines.extend(table)
+    args = ', '.join(f'in->a{j}' for j in range(len(params)))
+    call = f'{name}({args});' if return_kind[0] == 'void' else f'harness_sink = {name}({args});'
+    if return_kind[0] != 'void':
+        lines.append(f'static volatile {return_type} harness_sink;' if return_kind[0] != 'pointer'
+                     else f'static {return_type} volatile harness_sink;')
+    lines.append(f"""
+static long long harness_now_ns(void) {{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}}
+
+static long long harness_sample(size_t passes) {{
+    long long start = harness_now_ns();
+    for (size_t pass = 0; pass < passes; pass++) {{
+        for (size_t i = 0; i < {count}; i++) {{
+{'            const struct harness_input *in = &harness_inputs[i];' if params else ''}
+            {call}
+        }}
+    }}
+    return harness_now_ns() - start;
+}}
+
+int main(void) {{
+    size_t passes = 1;
+    while (harness_sample(passes) < {min_sample_ns}LL && passes < ((size_t)1 << 30))
+        passes *= 2;
+    for (int rep = 0; rep < {warmup}; rep++)
+        harness_sample(passes);
+    printf("%zu\\n", passes * ({count}));
+    for (int rep = 0; rep < {repetitions}; rep++)
+        printf("%lld\\n", harness_sample(passes));
+    return 0;
+}}""")
+    return '\n'.join(lines) + '\n'
+
+def render_coverage_harness(code, function_info, test_cases):
+    """
+    A harness that calls the function once per test case between the coverage runtime's
+    harness_cov_begin and harness_cov_end (see coverage_runtime.c), without printing anything
+    """
+    name = function_info['function_name']
+    _, params = split_params(function_info['signature'], name)
+    kinds = [type_kind(p) for p in params]
+
+    lines = [code, '', f'{HARNESS_MARKER}: coverage of each test case', '#include <stddef.h>']
+    table, count = input_table(params, kinds, test_cases)
+    lines.extend(table)
+    args = ', '.join(f'in->a{j}' for j in range(len(params)))
+    lines.append('')
+    lines.append('void harness_cov_begin(void);')
+    lines.append('void harness_cov_end(size_t test_case);')
+    lines.append('')
+    lines.append('int main(void) {')
+    lines.append(f'    for (size_t i = 0; i < {count}; i++) {{')
+    if params:
+        lines.append('        const struct harness_input *in = &harness_inputs[i];')
+    lines.append('        harness_cov_begin();')
+    lines.append(f'        {name}({args});')
+    lines.append('        harness_cov_end(i);')
+    lines.append('    }')
+    lines.append('    return 0;')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
@@ -1,14 +1,61 @@
 from abc import ABC, abstractmethod
 import os
+import json
 from typing import List, Dict, Tuple
-from paths import REPOS_DIR, LOGGER_DIR
+from paths import REPOS_DIR, LOGGER_DIR, BUILD_CHECKPOINT_DIR
 from utils import setup_logger
 import subprocess
+import shutil
 import re
 from openai import OpenAI 
 from collections import defaultdict
 
+class BuildCheckpoint:
+    """Records which build phases have finished for a repo so that retries can resume"""
+    def __init__(self, repo_path: str, build_system: str, checkpoint_dir: str = None):
+        repo_id = os.path.basename(os.path.normpath(repo_path))
+        self.path = os.path.join(checkpoint_dir or BUILD_CHECKPOINT_DIR, f"{repo_id}.json")
+        self.build_system = build_system
+        self.completed = []
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            # A checkpoint written by a different build system says nothing about this one
+            if data.get("build_system") == build_system:
+                self.completed = data.get("completed", [])
+
+    def is_done(self, phase: str) -> bool:
+        return phase in self.completed
+
+    def mark_done(self, phase: str):
+        if phase not in self.completed:
+            self.completed.append(phase)
+        self.save()
+
+    def clear(self, phases: List[str] = None):
+        """Forget the given phases, or every phase if none are given"""
+        if phases is None:
+            self.completed = []
+        else:
+            self.completed = [p for p in self.completed if p not in phases]
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({"build_system": self.build_system, "completed": self.completed}, f, indent=2)
+
+# Configure-time lookups of a whole package, in autoconf, CMake and Meson
+PACKAGE_CHECKS = r'(?:PKG_CHECK_MODULES|pkg_check_modules|find_package|dependency)'
+
 class BuildSystem(ABC):
+    # Ordered phases of a build. configure_phases are the ones that probe the system for
+    # headers and libraries, and probe_files are the sources those probes are generated from.
+    phases: List[str] = ["build"]
+    configure_phases: List[str] = []
+    probe_files: List[str] = []
+
     @abstractmethod 
     def detect(self, repo_path: str) -> bool:
         pass
@@ -50,39 +97,135 @@ class BuildSystem(ABC):
             "output": output
         }
 
+    def start_build(self, repo_path: str, resume_from: str = None) -> Tuple[BuildCheckpoint, str]:
+        """
+        Load the repo's checkpoint and pick the phase this build starts from.
+        Resuming is only honoured if every phase before resume_from has finished;
+        phases from the starting point onwards are invalidated since they will be re-run.
+        """
+        checkpoint = BuildCheckpoint(repo_path, self.__class__.__name__)
+        start = self.phases[0]
+        if resume_from in self.phases:
+            start = resume_from
+            for phase in self.phases[:self.phases.index(resume_from)]:
+                if not checkpoint.is_done(phase):
+                    start = phase
+                    break
+
+        checkpoint.clear(self.phases[self.phases.index(start):])
+        return checkpoint, start
+
+    def should_run(self, phase: str, start: str) -> bool:
+        return self.phases.index(phase) >= self.phases.index(start)
+
+    def run_phase(self, phase: str, command: str, cwd: str, logger, res: Dict[str, any],
+                  checkpoint: BuildCheckpoint, failure: str) -> bool:
+        """Run a single build phase, checkpointing it on success and recording the failure otherwise"""
+        cmd_result = self.run_command(command, cwd, logger)
+        res["output"] += cmd_result["output"]
+        if not cmd_result["success"]:
+            res["result"] = failure
+            res["failed_phase"] = phase
+            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
+            return False
+
+        checkpoint.mark_done(phase)
+        return True
+
+    def is_probed(self, repo_path: str, headers: List[str]) -> bool:
+        """
+        Check whether any of the headers is probed by a configure step: named by its full path as
+        the probe checks for it (e.g. sys/types.h), or, for a header outside any directory, looked
+        up as a package of the same name (e.g. zlib for zlib.h in PKG_CHECK_MODULES)
+        """
+        for probe_file in self.probe_files:
+            path = os.path.join(repo_path, probe_file)
+            if not os.path.isfile(path):
+                continue
+            with open(path, errors='ignore') as f:
+                content = f.read()
+            for header in headers:
+                if re.search(rf'(?<![\w/.-]){re.escape(header)}(?![\w.])', content):
+                    return True
+                # Bare words like time or string appear everywhere, so a package name only counts in a package check
+                stem = re.escape(header.rsplit('.', 1)[0])
+                if '/' not in header and re.search(rf'{PACKAGE_CHECKS}\s*\([^)]*\b{stem}\b', content, re.IGNORECASE):
+                    return True
+        return False
+
+    def resume_phase(self, repo_path: str, failed_phase: str, missing_headers: List[str]) -> str:
+        """
+        Earliest phase whose outcome newly installed packages can change. A header missing
+        during compilation only forces a re-configure if a configure step checks for it.
+        """
+        if failed_phase not in self.phases:
+            return self.phases[0]
+
+        for phase in self.configure_phases:
+            if self.phases.index(phase) < self.phases.index(failed_phase) and self.is_probed(repo_path, missing_headers):
+                return phase
+        return failed_phase
+
     @abstractmethod
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         pass
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        """
+        Commands, run in order from the repo, that compile every source of an already built repo
+        again, for tools that trace the compiler (e.g. CodeQL). None are known by default.
+        """
+        return []
+
 class MakeBasedSystem(BuildSystem):
     """Base class for make-based build systems"""
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    phases = ["clean", "configure", "make"]
+    configure_phases = ["configure"]
+    probe_files = ["configure"]
+
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
             "output": "",
         }
 
+        checkpoint, start = self.start_build(repo_path, resume_from)
+        self.build_phases(repo_path, logger, res, checkpoint, start)
+        return res
+
+    def build_phases(self, repo_path: str, logger, res: Dict[str, any], checkpoint: BuildCheckpoint, start: str):
+        """Run the clean, configure and make phases from start onwards"""
         # Common cleanup steps
-        self.run_command('make clean', repo_path, logger)
-        self.run_command('make distclean', repo_path, logger)
-        self.run_command('rm -rf autom4te.cache', repo_path, logger)
-        self.run_command('rm -f config.status config.cache config.log', repo_path, logger)
+        if self.should_run("clean", start):
+            self.run_command('make clean', repo_path, logger)
+            self.run_command('make distclean', repo_path, logger)
+            self.run_command('rm -rf autom4te.cache', repo_path, logger)
+            self.run_command('rm -f config.status config.cache config.log', repo_path, logger)
+            checkpoint.mark_done("clean")
+
+        # Run configure if it exists. A failing configure doesn't stop the build, but it
+        # isn't checkpointed either, so a resumed build will run it again.
+        if self.should_run("configure", start):
+            if os.path.exists(os.path.join(repo_path, 'configure')):
+                # Drop cached probe results so newly installed headers are picked up
+                if os.path.exists(os.path.join(repo_path, 'config.cache')):
+                    os.remove(os.path.join(repo_path, 'config.cache'))
+                cmd_result = self.run_command('./configure', repo_path, logger)
+                res["output"] += cmd_result["output"]
+                if cmd_result["success"]:
+                    checkpoint.mark_done("configure")
+            else:
+                checkpoint.mark_done("configure")
 
-        # Run configure if it exists
-        if os.path.exists(os.path.join(repo_path, 'configure')):
-            cmd_result = self.run_command('./configure', repo_path, logger)
-            res["output"] += cmd_result["output"]
+        # Run make, recording the compiler invocations into compile_commands.json when bear is
+        # available. --append keeps the entries of files compiled by earlier, resumed builds.
+        make_cmd = 'bear --append -- make' if shutil.which('bear') else 'make'
+        self.run_phase("make", make_cmd, repo_path, logger, res, checkpoint, "make failed")
 
-        # Run make
-        cmd_result = self.run_command('make', repo_path, logger)
-        res["output"] += cmd_result["output"]
-        
-        if not cmd_result["success"]:
-            res["result"] = "make failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-
-        return res
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        # -B remakes every target, since the sources are all up to date
+        return [f'make -B -j{jobs}']
 
 class MakefileBuildSystem(MakeBasedSystem):
     def detect(self, repo_path: str) -> bool:
@@ -90,39 +233,40 @@ class MakefileBuildSystem(MakeBasedSystem):
         return any(os.path.isfile(os.path.join(repo_path, variant)) for variant in makefile_variants)
 
 class AutotoolsBuildSystem(MakeBasedSystem):
+    phases = ["autoreconf", "clean", "configure", "make"]
+    probe_files = ["configure.ac", "configure.in", "acinclude.m4"]
+
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'configure.ac'))
 
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
             "output": "",
         }
 
-        # Run autoreconf
-        cmd_result = self.run_command('autoreconf -i', repo_path, logger)
-        res["output"] += cmd_result["output"]
-        if not cmd_result["success"]:
-            res["result"] = "autoreconf failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-            return res
+        checkpoint, start = self.start_build(repo_path, resume_from)
 
-        # Run parent class build method (handles configure and make)
-        parent_res = super().build(repo_path, logger)
-        res["output"] += parent_res["output"]
-        
-        if parent_res["result"] != "success":
-            res.update(parent_res)
+        # Run autoreconf
+        if self.should_run("autoreconf", start):
+            if not self.run_phase("autoreconf", 'autoreconf -i', repo_path, logger, res, checkpoint, "autoreconf failed"):
+                return res
 
+        # Run parent class build phases (handles cleanup, configure and make)
+        self.build_phases(repo_path, logger, res, checkpoint, start)
         return res
 
 
 class CMakeBuildSystem(BuildSystem):
+    phases = ["cmake", "make"]
+    configure_phases = ["cmake"]
+    probe_files = ["CMakeLists.txt"]
+
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'CMakeLists.txt'))
         
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -132,30 +276,30 @@ class CMakeBuildSystem(BuildSystem):
         # Create build directory
         build_dir = os.path.join(repo_path, 'build')
         os.makedirs(build_dir, exist_ok=True)
+        checkpoint, start = self.start_build(repo_path, resume_from)
         
-        # Run CMake
-        cmd_result = self.run_command('cmake ..', build_dir, logger)
-        res["output"] += cmd_result["output"]
-        if not cmd_result["success"]:
-            res["result"] = "cmake failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-            return res
+        # Run CMake. The cache remembers failed header and package checks, so it has to go
+        # before re-running them.
+        if self.should_run("cmake", start):
+            if os.path.exists(os.path.join(build_dir, 'CMakeCache.txt')):
+                os.remove(os.path.join(build_dir, 'CMakeCache.txt'))
+            # Export compile_commands.json so function extraction can parse with the project's own flags
+            if not self.run_phase("cmake", 'cmake -DCMAKE_EXPORT_COMPILE_COMMANDS=ON ..', build_dir, logger, res, checkpoint, "cmake failed"):
+                return res
             
         # Run make
-        cmd_result = self.run_command('make', build_dir, logger)
-        res["output"] += cmd_result["output"]
-        if not cmd_result["success"]:
-            res["result"] = "make failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-            
+        self.run_phase("make", 'make', build_dir, logger, res, checkpoint, "make failed")
         return res
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        return [f'cmake --build build --clean-first -j {jobs}']
+
 class SConsBuildSystem(BuildSystem):
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'SConstruct')) or \
                os.path.isfile(os.path.join(repo_path, 'Sconstruct'))
                
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -175,12 +319,15 @@ class SConsBuildSystem(BuildSystem):
             
         return res
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        return ['scons -c', f'scons -j{jobs}']
+
 class BazelBuildSystem(BuildSystem):
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'WORKSPACE')) or \
                os.path.isfile(os.path.join(repo_path, 'WORKSPACE.bazel'))
                
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -200,11 +347,18 @@ class BazelBuildSystem(BuildSystem):
             
         return res
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        return ['bazel clean', f'bazel build --jobs={jobs} //...']
+
 class MesonBuildSystem(BuildSystem):
+    phases = ["setup", "ninja"]
+    configure_phases = ["setup"]
+    probe_files = ["meson.build", "meson_options.txt"]
+
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'meson.build'))
         
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -213,30 +367,29 @@ class MesonBuildSystem(BuildSystem):
         
         build_dir = os.path.join(repo_path, 'build')
         os.makedirs(build_dir, exist_ok=True)
+        checkpoint, start = self.start_build(repo_path, resume_from)
         
-        # Setup build directory
-        cmd_result = self.run_command('meson setup ..', build_dir, logger)
-        res["output"] += cmd_result["output"]
-        if not cmd_result["success"]:
-            res["result"] = "meson setup failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-            return res
+        # Setup build directory, forcing the dependency checks to re-run if it was set up before
+        if self.should_run("setup", start):
+            setup_cmd = 'meson setup ..'
+            if os.path.isdir(os.path.join(build_dir, 'meson-private')):
+                setup_cmd = 'meson setup --reconfigure ..'
+            if not self.run_phase("setup", setup_cmd, build_dir, logger, res, checkpoint, "meson setup failed"):
+                return res
             
         # Run build
-        cmd_result = self.run_command('ninja', build_dir, logger)
-        res["output"] += cmd_result["output"]
-        if not cmd_result["success"]:
-            res["result"] = "ninja failed"
-            res["missing_headers"] = self.find_missing_headers(cmd_result["output"])
-            
+        self.run_phase("ninja", 'ninja', build_dir, logger, res, checkpoint, "ninja failed")
         return res
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        return ['ninja -C build clean', f'ninja -C build -j{jobs}']
+
 class CustomScriptBuildSystem(BuildSystem):
     def detect(self, repo_path: str) -> bool:
         build_scripts = ['build.sh', 'compile.sh', 'make.sh', 'build']
         return any(os.path.isfile(os.path.join(repo_path, script)) for script in build_scripts)
         
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -260,11 +413,18 @@ class CustomScriptBuildSystem(BuildSystem):
                 
         return res
 
+    def rebuild_commands(self, repo_path: str, jobs: int = 1) -> List[str]:
+        # The same script the build ran
+        for script in ['build.sh', 'compile.sh', 'make.sh', 'build']:
+            if os.path.isfile(os.path.join(repo_path, script)):
+                return [f'./{script}']
+        return []
+
 class SlnBuildSystem(BuildSystem):
     def detect(self, repo_path: str) -> bool:
         return any(f.endswith('.sln') for f in os.listdir(repo_path))
         
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -293,7 +453,7 @@ class GradleBuildSystem(BuildSystem):
     def detect(self, repo_path: str) -> bool:
         return os.path.isfile(os.path.join(repo_path, 'build.gradle'))
         
-    def build(self, repo_path: str, logger) -> Dict[str, any]:
+    def build(self, repo_path: str, logger, resume_from: str = None) -> Dict[str, any]:
         res = {
             "result": "success",
             "missing_headers": [],
@@ -313,8 +473,9 @@ class GradleBuildSystem(BuildSystem):
             
         return res
 
-def build_repo(repo_path: str, logger) -> Dict[str, any]:
-    build_systems = [
+def get_build_systems() -> List[BuildSystem]:
+    """Supported build systems, in detection order"""
+    return [
         CustomScriptBuildSystem(),
         SConsBuildSystem(),
         AutotoolsBuildSystem(),
@@ -326,11 +487,21 @@ def build_repo(repo_path: str, logger) -> Dict[str, any]:
         MesonBuildSystem(),
     ]
 
+def build_repo(repo_path: str, logger, resume_from: str = None, alternatives: bool = True) -> Dict[str, any]:
+    """
+    Build a repo with the first build system detected for it. If resume_from is given,
+    phases before it that are checkpointed as finished are skipped. If the build fails and
+    alternatives is set, the other build systems detected for the repo are tried too (see
+    try_alternatives); callers that will retry the build should try them only once they give up.
+    """
+    build_systems = get_build_systems()
+
     res = {
         "build_system": "Unknown",
         "result": "no build system",
         "missing_headers": [],
         "output": "",
+        "failed_phase": None,
         "additional_buildsystems": []
     }
 
@@ -338,29 +509,55 @@ def build_repo(repo_path: str, logger) -> Dict[str, any]:
     for build_system in build_systems:
         if build_system.detect(repo_path):
             print(f"Build system detected: {build_system.__class__.__name__}")
-            build_res = build_system.build(repo_path, logger)
+            build_res = build_system.build(repo_path, logger, resume_from=resume_from)
             
             res["build_system"] = build_system.__class__.__name__
             res.update(build_res)
-            
-            # If build failed, try other build systems
-            if build_res["result"] != "success":
-                print("Primary build system failed, trying alternatives...")
-                for alt_system in build_systems:
-                    if alt_system.__class__.__name__ != res["build_system"]:
-                        if alt_system.detect(repo_path):
-                            alt_res = alt_system.build(repo_path, logger)
-                            if alt_res["result"] == "success":
-                                res["additional_buildsystems"].append({
-                                    "name": alt_system.__class__.__name__,
-                                    "result": "success"
-                                })
-                            
+            # Builds without phases are checkpointed whole, so later stages know how the repo was built
+            if build_res["result"] == "success":
+                BuildCheckpoint(repo_path, res["build_system"]).mark_done(build_system.phases[-1])
+            elif alternatives:
+                try_alternatives(repo_path, logger, res)
             return res
 
     logger.error(f"No supported build system found for {repo_path}")
     return res
 
+def try_alternatives(repo_path: str, logger, res: Dict[str, any]):
+    """
+    After the primary build system of a repo failed, build it with every other build system
+    detected for it, recording those that succeed in res. They clean and reconfigure the tree,
+    so the primary's checkpoint is cleared and a later build of it starts from scratch.
+    """
+    print("Primary build system failed, trying alternatives...")
+    for alt_system in get_build_systems():
+        if alt_system.__class__.__name__ != res["build_system"]:
+            if alt_system.detect(repo_path):
+                alt_res = alt_system.build(repo_path, logger)
+                if alt_res["result"] == "success":
+                    res["additional_buildsystems"].append({
+                        "name": alt_system.__class__.__name__,
+                        "result": "success"
+                    })
+                # The alternative may have cleaned or reconfigured the tree
+                # under the primary build system, so its phases can't be trusted
+                BuildCheckpoint(repo_path, res["build_system"]).clear()
+
+def successful_build_system(repo_path: str, checkpoint_dir: str = None) -> BuildSystem:
+    """The build system whose last build of a repo finished, according to its checkpoint, or None"""
+    for build_system in get_build_systems():
+        checkpoint = BuildCheckpoint(repo_path, build_system.__class__.__name__, checkpoint_dir)
+        if checkpoint.is_done(build_system.phases[-1]):
+            return build_system
+    return None
+
+def get_resume_phase(repo_path: str, build_res: Dict[str, any]) -> str:
+    """Phase to resume a failed build from once its missing packages are installed"""
+    for build_system in get_build_systems():
+        if build_system.__class__.__name__ == build_res["build_system"]:
+            return build_system.resume_phase(repo_path, build_res.get("failed_phase"), build_res["missing_headers"])
+    return None
+
 def main() -> Tuple[Dict[str, List[str]], Dict[str, List[str]], Dict[str, List[str]], List[str]]:
     successes = defaultdict(list)
     failures = defaultdict(list)
@@ -0,0 +1,162 @@
+import os
+import json
+
+'''
+Streaming JSONL storage for extraction output and test results.
+
+Records are appended one per line as they are produced, instead of being held in memory and
+dumped as one big JSON file at the end, so a crash only loses the work since the last checkpoint.
+Readers can go through these files lazily, one record at a time.
+'''
+
+def iter_jsonl(path):
+    """Yield the records of a JSONL file one at a time, skipping blank lines"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def load_records(path):
+    """Records of a .jsonl file, or of a .json file holding a list"""
+    if str(path).endswith('.jsonl'):
+        return list(iter_jsonl(path))
+    with open(path) as f:
+        return json.load(f)
+
+class JsonlWriter:
+    """Appends records to a JSONL file, one line per record"""
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'a')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def tell(self):
+        self.file.flush()
+        return self.file.tell()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def truncate(self, size):
+        """Drop everything after size bytes, e.g. records written after the last checkpoint"""
+        self.file.flush()
+        self.file.truncate(size)
+        self.file.seek(size)
+
+    def close(self):
+        self.file.close()
+
+class JsonlFile:
+    """A JSONL file that can be iterated lazily any number of times without loading it into memory"""
+    def __init__(self, path):
+        self.path = str(path)
+        self._len = None
+
+    def __iter__(self):
+        return iter_jsonl(self.path)
+
+    def __len__(self):
+        if self._len is None:
+            with open(self.path) as f:
+                self._len = sum(1 for line in f if line.strip())
+        return self._len
+
+class JsonlIndex:
+    """
+    Lookup of JSONL records by a key field. A single pass records the byte offset of each
+    record, and records are only parsed when looked up.
+    """
+    def __init__(self, path, key):
+        self.path = str(path)
+        self.offsets = {}
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    self.offsets[json.loads(line)[key]] = offset
+                offset += len(line)
+        self.file = open(self.path, 'rb')
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, key):
+        self.file.seek(self.offsets[key])
+        return json.loads(self.file.readline())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def close(self):
+        self.file.close()
+
+class StreamCheckpoint:
+    """
+    Tracks which units of work (files, repos) have been fully written to a set of JSONL outputs.
+
+    Each save records the size of every output alongside the completed work. On restart the
+    outputs are truncated back to those sizes. Records from a unit that was only partly written
+    when the run died are dropped, and that unit is redone from scratch.
+    """
+    def __init__(self, output_dir, outputs, every=50):
+        self.path = os.path.join(output_dir, 'checkpoint.json')
+        self.writers = {name: JsonlWriter(os.path.join(output_dir, filename)) for name, filename in outputs.items()}
+        self.every = every
+        self.done = {}
+        self.counters = {}
+        self._pending = 0
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.done = {kind: set(items) for kind, items in state['done'].items()}
+            self.counters = state['counters']
+            for name, writer in self.writers.items():
+                writer.truncate(state['offsets'].get(name, 0))
+        else:
+            # Nothing written so far is covered by a checkpoint
+            for writer in self.writers.values():
+                writer.truncate(0)
+
+    def write(self, name, record):
+        self.writers[name].write(record)
+
+    def is_done(self, kind, item):
+        return item in self.done.get(kind, ())
+
+    def mark_done(self, kind, item):
+        """Record a finished unit of work, saving a checkpoint every `every` units"""
+        self.done.setdefault(kind, set()).add(item)
+        self._pending += 1
+        if self._pending >= self.every:
+            self.save()
+
+    def save(self):
+        for writer in self.writers.values():
+            writer.sync()
+        state = {
+            'done': {kind: sorted(items) for kind, items in self.done.items()},
+            'counters': self.counters,
+            'offsets': {name: writer.tell() for name, writer in self.writers.items()},
+        }
+        # Write then rename, so a crash mid-save leaves the previous checkpoint intact
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+        self._pending = 0
+
+    def close(self):
+        self.save()
+        for writer in self.writers.values():
+            writer.close()
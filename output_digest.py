@@ -0,0 +1,113 @@
+import difflib
+import hashlib
+
+'''
+Digests of test harness output, computed as the output streams in.
+
+A harness's output is never held in memory or stored whole. It is hashed as it arrives, both as
+a whole and split into its test cases (at the "Test case N:" line each one starts with), so
+outputs are compared by digest and a mismatch can be narrowed down to the first test case that
+differs. Only the output of one chosen test case is kept, up to a size limit, which is what a
+diff of a mismatch is built from.
+'''
+
+CASE_HEADING = b'Test case '
+# Bytes of a test case's output kept for a diff
+EXCERPT_LIMIT = 4096
+
+class OutputDigest:
+    def __init__(self, keep_case=None, limit=EXCERPT_LIMIT):
+        self._total = hashlib.sha256()
+        self._case = hashlib.blake2b(digest_size=8)
+        # Digests of the output before the first test case and of each finished test case
+        self.cases = []
+        self.size = 0
+        self.digest = None
+        # Index in cases of the segment whose output is kept, up to limit bytes
+        self.keep_case = keep_case
+        self.limit = limit
+        self.excerpt = bytearray()
+        self.truncated = False
+        # Start of the current line while it's too short to tell whether it begins a test case
+        self._pending = bytearray()
+
+    def _add(self, data):
+        self._case.update(data)
+        if self.keep_case == len(self.cases):
+            room = self.limit - len(self.excerpt)
+            self.excerpt += data[:room]
+            self.truncated = self.truncated or len(data) > room
+
+    def _flush_pending(self):
+        line, self._pending = bytes(self._pending), None
+        if line.startswith(CASE_HEADING):
+            self.cases.append(self._case.hexdigest())
+            self._case = hashlib.blake2b(digest_size=8)
+        self._add(line)
+
+    def feed(self, data):
+        self._total.update(data)
+        self.size += len(data)
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start)
+            end = len(data) if end == -1 else end + 1
+            piece = data[start:end]
+            start = end
+            if self._pending is not None:
+                self._pending += piece
+                if len(self._pending) < len(CASE_HEADING) and not piece.endswith(b'\n'):
+                    continue
+                self._flush_pending()
+            else:
+                self._add(piece)
+            if piece.endswith(b'\n'):
+                self._pending = bytearray()
+
+    def finish(self):
+        if self._pending:
+            self._flush_pending()
+        self._pending = None
+        self.cases.append(self._case.hexdigest())
+        self.digest = self._total.hexdigest()
+        return self
+
+    def summary(self):
+        """What's needed to compare another output with this one, e.g. to store it"""
+        return {'digest': self.digest, 'size': self.size, 'cases': self.cases}
+
+    def text(self):
+        return self.excerpt.decode(errors='replace')
+
+    def __eq__(self, other):
+        return isinstance(other, OutputDigest) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+def digest_text(text, keep_case=None):
+    """Digest of an output that is already in memory"""
+    digest = OutputDigest(keep_case)
+    digest.feed(text.encode())
+    return digest.finish()
+
+def first_difference(cases, other_cases):
+    """Index of the first segment in which two outputs differ, counting a missing one as different"""
+    for index, (case, other) in enumerate(zip(cases, other_cases)):
+        if case != other:
+            return index
+    return min(len(cases), len(other_cases))
+
+def bounded_diff(original, generated, index):
+    """Unified diff of the kept outputs of one test case of two harnesses"""
+    diff = ''.join(difflib.unified_diff(
+        original.text().splitlines(keepends=True),
+        generated.text().splitlines(keepends=True),
+        fromfile='Original',
+        tofile='Generated'
+    ))
+    where = f"test case {index}" if index else "the output before the first test case"
+    if not diff:
+        return f"Outputs differ in {where}, which matched when run again"
+    truncated = original.truncated or generated.truncated
+    return f"Outputs differ from {where} on{' (first ' + str(EXCERPT_LIMIT) + ' bytes)' if truncated else ''}:\n{diff}"
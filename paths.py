@@ -8,8 +8,20 @@ REPOS_DIR = f'repos/'
 LOGGER_DIR = f'logs/{CLONED_REPO_ID}_{TEST_ID}_{time.strftime("%Y-%m-%d_%H-%M-%S")}'
 REPO_LIST = 'json/repos_easy_10.json'
 SELF_EQUIV_OUTPUT_DIR = f"self_equiv_tests/{CLONED_REPO_ID}_{TEST_ID}"
+CORPUS_OUTPUT_DIR = f"{SELF_EQUIV_OUTPUT_DIR}/corpus"
+BUILD_CHECKPOINT_DIR = f'build_checkpoints/{CLONED_REPO_ID}'
+CACHE_DIR = 'cache/'
+EXTRACTION_CACHE_PATH = os.path.join(CACHE_DIR, 'extraction_cache.sqlite')
+SYMBOL_INDEX_DIR = os.path.join(CACHE_DIR, 'symbol_index')
+SLICE_INDEX_DIR = os.path.join(CACHE_DIR, 'slice_index')
+GOLDEN_CACHE_PATH = os.path.join(CACHE_DIR, 'golden_outputs.sqlite')
+HARNESS_OBJECT_DIR = os.path.join(CACHE_DIR, 'harness_objects')
+FUZZ_REPRODUCERS_PATH = os.path.join(CACHE_DIR, 'fuzz_reproducers.jsonl')
+ARTIFACT_DIR = os.path.join(CACHE_DIR, 'build_artifacts')
+BENCHMARK_DIR = 'benchmarks/'
+CODEQL_DB_DIR = 'codeql_databases/'
 
-directories = [REPOS_DIR, LOGGER_DIR, SELF_EQUIV_OUTPUT_DIR, 'json', SELF_EQUIV_OUTPUT_DIR]
+directories = [REPOS_DIR, LOGGER_DIR, SELF_EQUIV_OUTPUT_DIR, 'json', SELF_EQUIV_OUTPUT_DIR, CORPUS_OUTPUT_DIR, BUILD_CHECKPOINT_DIR, CACHE_DIR, SYMBOL_INDEX_DIR, SLICE_INDEX_DIR, BENCHMARK_DIR, CODEQL_DB_DIR]
 for directory in directories:
     if not os.path.exists(directory):
         os.makedirs(directory)
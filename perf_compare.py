@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import uuid
+import random
+import tempfile
+import statistics
+import subprocess
+from jsonl_store import load_records
+from harness_table import render_timing_harness
+from harness_build import split_harness, replace_function, fixed_harness_source, compile_weak_object
+
+'''
+Compare the speed of a generated function with the original's.
+
+Both are built at the same optimization level into timing harnesses that call the function over
+the function's input table (see render_timing_harness). The table and timing loop are compiled
+separately from the function, into a weak object as in the equivalence tests, so the compiler
+can't inline the function into the loop or hoist the calls out of it for one side only. If the
+harness can't be split that way, both sides are compiled whole.
+
+Each harness calibrates how many passes over the table make up one sample, runs a few untimed
+warmup samples, then prints its sample times. Original and candidate are run in alternating
+rounds pinned to one CPU (where the platform allows), so drift in machine load hits both alike.
+The speedup is the ratio of the median time per call of the original to the candidate's, with a
+bootstrap confidence interval. The verdict is 'faster' or 'slower' only when the whole interval
+is past the tolerance, otherwise 'same'.
+
+Usage:
+python perf_compare.py <functions_file> <tests_file> <function_name> <candidate.c> [opt_level]
+'''
+
+BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE = 0.95
+
+def default_cpu():
+    """CPU timing runs are pinned to, the last one this process may run on, or None if pinning isn't supported"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    return max(os.sched_getaffinity(0))
+
+def bootstrap_speedup(original, candidate, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE):
+    """Confidence interval of the ratio of median times, from resampling both sets of samples"""
+    rng = random.Random(0)
+    ratios = sorted(
+        statistics.median(rng.choices(original, k=len(original))) /
+        statistics.median(rng.choices(candidate, k=len(candidate)))
+        for _ in range(resamples)
+    )
+    tail = (1 - confidence) / 2
+    return ratios[int(tail * (resamples - 1))], ratios[int((1 - tail) * (resamples - 1))]
+
+def verdict(ci_low, ci_high, tolerance):
+    if ci_low > 1 + tolerance:
+        return 'faster'
+    if ci_high < 1 - tolerance:
+        return 'slower'
+    return 'same'
+
+def sample_stats(samples):
+    return {
+        'median_ns': statistics.median(samples),
+        'mean_ns': statistics.mean(samples),
+        'stdev_ns': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'samples': len(samples),
+    }
+
+class PerformanceComparer:
+    def __init__(self, compiler='gcc', opt_level='-O2', repetitions=30, warmup=3, rounds=3, cpu=-1,
+                 timeout=60, tolerance=0.05, build_dir=None):
+        self.compiler = compiler
+        self.flags = [opt_level, '-w']
+        # Samples per run, untimed samples before them and runs per side
+        self.repetitions = repetitions
+        self.warmup = warmup
+        self.rounds = rounds
+        # -1 picks default_cpu(), None doesn't pin
+        self.cpu = default_cpu() if cpu == -1 else cpu
+        self.timeout = timeout
+        # Relative difference in speed below which candidates count as the same
+        self.tolerance = tolerance
+        # Where harnesses are built, the system's temporary directory if None
+        self.build_dir = build_dir
+
+    def _pin(self):
+        os.sched_setaffinity(0, {self.cpu})
+
+    def _build_path(self, suffix):
+        return os.path.join(self.build_dir or tempfile.gettempdir(), uuid.uuid4().hex + suffix)
+
+    def build(self, timing_harness, source, replacement, timing_object):
+        """
+        Executable of a timing harness with source replaced by replacement, linked against
+        timing_object if there is one and compiled whole otherwise. Returns (path, error); path
+        is None if the build failed.
+        """
+        executable = self._build_path('.perf')
+        harness = replace_function(timing_harness, source, replacement)
+        if timing_object is not None:
+            result = subprocess.run([self.compiler] + self.flags + ['-x', 'c', '-', '-x', 'none', timing_object, '-o', executable],
+                                    input=split_harness(harness), capture_output=True, text=True)
+        else:
+            result = subprocess.run([self.compiler] + self.flags + ['-x', 'c', '-', '-o', executable],
+                                    input=harness, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr
+        return executable, None
+
+    def build_pair(self, timing_harness, original_source, generated_source, timing_object, executables):
+        """
+        Executables of the original and the candidate, built the same way: both linked against
+        timing_object or, if there is none or that fails for either side, both compiled whole,
+        so the compiler never gets to inline the function for one side only. Built executables
+        are added to executables. Returns (paths, separate, error); paths is None if the build failed.
+        """
+        for objects in ([timing_object] if timing_object is not None else []) + [None]:
+            paths = []
+            for source in (original_source, generated_source):
+                executable, error = self.build(timing_harness, original_source, source, objects)
+                if executable is None:
+                    break
+                paths.append(executable)
+                executables.append(executable)
+            else:
+                return paths, objects is not None, None
+        return None, False, error
+
+    def run(self, executable):
+        """Times per call in ns of each sample of one run of a timing harness"""
+        result = subprocess.run([executable], capture_output=True, text=True, timeout=self.timeout, check=True,
+                                preexec_fn=self._pin if self.cpu is not None else None)
+        calls, *samples = (int(line) for line in result.stdout.split())
+        return [sample / calls for sample in samples]
+
+    def compare(self, harness, function_info, test_cases, original_source, generated_source):
+        """
+        Speed of a generated function relative to the original, over the same inputs as the
+        equivalence harness. Returns a dict with each side's timing statistics, the speedup
+        (original time / candidate time, above 1 when the candidate is faster), its confidence
+        interval and the verdict, or with an 'error' if either side couldn't be built or run.
+        """
+        timing = render_timing_harness(split_harness(harness), function_info, test_cases,
+                                       self.repetitions, self.warmup)
+        object_file = self._build_path('.o')
+        timing_object = None
+        executables = []
+        try:
+            fixed = fixed_harness_source(timing, original_source, function_info.get('body_offset'))
+            if fixed is not None and compile_weak_object(self.compiler, self.flags, fixed, object_file).returncode == 0:
+                timing_object = object_file
+            paths, separate, error = self.build_pair(timing, original_source, generated_source, timing_object, executables)
+            if paths is None:
+                return {'error': f"Timing harness failed to compile: {error}"}
+
+            samples = ([], [])
+            for round_index in range(self.rounds):
+                # Alternate which side goes first so neither always runs on a warmer machine
+                order = (0, 1) if round_index % 2 == 0 else (1, 0)
+                for side in order:
+                    samples[side].extend(self.run(paths[side]))
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            return {'error': f"Timing run failed: {e}"}
+        finally:
+            for path in executables + [object_file]:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+        original, candidate = samples
+        ci_low, ci_high = bootstrap_speedup(original, candidate)
+        return {
+            'opt_level': self.flags[0],
+            'separate_compilation': separate,
+            'original': sample_stats(original),
+            'candidate': sample_stats(candidate),
+            'speedup': statistics.median(original) / statistics.median(candidate),
+            'confidence_interval': [ci_low, ci_high],
+            'verdict': verdict(ci_low, ci_high, self.tolerance),
+        }
+
+def main():
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python perf_compare.py <functions_file> <tests_file> <function_name> <candidate.c> [opt_level]")
+        sys.exit(1)
+
+    functions_file, tests_file, function_name, candidate_file = sys.argv[1:5]
+    function_info = next(f for f in load_records(functions_file) if f['function_name'] == function_name)
+    test_info = next(t for t in load_records(tests_file) if t['function_name'] == function_name)
+    with open(candidate_file) as f:
+        candidate_source = f.read().strip()
+
+    comparer = PerformanceComparer(opt_level=sys.argv[5] if len(sys.argv) == 6 else '-O2')
+    result = comparer.compare(test_info['harness'], function_info, test_info['test_cases'],
+                              function_info['source'], candidate_source)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
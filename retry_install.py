@@ -1,7 +1,7 @@
 import os
 import subprocess
 from typing import List
-from install_repos import build_repo  # Assuming your existing code is in a file called build_script.py
+from install_repos import build_repo, get_resume_phase, try_alternatives  # Assuming your existing code is in a file called build_script.py
 from utils import setup_logger  # Assumed to be available from your original script
 from paths import REPOS_DIR, LOGGER_DIR  # Assumed to be available from your original script
 
@@ -130,8 +130,12 @@ def install_missing_headers(missing_headers: List[str], logger) -> bool:
 def retry_build(repo_path: str, logger, stats: StatsTracker, max_retries: int = num_tries):
     """
     Attempt to build the repo, retrying up to max_retries times if missing header errors occur.
+    Retries resume from the earliest build phase the newly installed packages can affect,
+    instead of rebuilding from scratch. Alternative build systems only run once the retries are
+    over, since they clean the tree the retries resume in.
     """
-    build_system, result, missing_headers, output = build_repo(repo_path, logger)
+    build_res = build_repo(repo_path, logger, alternatives=False)
+    missing_headers = build_res["missing_headers"]
     error_type = "other" if not missing_headers else "missing_header"
 
     retries = 0
@@ -141,10 +145,19 @@ def retry_build(repo_path: str, logger, stats: StatsTracker, max_retries: int =
             logger.error("Failed to resolve missing headers. Aborting retries.")
             break
 
-        logger.info("Retrying build...")
-        build_system, result, missing_headers, output = build_repo(repo_path, logger)
+        resume_from = get_resume_phase(repo_path, build_res)
+        logger.info(f"Retrying build from phase: {resume_from}")
+        build_res = build_repo(repo_path, logger, resume_from=resume_from, alternatives=False)
+        missing_headers = build_res["missing_headers"]
         retries += 1
 
+    if build_res["result"] != "success" and build_res["build_system"] != "Unknown":
+        try_alternatives(repo_path, logger, build_res)
+
+    build_system = build_res["build_system"]
+    result = build_res["result"] == "success"
+    output = build_res["output"]
+
     # Update the error type based on the final result
     if not result and not missing_headers:
         error_type = "configure_error" if "./configure" in output else "other"
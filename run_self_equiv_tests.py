@@ -2,17 +2,130 @@ import json
 import subprocess
 import tempfile
 from pathlib import Path
-import difflib
 import sys
 import os
 import logging
+import argparse
+import hashlib
+import threading
+import queue
+import shutil
+import uuid
+import math
+import time
+import weakref
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from jsonl_store import JsonlFile, JsonlIndex, JsonlWriter, iter_jsonl, load_records
+from golden_cache import GoldenOutputCache, compiler_id
+from harness_build import split_harness, replace_function, fixed_harness_source, compile_weak_object
+from perf_compare import PerformanceComparer
+from differential_fuzzer import DifferentialFuzzer
+from build_artifacts import BuildArtifacts, link_objects
+from harness_table import render_harness
+from fork_server import ForkServer, LIBRARY_FLAGS, library_source
+from output_digest import OutputDigest, first_difference, bounded_diff
+from paths import GOLDEN_CACHE_PATH, HARNESS_OBJECT_DIR, FUZZ_REPRODUCERS_PATH
+
+# Compiled harnesses go to a RAM-backed directory when there is one that allows executing files
+SCRATCH_ROOTS = ['/dev/shm']
+SCRATCH_PREFIX = 'r2e_harness_'
+# Streamed record of every candidate's result, in the output directory
+RESULTS_FILE = 'results.jsonl'
+# Bytes of harness output read at a time
+OUTPUT_CHUNK_SIZE = 1 << 16
+
+def scratch_root():
+    for root in SCRATCH_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK) and not os.statvfs(root).f_flag & os.ST_NOEXEC:
+            return root
+    return tempfile.gettempdir()
+
+def remove_stale_scratch_dirs(root):
+    """Remove scratch directories left behind by runners that died without cleaning up"""
+    for name in os.listdir(root):
+        if not name.startswith(SCRATCH_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SCRATCH_PREFIX):].split('_')[0])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        except (ValueError, PermissionError):
+            pass
+
+def make_scratch_dir():
+    """A private directory for this process's build outputs, named after its pid so it can be cleaned up later"""
+    root = scratch_root()
+    remove_stale_scratch_dirs(root)
+    return tempfile.mkdtemp(prefix=f'{SCRATCH_PREFIX}{os.getpid()}_', dir=root)
 
 class TestRunner:
-    def __init__(self, functions_file, tests_file, output_dir="test_results"):
+    def __init__(self, functions_file, tests_file, output_dir="test_results", golden_cache_path=GOLDEN_CACHE_PATH,
+                 refresh_golden=False, workers=1, object_cache_dir=HARNESS_OBJECT_DIR, fork_server=False,
+                 stop_at_first_pass=False, perf=None, fuzzer=None, reproducers_path=FUZZ_REPRODUCERS_PATH, resume=False,
+                 artifacts=None):
+        self.compiler = 'gcc'
         self.gcc_flags = ['-O0', '-Wall', '-Wextra']
+        # Outputs of the original harnesses are reused across candidates and runs; refresh_golden recomputes them
+        self.golden = GoldenOutputCache(golden_cache_path) if golden_cache_path else None
+        self.refresh_golden = refresh_golden
+        # Tests are compiled and run on this many threads; the work happens in gcc and the test binaries
+        self.workers = workers
+        # With several candidates per function, don't evaluate the rest once one passes
+        self.stop_at_first_pass = stop_at_first_pass
+        # A PerformanceComparer (see perf_compare.py) also times passing candidates against the
+        # original. Timing runs take turns so tests running alongside disturb them less.
+        self.perf = perf
+        self._perf_lock = threading.Lock()
+        # A DifferentialFuzzer (see differential_fuzzer.py) also fuzzes candidates that pass their
+        # harness against the original. Inputs a candidate is found to diverge on are stored in
+        # reproducers_path and added to the function's test cases for every later candidate and run.
+        self.fuzzer = fuzzer
+        self.reproducers_path = reproducers_path
+        self.reproducers = defaultdict(list)
+        self._reproducer_lock = threading.Lock()
+        if reproducers_path and os.path.exists(reproducers_path):
+            for record in iter_jsonl(reproducers_path):
+                self.reproducers[(record['function_name'], record['original_hash'])].append(record['test_case'])
+        self.timeout = 5
+        # The fixed part of each harness (input table, main, context) is compiled once into an object
+        # here, and candidates are compiled on their own and linked against it. None compiles everything.
+        self.object_cache_dir = object_cache_dir
+        self._failed_objects = set()
+        self._object_lock = threading.Lock()
+        # Build harnesses as shared libraries and run them in children of fork servers (see fork_server.py)
+        self.fork_server = fork_server
+        self._servers = queue.SimpleQueue()
+        # A BuildArtifacts (see build_artifacts.py) links harnesses against the objects the repo's
+        # build produced instead of compiling functions from source, where it can find them
+        if artifacts is not None and fork_server:
+            raise ValueError("Harnesses linked against a repo's build can't be run in a fork server")
+        self.artifacts = artifacts
+        self._function_artifacts = {}
+        self._artifact_lock = threading.Lock()
+        # Sources are piped to the compiler; only binaries are written, to a scratch directory in
+        # RAM that is removed when the runner goes away
+        self.scratch_dir = make_scratch_dir()
+        self._remove_scratch_dir = weakref.finalize(self, shutil.rmtree, self.scratch_dir, True)
+        for tool in (self.perf, self.fuzzer):
+            if tool is not None and tool.build_dir is None:
+                tool.build_dir = self.scratch_dir
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Each candidate's result is appended to the results file as soon as it is known. With
+        # resume, results already in the file are reused instead of testing those candidates again;
+        # otherwise the file starts over.
+        self.results_file = self.output_dir / RESULTS_FILE
+        self.completed = {}
+        self._results_lock = threading.Lock()
+        complete_size = 0
+        if resume and self.results_file.exists():
+            records, complete_size = load_result_records(self.results_file)
+            self.completed = {result_key(record): record for record in records}
+        self._results_writer = JsonlWriter(self.results_file)
+        self._results_writer.truncate(complete_size)
         
         # Set up logging
         log_file = self.output_dir / f"test_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
@@ -25,27 +138,103 @@ class TestRunner:
             ]
         )
         
-        # Load test data
-        with open(functions_file) as f:
-            self.functions = json.load(f)
-        with open(tests_file) as f:
-            self.test_cases = json.load(f)
+        # Load test data. JSONL files from a streamed extraction run are read lazily: functions
+        # are iterated from disk and test cases are looked up by offset when needed.
+        if str(functions_file).endswith('.jsonl'):
+            self.functions = JsonlFile(functions_file)
+        else:
+            with open(functions_file) as f:
+                self.functions = json.load(f)
+        if str(tests_file).endswith('.jsonl'):
+            self.test_cases = JsonlIndex(tests_file, key='function_name')
+        else:
+            with open(tests_file) as f:
+                self.test_cases = json.load(f)
             
         logging.info(f"Loaded {len(self.functions)} functions and their test cases")
 
-    def compile_and_run(self, source_code, function_name):
-        """Compile and run a test harness"""
-        with tempfile.NamedTemporaryFile(suffix='.c', mode='w', delete=False) as f:
-            f.write(source_code)
-            source_file = f.name
-            
-        executable = source_file + '.exe'
+    def compile_flags(self):
+        """Flags every harness and harness object is compiled with"""
+        return self.gcc_flags + (['-fPIC'] if self.fork_server else [])
+
+    def run_in_fork_server(self, library, function_name, digest):
+        """Digest of the output of a harness library run by one of the fork servers, or None if it timed out or failed to load"""
+        try:
+            server = self._servers.get_nowait()
+        except queue.Empty:
+            # At most one server per worker thread is ever created
+            server = ForkServer(self.compiler)
+        try:
+            reply = server.run(library, self.timeout, digest.feed)
+        except (RuntimeError, OSError) as e:
+            # The dead server is dropped and a new one takes its place
+            logging.error(f"Error running tests for {function_name}: the fork server died ({e})")
+            server.close(kill=True)
+            self._servers.put(ForkServer(self.compiler))
+            return None
+        self._servers.put(server)
+        if reply['status'] == 'timeout':
+            logging.error(f"Timeout running tests for {function_name}")
+            return None
+        if reply['status'] == 'error':
+            logging.error(f"Error running tests for {function_name}: could not load the harness library")
+            return None
+        return digest.finish()
+
+    def run_executable(self, executable, function_name, digest):
+        """Digest of the output of a harness executable, hashed as it is read, or None if it timed out"""
+        process = subprocess.Popen([executable], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(self.timeout, kill)
+        timer.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read1(OUTPUT_CHUNK_SIZE), b''):
+                digest.feed(chunk)
+            process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+        if timed_out.is_set():
+            logging.error(f"Timeout running tests for {function_name}")
+            return None
+        return digest.finish()
+
+    def close(self):
+        """Stop the fork servers and remove the scratch directory"""
+        while True:
+            try:
+                self._servers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._remove_scratch_dir()
+        self._results_writer.close()
+
+    def compile_and_run(self, source_code, function_name, objects=(), keep_case=None):
+        """
+        Compile and run a test harness, linked with already compiled objects (and libraries) if
+        given, or only link the objects if source_code is None. Returns the digest of its output
+        (see output_digest.py), which keeps the output of test case keep_case if given, or None
+        if it failed to compile or timed out.
+        """
+        if self.fork_server:
+            source_code = library_source(source_code)
+        executable = os.path.join(self.scratch_dir, uuid.uuid4().hex + ('.so' if self.fork_server else '.exe'))
         
         try:
-            # Compile
-            compile_cmd = ['gcc'] + self.gcc_flags + [source_file, '-o', executable]
+            # Compile the source from stdin; -x none switches back to telling objects by their extension
+            source_args = ['-x', 'c', '-', '-x', 'none'] if source_code is not None else []
+            compile_cmd = [self.compiler] + self.compile_flags() + source_args + list(objects) + ['-o', executable]
+            if self.fork_server:
+                compile_cmd += LIBRARY_FLAGS
             compile_result = subprocess.run(
                 compile_cmd,
+                input=source_code,
                 capture_output=True,
                 text=True
             )
@@ -56,69 +245,222 @@ class TestRunner:
                 return None
                 
             # Run
-            run_result = subprocess.run(
-                [executable],
-                capture_output=True,
-                text=True,
-                timeout=5  # 5 second timeout
-            )
-            
-            return run_result.stdout
+            digest = OutputDigest(keep_case)
+            if self.fork_server:
+                return self.run_in_fork_server(executable, function_name, digest)
+            return self.run_executable(executable, function_name, digest)
             
-        except subprocess.TimeoutExpired:
-            logging.error(f"Timeout running tests for {function_name}")
-            return None
         except Exception as e:
             logging.error(f"Error running tests for {function_name}: {e}")
             return None
         finally:
             # Cleanup
-            if os.path.exists(source_file):
-                os.unlink(source_file)
             if os.path.exists(executable):
                 os.unlink(executable)
 
+    def function_artifact(self, orig_func):
+        """The repo build's objects a function's harness is linked against, or None to compile it from source"""
+        if self.artifacts is None or 'file_path' not in orig_func:
+            return None
+        key = reproducer_key(orig_func)
+        with self._artifact_lock:
+            if key in self._function_artifacts:
+                return self._function_artifacts[key]
+        artifact = self.artifacts.function_artifact(orig_func['file_path'], orig_func['function_name'])
+        with self._artifact_lock:
+            return self._function_artifacts.setdefault(key, artifact)
+
+    def drop_artifact(self, orig_func):
+        """Compile a function from source from now on, e.g. because its harness didn't link against the build"""
+        with self._artifact_lock:
+            self._function_artifacts[reproducer_key(orig_func)] = None
+
+    def run_original(self, harness, orig_func, artifact=None, keep_case=None):
+        """Output digest of an original function's harness, linked against the repo's build if artifact is given"""
+        function_name = orig_func['function_name']
+        harness_object = self.harness_object(harness, orig_func) if artifact is not None else None
+        if harness_object is None:
+            return self.compile_and_run(harness, function_name, keep_case=keep_case)
+        # Nothing is compiled: the harness object already holds the table and main
+        return self.compile_and_run(None, function_name, objects=link_objects(artifact, [harness_object], replace=False),
+                                    keep_case=keep_case)
+
+    def original_output(self, harness, orig_func, artifact=None):
+        """
+        Summary of the output of an original function's harness (its digests, see
+        OutputDigest.summary), from the golden output cache if it has been run before. With an
+        artifact, the harness is linked against the repo's build (see function_artifact).
+        """
+        if self.golden is None:
+            output = self.run_original(harness, orig_func, artifact)
+            return output.summary() if output is not None else None
+
+        # Outputs of the repo's objects are kept apart from those of the pasted source
+        key = self.golden.make_key(harness if artifact is None else f"{harness}\0{artifact['digest']}",
+                                   self.compiler, self.gcc_flags)
+        if not self.refresh_golden:
+            output = self.golden.get(key)
+            if output is not None:
+                return output
+
+        output = self.run_original(harness, orig_func, artifact)
+        if output is None:
+            return None
+        self.golden.put(key, orig_func['function_name'], output.summary())
+        return output.summary()
+
+    def harness_object(self, harness, orig_func):
+        """
+        Object file with everything in a harness except the function under test, which is left
+        as a prototype. All its definitions are made weak, so the copies of types' helpers,
+        globals and callees that come with a candidate take their place when linked. None if
+        the harness can't be split.
+        """
+        if self.object_cache_dir is None:
+            return None
+        fixed = fixed_harness_source(harness, orig_func['source'], orig_func.get('body_offset'))
+        if fixed is None:
+            return None
+        if self.fork_server:
+            fixed = library_source(fixed)
+
+        settings = json.dumps([compiler_id(self.compiler), self.compile_flags()])
+        key = hashlib.sha256(f'{settings}\0{fixed}'.encode()).hexdigest()
+        path = os.path.join(self.object_cache_dir, f'{key}.o')
+        if os.path.exists(path):
+            return path
+        with self._object_lock:
+            if key in self._failed_objects:
+                return None
+
+        os.makedirs(self.object_cache_dir, exist_ok=True)
+        # Built in the scratch directory and moved into the cache once complete
+        object_file = os.path.join(self.scratch_dir, f'{uuid.uuid4().hex}.o')
+        try:
+            compiled = compile_weak_object(self.compiler, self.compile_flags(), fixed, object_file)
+            if compiled.returncode != 0:
+                logging.warning(f"Compiling the harness separately failed, compiling it whole: {compiled.stderr}")
+                with self._object_lock:
+                    self._failed_objects.add(key)
+                return None
+            # Copied next to its final name first (the scratch directory may be another filesystem),
+            # then renamed, so other threads and runs never see a partial object. Another thread may
+            # have built the same object; either copy is fine.
+            partial = f'{path}.{uuid.uuid4().hex}.tmp'
+            shutil.move(object_file, partial)
+            os.replace(partial, path)
+            return path
+        except OSError as e:
+            logging.warning(f"Compiling the harness separately failed, compiling it whole: {e}")
+            with self._object_lock:
+                self._failed_objects.add(key)
+            return None
+        finally:
+            if os.path.exists(object_file):
+                os.unlink(object_file)
+
+    def candidate_output(self, harness, orig_func, generated_source, function_name, keep_case=None, artifact=None):
+        """
+        Output digest of a harness with the original function replaced by a generated one,
+        linked against the repo's build if artifact is given
+        """
+        generated_harness = replace_function(harness, orig_func['source'], generated_source)
+        harness_object = self.harness_object(harness, orig_func)
+        if harness_object is None:
+            return self.compile_and_run(generated_harness, function_name, keep_case=keep_case)
+        # Only the code in front of the harness's table and main is compiled for the candidate
+        candidate_code = split_harness(generated_harness)
+        if artifact is None:
+            return self.compile_and_run(candidate_code, function_name, objects=[harness_object], keep_case=keep_case)
+
+        # Everything but the function itself is weak in the candidate's object, so it replaces the
+        # build's function (weak in the replaceable copy) and the build's definitions of the rest win
+        candidate_object = os.path.join(self.scratch_dir, f'{uuid.uuid4().hex}.o')
+        try:
+            compiled = compile_weak_object(self.compiler, self.compile_flags(), candidate_code, candidate_object,
+                                           keep=(function_name,))
+            if compiled.returncode != 0:
+                logging.error(f"Compilation failed for {function_name}:")
+                logging.error(compiled.stderr)
+                return None
+            objects = link_objects(artifact, [candidate_object, harness_object], replace=True)
+            return self.compile_and_run(None, function_name, objects=objects, keep_case=keep_case)
+        finally:
+            if os.path.exists(candidate_object):
+                os.unlink(candidate_object)
+
+    def function_harness(self, orig_func, test_info):
+        """A function's test harness, with the inputs fuzzing found added to its test cases"""
+        with self._reproducer_lock:
+            found = list(self.reproducers.get(reproducer_key(orig_func), ()))
+        if not found or 'test_cases' not in test_info:
+            return test_info['harness']
+        return render_harness(split_harness(test_info['harness']), orig_func, test_info['test_cases'] + found)
+
+    def add_reproducer(self, orig_func, test_case):
+        """Add an input a candidate diverged on to a function's test cases"""
+        function_name, original_hash = reproducer_key(orig_func)
+        with self._reproducer_lock:
+            self.reproducers[(function_name, original_hash)].append(test_case)
+            if self.reproducers_path:
+                writer = JsonlWriter(self.reproducers_path)
+                writer.write({'function_name': function_name, 'original_hash': original_hash, 'test_case': test_case})
+                writer.close()
+
+    def compare_candidate(self, harness, original_func, generated_func, original_output, artifact=None):
+        """Run a generated function's harness and compare its output with the original's"""
+        # Run the harness with the generated function in place of the original implementation
+        generated_output = self.candidate_output(
+            harness,
+            original_func,
+            generated_func['source'],
+            generated_func['function_name'],
+            artifact=artifact
+        )
+        
+        if generated_output is None:
+            return False, "Generated function failed to compile/run"
+            
+        # Compare outputs by their digests
+        if original_output['digest'] == generated_output.digest:
+            return True, "Outputs match exactly"
+            
+        # Only on a mismatch are both run again, keeping the output of the first test case that
+        # differs, so the diff stays small however much the harness prints
+        index = first_difference(original_output['cases'], generated_output.cases)
+        original_case = self.run_original(harness, original_func, artifact, keep_case=index)
+        generated_case = self.candidate_output(harness, original_func, generated_func['source'],
+                                               generated_func['function_name'], keep_case=index, artifact=artifact)
+        if original_case is None or generated_case is None:
+            return False, f"Outputs differ from test case {index} on"
+        return False, bounded_diff(original_case, generated_case, index)
+
     def run_equivalence_test(self, original_func, generated_func):
         """Run equivalence test between original and generated function"""
         test_info = self.test_cases[original_func['function_name']]
+        harness = self.function_harness(original_func, test_info)
         
         # Run original function tests
-        original_output = self.compile_and_run(
-            test_info['harness'],
-            original_func['function_name']
-        )
+        artifact, original_output = self.original_with_fallback(harness, original_func)
         
         if original_output is None:
             return False, "Original function failed to compile/run"
             
-        # Create harness for generated function by replacing the function implementation
-        generated_harness = test_info['harness'].replace(
-            original_func['source'],
-            generated_func['source']
-        )
-        
-        # Run generated function tests
-        generated_output = self.compile_and_run(
-            generated_harness,
-            generated_func['function_name']
-        )
-        
-        if generated_output is None:
-            return False, "Generated function failed to compile/run"
-            
-        # Compare outputs
-        if original_output == generated_output:
-            return True, "Outputs match exactly"
-            
-        # Generate detailed diff if outputs don't match
-        diff = list(difflib.unified_diff(
-            original_output.splitlines(),
-            generated_output.splitlines(),
-            fromfile='Original',
-            tofile='Generated'
-        ))
-        
-        return False, f"Outputs differ:\n{''.join(diff)}"
+        return self.compare_candidate(harness, original_func, generated_func, original_output, artifact)
+
+    def original_with_fallback(self, harness, orig_func):
+        """
+        The artifact a function's harness is linked against (None if it's compiled from source)
+        and the original's output summary, compiling it from source if linking against the build fails
+        """
+        artifact = self.function_artifact(orig_func)
+        original_output = self.original_output(harness, orig_func, artifact)
+        if original_output is None and artifact is not None:
+            logging.warning(f"Linking {orig_func['function_name']} against the build failed, compiling it from source")
+            self.drop_artifact(orig_func)
+            artifact = None
+            original_output = self.original_output(harness, orig_func)
+        return artifact, original_output
 
     def save_results(self, results):
         """Save test results to JSON"""
@@ -127,60 +469,257 @@ class TestRunner:
             json.dump(results, f, indent=2)
         logging.info(f"Results saved to {output_file}")
 
-    def run_all_tests(self, generated_functions):
-        """Run all equivalence tests"""
-        results = []
+    def evaluate_candidate(self, harness, orig_func, gen_func, test_info, original_output, artifact=None):
+        """Result of one candidate: its harness output compared with the original's, then fuzzing and timing if enabled"""
+        start = time.perf_counter()
+        is_equivalent, details = self.compare_candidate(harness, orig_func, gen_func, original_output, artifact)
+        fuzzed = None
+        if is_equivalent and self.fuzzer is not None:
+            fuzzed = self.fuzzer.fuzz(harness, orig_func, orig_func['source'], gen_func['source'])
+            if fuzzed['status'] == 'diverged':
+                is_equivalent = False
+                details = f"Fuzzing found an input where the outputs differ ({fuzzed['reason']}): {fuzzed['reproducer']['inputs']}"
+        result = {
+            'status': 'equivalent' if is_equivalent else 'different',
+            'details': details,
+            'seconds': time.perf_counter() - start,
+        }
+        if fuzzed is not None:
+            result['fuzzing'] = fuzzed
+        if is_equivalent and self.perf is not None and 'test_cases' in test_info:
+            with self._perf_lock:
+                result['performance'] = self.perf.compare(harness, orig_func, test_info['test_cases'],
+                                                          orig_func['source'], gen_func['source'])
+        return result
+
+    def record_result(self, record):
+        """Append a candidate's result to the results file as soon as it is known"""
+        with self._results_lock:
+            self._results_writer.write(record)
+            self._results_writer.flush()
+
+    def test_function(self, orig_func, candidates):
+        """
+        Result of testing every candidate of one original function. The original is run once
+        and its output is compared with each candidate's, in order, stopping at the first
+        passing one if stop_at_first_pass is set. A candidate that already has a result for
+        the same harness (from the results file, when resuming) isn't tested again.
+        """
+        func_name = orig_func['function_name']
+        logging.info(f"Testing function: {func_name} ({len(candidates)} candidates)")
         
-        for orig_func in self.functions:
-            func_name = orig_func['function_name']
-            logging.info(f"Testing function: {func_name}")
-            
-            # Find corresponding generated function
-            gen_func = next(
-                (f for f in generated_functions if f['function_name'] == func_name),
-                None
-            )
-            
-            if gen_func is None:
-                logging.warning(f"No generated function found for {func_name}")
-                results.append({
-                    'function_name': func_name,
-                    'status': 'skipped',
-                    'reason': 'No generated function found'
-                })
-                continue
-                
-            # Run equivalence test
-            is_equivalent, details = self.run_equivalence_test(orig_func, gen_func)
-            
-            results.append({
+        if not candidates:
+            logging.warning(f"No generated function found for {func_name}")
+            return {
                 'function_name': func_name,
-                'status': 'equivalent' if is_equivalent else 'different',
-                'details': details,
-                'original_source': orig_func['source'],
-                'generated_source': gen_func['source']
-            })
-            
-            logging.info(f"Function {func_name}: {'PASS' if is_equivalent else 'FAIL'}")
+                'status': 'skipped',
+                'reason': 'No generated function found'
+            }
+
+        test_info = self.test_cases[func_name]
+        harness = self.function_harness(orig_func, test_info)
+        # The original is only run once a candidate needs testing
+        original_output = None
+        artifact = None
+        details = None
+        candidate_results = []
+        for index, gen_func in enumerate(candidates):
+            record = {
+                'function_name': func_name,
+                'candidate_hash': source_hash(gen_func['source']),
+                'harness_hash': source_hash(harness),
+                'original_hash': source_hash(orig_func['source']),
+            }
+            earlier = self.completed.get(result_key(record))
+            if earlier is not None:
+                candidate_results.append(dict(earlier, candidate=index, resumed=True))
+            else:
+                if original_output is None:
+                    artifact, original_output = self.original_with_fallback(harness, orig_func)
+                    if original_output is None:
+                        # No candidate can be compared, so none are compiled
+                        details = "Original function failed to compile/run"
+                        break
+                record.update(self.evaluate_candidate(harness, orig_func, gen_func, test_info, original_output, artifact))
+                self.record_result(record)
+                candidate_results.append(dict(record, candidate=index))
+                fuzzed = record.get('fuzzing')
+                if fuzzed and fuzzed['status'] == 'diverged' and fuzzed['reproducible'] and 'test_cases' in test_info:
+                    # The remaining candidates are tested on the new input too
+                    self.add_reproducer(orig_func, fuzzed['reproducer'])
+                    harness = self.function_harness(orig_func, test_info)
+                    original_output = None
+            if candidate_results[-1]['status'] == 'equivalent' and self.stop_at_first_pass:
+                break
+
+        passed = [c for c in candidate_results if c['status'] == 'equivalent']
+        # The first passing candidate stands for the function, or the first candidate if none passed
+        shown = passed[0] if passed else (candidate_results[0] if candidate_results else None)
+        logging.info(f"Function {func_name}: {'PASS' if passed else 'FAIL'} ({len(passed)}/{len(candidate_results)} candidates)")
+        
+        return {
+            'function_name': func_name,
+            'status': 'equivalent' if passed else 'different',
+            'details': shown['details'] if shown else details,
+            'original_hash': source_hash(orig_func['source']),
+            'generated_hash': shown['candidate_hash'] if shown else source_hash(candidates[0]['source']),
+            'num_candidates': len(candidates),
+            'num_evaluated': len(candidate_results),
+            'num_passed': len(passed),
+            'original_failed': original_output is None and details is not None,
+            'linked_build': artifact is not None,
+            'candidates': candidate_results
+        }
+
+    def run_all_tests(self, generated_functions):
+        """
+        Run all equivalence tests, up to `workers` functions at a time, returning results in
+        function order. generated_functions may hold any number of candidates per function name.
+        """
+        candidates = index_candidates(generated_functions)
+        results = []
+        in_flight = deque()
+        pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for orig_func in self.functions:
+                function_candidates = candidates.get(orig_func['function_name'], [])
+                if pool is not None:
+                    future = pool.submit(self.test_function, orig_func, function_candidates)
+                else:
+                    future = Future()
+                    future.set_result(self.test_function(orig_func, function_candidates))
+                in_flight.append(future)
+                # Only a few tests ahead of the oldest unfinished one are kept in memory
+                if len(in_flight) >= 2 * self.workers:
+                    results.append(in_flight.popleft().result())
+            while in_flight:
+                results.append(in_flight.popleft().result())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
             
         return results
 
+def source_hash(source):
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+def result_key(record):
+    """What a candidate's result depends on: the function, the candidate's source and the harness it was tested with"""
+    return record['function_name'], record['candidate_hash'], record['harness_hash']
+
+def load_result_records(path):
+    """
+    Records of a results file, and the size of the part of it that holds complete records.
+    A run that was killed may have left half a line at the end.
+    """
+    records = []
+    size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("Incomplete record")
+                if line.strip():
+                    records.append(json.loads(line))
+            except ValueError:
+                break
+            size += len(line)
+    return records, size
+
+def reproducer_key(orig_func):
+    """Key of the inputs found for a function, which stop applying once the original changes"""
+    return orig_func['function_name'], source_hash(orig_func['source'])
+
+def index_candidates(generated_functions):
+    """Generated functions grouped by function name, keeping the order candidates were given in"""
+    candidates = defaultdict(list)
+    for func in generated_functions:
+        candidates[func['function_name']].append(func)
+    return candidates
+
+def pass_at_k(n, c, k):
+    """Unbiased estimate of the chance that at least one of k of a function's n candidates passes, c of which did"""
+    if n - c < k:
+        return 1.0
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+def summarize(results, ks=(1,), stop_at_first_pass=False):
+    """
+    pass@k over the tested functions, and how long candidates took. Functions whose original
+    failed to compile or run have no candidate results and are left out of pass@k.
+    """
+    tested = [r for r in results if r['status'] != 'skipped']
+    timings = [c['seconds'] for r in tested for c in r.get('candidates', [])]
+    summary = {
+        'functions': len(tested),
+        'solved': sum(1 for r in tested if r['status'] == 'equivalent'),
+        'candidates_evaluated': len(timings),
+        'original_failed': sum(1 for r in tested if r.get('original_failed')),
+        'resumed': sum(1 for r in tested for c in r.get('candidates', []) if c.get('resumed')),
+        'linked_build': sum(1 for r in tested if r.get('linked_build')),
+        'mean_candidate_seconds': sum(timings) / len(timings) if timings else 0.0,
+    }
+    # Speed of the passing candidates that were timed, relative to their originals
+    speedups = [c['performance']['speedup'] for r in tested for c in r.get('candidates', [])
+                if 'speedup' in c.get('performance', {})]
+    if speedups:
+        verdicts = [c['performance']['verdict'] for r in tested for c in r.get('candidates', [])
+                    if 'verdict' in c.get('performance', {})]
+        summary.update({
+            'timed': len(speedups),
+            'faster': verdicts.count('faster'),
+            'slower': verdicts.count('slower'),
+            'geomean_speedup': math.exp(sum(math.log(x) for x in speedups) / len(speedups)),
+        })
+    # pass@k needs every candidate evaluated; a run that stopped at first passes only tells which functions were solved
+    if not stop_at_first_pass:
+        for k in ks:
+            # Only functions with at least k candidates, compared against a working original, have a pass@k
+            eligible = [r for r in tested if r['num_candidates'] >= k and not r.get('original_failed')]
+            if eligible:
+                summary[f'pass@{k}'] = sum(pass_at_k(r['num_candidates'], r['num_passed'], k) for r in eligible) / len(eligible)
+    return summary
+
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: python test_runner.py <functions_file> <tests_file> <generated_functions_file>")
-        sys.exit(1)
-        
-    functions_file = sys.argv[1]
-    tests_file = sys.argv[2]
-    generated_functions_file = sys.argv[3]
+    parser = argparse.ArgumentParser(description="Run self-equivalence tests of generated functions against the originals")
+    parser.add_argument('functions_file')
+    parser.add_argument('tests_file')
+    parser.add_argument('generated_functions_file')
+    parser.add_argument('--no-golden-cache', action='store_true', help="always compile and run the original harnesses")
+    parser.add_argument('--refresh-golden', action='store_true', help="recompute the cached outputs of the original harnesses")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="tests compiled and run at the same time")
+    parser.add_argument('--fork-server', action='store_true', help="run harnesses as shared libraries in forked children instead of executables")
+    parser.add_argument('--k', type=int, nargs='+', default=[1], help="k values to report pass@k for")
+    parser.add_argument('--first-pass', action='store_true', help="stop evaluating a function's candidates once one passes")
+    parser.add_argument('--perf', action='store_true', help="also time passing candidates against the original")
+    parser.add_argument('--opt-level', default='-O2', help="optimization level timed harnesses are built at")
+    parser.add_argument('--fuzz', type=float, metavar='SECONDS', help="also fuzz passing candidates against the original for SECONDS each")
+    parser.add_argument('--resume', action='store_true', help="reuse results from the results file of an earlier run instead of testing those candidates again")
+    parser.add_argument('--perf-repetitions', type=int, default=30, help="timed samples per run of a timing harness")
+    parser.add_argument('--link-build', action='store_true', help="link harnesses against the objects the repos' builds produced instead of compiling functions from source")
+    args = parser.parse_args()
+    if args.link_build and args.fork_server:
+        parser.error("--link-build can't be combined with --fork-server")
+
+    functions_file = args.functions_file
+    tests_file = args.tests_file
+    generated_functions_file = args.generated_functions_file
     
     # Load generated functions
-    with open(generated_functions_file) as f:
-        generated_functions = json.load(f)
+    generated_functions = load_records(generated_functions_file)
     
     # Create and run tests
-    runner = TestRunner(functions_file, tests_file)
-    results = runner.run_all_tests(generated_functions)
+    runner = TestRunner(functions_file, tests_file,
+                        golden_cache_path=None if args.no_golden_cache else GOLDEN_CACHE_PATH,
+                        refresh_golden=args.refresh_golden, workers=args.workers, fork_server=args.fork_server,
+                        stop_at_first_pass=args.first_pass,
+                        perf=PerformanceComparer(opt_level=args.opt_level, repetitions=args.perf_repetitions) if args.perf else None,
+                        fuzzer=DifferentialFuzzer(budget=args.fuzz) if args.fuzz else None, resume=args.resume,
+                        artifacts=BuildArtifacts() if args.link_build else None)
+    try:
+        results = runner.run_all_tests(generated_functions)
+    finally:
+        runner.close()
     
     # Save results
     runner.save_results(results)
@@ -192,6 +731,19 @@ def main():
     print(f"Total functions tested: {total}")
     print(f"Equivalent implementations: {equivalent}")
     print(f"Success rate: {(equivalent/total)*100:.2f}%")
+    summary = summarize(results, args.k, args.first_pass)
+    if args.link_build:
+        print(f"Functions linked against their repo's build: {summary['linked_build']}/{summary['functions']}")
+    print(f"Candidates evaluated: {summary['candidates_evaluated']} "
+          f"({summary['mean_candidate_seconds'] * 1000:.1f} ms each on average, {summary['resumed']} from an earlier run)")
+    if summary['original_failed']:
+        print(f"Functions left out of pass@k because their original failed to compile/run: {summary['original_failed']}")
+    for k in args.k:
+        if f'pass@{k}' in summary:
+            print(f"pass@{k}: {summary[f'pass@{k}'] * 100:.2f}%")
+    if 'timed' in summary:
+        print(f"Timed candidates: {summary['timed']} ({summary['faster']} faster, {summary['slower']} slower than the original)")
+        print(f"Geometric mean speedup: {summary['geomean_speedup']:.3f}x")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,323 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from pathlib import Path
+import clang.cindex
+from paths import SYMBOL_INDEX_DIR
+from extraction_cache import ExtractionCache
+from generate_self_equiv_tests import CFunctionExtractor, SourceFile, ENGINES, find_compilation_database
+
+'''
+Persistent per-repo index of C symbols: where each function, variable, struct, union, enum,
+enum constant, typedef and macro is defined or declared, which names each file references, and
+which functions each function calls.
+
+The index lives in one SQLite file per repo (SYMBOL_INDEX_DIR/<repo_id>.sqlite). update() only
+re-reads the .c and .h files whose rows may have changed since the last update, and drops the
+rows of files that were deleted, so keeping the index current after an edit costs about as much
+as parsing the edited files. Lookups go through indexed columns and take well under a
+millisecond.
+
+Each file is indexed on its own. It can be filled by tree-sitter (fast, purely syntactic), where
+a file's rows only depend on its own content, or by libclang (preprocessed, with the repo's
+compilation database when there is one), where they also depend on the arguments it is parsed
+with and on every file it includes: a file is re-read when any of those changed.
+
+Usage:
+python symbol_index.py <repo_path> [name] [--engine {libclang,tree-sitter}]
+'''
+
+# Bump whenever the rows stored for a file change, so existing indexes are rebuilt
+INDEX_VERSION = 2
+
+LIBCLANG_KINDS = {
+    clang.cindex.CursorKind.FUNCTION_DECL: 'function',
+    clang.cindex.CursorKind.VAR_DECL: 'variable',
+    clang.cindex.CursorKind.STRUCT_DECL: 'struct',
+    clang.cindex.CursorKind.UNION_DECL: 'union',
+    clang.cindex.CursorKind.ENUM_DECL: 'enum',
+    clang.cindex.CursorKind.ENUM_CONSTANT_DECL: 'enumerator',
+    clang.cindex.CursorKind.TYPEDEF_DECL: 'typedef',
+    clang.cindex.CursorKind.MACRO_DEFINITION: 'macro',
+}
+REFERENCE_KINDS = {
+    clang.cindex.CursorKind.DECL_REF_EXPR,
+    clang.cindex.CursorKind.TYPE_REF,
+    clang.cindex.CursorKind.MACRO_INSTANTIATION,
+}
+# Anonymous structs and enums are spelled like 'struct (unnamed at foo.h:3:9)'
+SYMBOL_NAME = re.compile(r'^\w+$')
+
+class SymbolIndex:
+    def __init__(self, repo_path, path=None, engine='tree-sitter'):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown extraction engine {engine}, expected one of {ENGINES}")
+        self.repo_path = os.path.abspath(repo_path)
+        self.engine = engine
+        if path is None:
+            path = os.path.join(SYMBOL_INDEX_DIR, os.path.basename(self.repo_path) + '.sqlite')
+        self.path = path
+        self._extractor = None
+        self._tree_sitter = None
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+        # An index filled by another engine or an older version is thrown away, tables and all,
+        # since they may not have the same columns
+        settings = {'engine': engine, 'version': str(INDEX_VERSION)}
+        stored = dict(self.conn.execute('SELECT key, value FROM meta').fetchall())
+        if stored != settings:
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS symbols;
+                DROP TABLE IF EXISTS refs; DROP TABLE IF EXISTS calls;
+                DELETE FROM meta;
+            ''')
+            self.conn.executemany('INSERT INTO meta VALUES (?, ?)', settings.items())
+
+        # hash covers everything a file's rows depend on (see file_state), deps is the JSON list
+        # of the files it included when it was indexed
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, hash TEXT NOT NULL, deps TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS symbols (
+                name TEXT NOT NULL, kind TEXT NOT NULL, file_id INTEGER NOT NULL,
+                line INTEGER NOT NULL, end_line INTEGER NOT NULL, is_definition INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS refs (name TEXT NOT NULL, file_id INTEGER NOT NULL, line INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS calls (caller TEXT NOT NULL, callee TEXT NOT NULL, file_id INTEGER NOT NULL, line INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+            CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file_id);
+            CREATE INDEX IF NOT EXISTS refs_name ON refs (name);
+            CREATE INDEX IF NOT EXISTS refs_file ON refs (file_id);
+            CREATE INDEX IF NOT EXISTS calls_caller ON calls (caller);
+            CREATE INDEX IF NOT EXISTS calls_callee ON calls (callee);
+            CREATE INDEX IF NOT EXISTS calls_file ON calls (file_id);
+        ''')
+        self.conn.commit()
+
+    def source_files(self):
+        """All .c and .h files of the repo, relative to it"""
+        root = Path(self.repo_path)
+        return sorted(str(p.relative_to(root)) for pattern in ('*.c', '*.h') for p in root.rglob(pattern))
+
+    def update(self):
+        """Re-index the files that changed since the last update and drop deleted ones"""
+        known = {path: (file_id, state, json.loads(deps)) for file_id, path, state, deps
+                 in self.conn.execute('SELECT id, path, hash, deps FROM files')}
+        stats = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+        # Content hash of each file read during this update, as headers are shared by many files
+        hashes = {}
+
+        files = self.source_files()
+        for rel_path in files:
+            if rel_path in known and known[rel_path][1] == self.file_state(rel_path, known[rel_path][2], hashes):
+                stats['unchanged'] += 1
+                continue
+            collected = self.collect(rel_path)
+            deps = collected.get('includes', [])
+            state = self.file_state(rel_path, deps, hashes)
+            if rel_path in known:
+                file_id = known[rel_path][0]
+                self.delete_file_rows(file_id)
+                self.conn.execute('UPDATE files SET hash = ?, deps = ? WHERE id = ?', (state, json.dumps(deps), file_id))
+            else:
+                file_id = self.conn.execute('INSERT INTO files (path, hash, deps) VALUES (?, ?, ?)',
+                                            (rel_path, state, json.dumps(deps))).lastrowid
+            self.insert_file_rows(file_id, collected)
+            stats['indexed'] += 1
+
+        for rel_path in set(known) - set(files):
+            self.delete_file_rows(known[rel_path][0])
+            self.conn.execute('DELETE FROM files WHERE id = ?', (known[rel_path][0],))
+            stats['removed'] += 1
+
+        self.conn.commit()
+        return stats
+
+    def file_state(self, rel_path, deps, hashes):
+        """
+        Hash of everything a file's rows depend on: its content, and with libclang also its parse
+        arguments and the content of the files it includes (deps). Missing files hash to None.
+        """
+        def content_hash(path):
+            if path not in hashes:
+                hashes[path] = ExtractionCache.hash_file(path) if os.path.isfile(path) else None
+            return hashes[path]
+
+        path = os.path.join(self.repo_path, rel_path)
+        if self.engine == 'tree-sitter':
+            return content_hash(path)
+        state = [content_hash(path), self.parse_args(path), [[dep, content_hash(dep)] for dep in deps]]
+        return hashlib.sha256(json.dumps(state).encode()).hexdigest()
+
+    def delete_file_rows(self, file_id):
+        for table in ('symbols', 'refs', 'calls'):
+            self.conn.execute(f'DELETE FROM {table} WHERE file_id = ?', (file_id,))
+
+    def insert_file_rows(self, file_id, collected):
+        self.conn.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)', [
+            (s['name'], s['kind'], file_id, s['line'], s['end_line'], int(s['is_definition'])) for s in collected['symbols']
+        ])
+        self.conn.executemany('INSERT INTO refs VALUES (?, ?, ?)', [
+            (name, file_id, line) for name, line in collected['references']
+        ])
+        self.conn.executemany('INSERT INTO calls VALUES (?, ?, ?, ?)', [
+            (caller, callee, file_id, line) for caller, callee, line in collected['calls']
+        ])
+
+    def collect(self, rel_path):
+        """Symbols, references and calls of one file with the index's engine"""
+        path = os.path.join(self.repo_path, rel_path)
+        try:
+            if self.engine == 'tree-sitter':
+                if self._tree_sitter is None:
+                    from tree_sitter_engine import TreeSitterEngine
+                    self._tree_sitter = TreeSitterEngine()
+                return self._tree_sitter.symbols(SourceFile(path))
+            return self.collect_libclang(path)
+        except Exception as e:
+            print(f"Error indexing {path}: {e}")
+            return {'symbols': [], 'references': [], 'calls': []}
+
+    def libclang_extractor(self):
+        if self._extractor is None:
+            self._extractor = CFunctionExtractor()
+            self._extractor.use_compilation_database(find_compilation_database(self.repo_path))
+        return self._extractor
+
+    def parse_args(self, path):
+        """Arguments libclang parses a file with: its own from the compilation database if there is one"""
+        args = self.libclang_extractor().get_parse_args(path)
+        if path.endswith('.h'):
+            args = args + ['-x', 'c-header']
+        return args
+
+    def collect_libclang(self, path):
+        extractor = self.libclang_extractor()
+        tu = extractor.index.parse(path, args=self.parse_args(path), options=clang.cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD)
+        symbols, references, calls = [], set(), set()
+
+        def add(node, kind):
+            if SYMBOL_NAME.match(node.spelling):
+                symbols.append({'name': node.spelling, 'kind': kind, 'line': node.extent.start.line,
+                                'end_line': node.extent.end.line, 'is_definition': kind == 'macro' or node.is_definition()})
+
+        for node in tu.cursor.get_children():
+            if not extractor.in_main_file(node, path):
+                continue
+            if node.kind == clang.cindex.CursorKind.MACRO_INSTANTIATION:
+                references.add((node.spelling, node.location.line))
+                continue
+            kind = LIBCLANG_KINDS.get(node.kind)
+            if kind is None:
+                continue
+            add(node, kind)
+            if kind == 'macro':
+                continue
+
+            caller = node.spelling if kind == 'function' and node.is_definition() else None
+            for child in node.walk_preorder():
+                if child.kind == clang.cindex.CursorKind.ENUM_CONSTANT_DECL:
+                    add(child, 'enumerator')
+                elif child.kind in REFERENCE_KINDS:
+                    referenced = child.referenced
+                    # Locals and parameters aren't symbols of the repo
+                    if referenced is None or (referenced.kind in (clang.cindex.CursorKind.VAR_DECL, clang.cindex.CursorKind.PARM_DECL)
+                                              and referenced.semantic_parent.kind != clang.cindex.CursorKind.TRANSLATION_UNIT):
+                        continue
+                    if SYMBOL_NAME.match(referenced.spelling):
+                        references.add((referenced.spelling, child.location.line))
+                elif child.kind == clang.cindex.CursorKind.CALL_EXPR and caller is not None:
+                    referenced = child.referenced
+                    if referenced is not None and referenced.kind == clang.cindex.CursorKind.FUNCTION_DECL:
+                        calls.add((caller, referenced.spelling, child.location.line))
+
+        includes = sorted({inclusion.include.name for inclusion in tu.get_includes()})
+        return {'symbols': symbols, 'references': sorted(references), 'calls': sorted(calls), 'includes': includes}
+
+    def lookup(self, name, kind=None, is_definition=None):
+        """Definitions and declarations of a name, as dicts with the file relative to the repo"""
+        query = ('SELECT s.name, s.kind, f.path, s.line, s.end_line, s.is_definition '
+                 'FROM symbols s JOIN files f ON f.id = s.file_id WHERE s.name = ?')
+        params = [name]
+        if kind is not None:
+            query += ' AND s.kind = ?'
+            params.append(kind)
+        if is_definition is not None:
+            query += ' AND s.is_definition = ?'
+            params.append(int(is_definition))
+        return [
+            {'name': row[0], 'kind': row[1], 'file': row[2], 'line': row[3], 'end_line': row[4], 'is_definition': bool(row[5])}
+            for row in self.conn.execute(query + ' ORDER BY f.path, s.line', params)
+        ]
+
+    def definitions(self, name, kind=None):
+        return self.lookup(name, kind, is_definition=True)
+
+    def declarations(self, name, kind=None):
+        return self.lookup(name, kind, is_definition=False)
+
+    def references(self, name):
+        return [{'file': path, 'line': line} for path, line in self.conn.execute(
+            'SELECT f.path, r.line FROM refs r JOIN files f ON f.id = r.file_id WHERE r.name = ? ORDER BY f.path, r.line', (name,))]
+
+    def callers(self, name):
+        return [{'caller': caller, 'file': path, 'line': line} for caller, path, line in self.conn.execute(
+            'SELECT c.caller, f.path, c.line FROM calls c JOIN files f ON f.id = c.file_id WHERE c.callee = ? ORDER BY f.path, c.line', (name,))]
+
+    def callees(self, name):
+        return [{'callee': callee, 'file': path, 'line': line} for callee, path, line in self.conn.execute(
+            'SELECT c.callee, f.path, c.line FROM calls c JOIN files f ON f.id = c.file_id WHERE c.caller = ? ORDER BY f.path, c.line', (name,))]
+
+    def stats(self):
+        counts = {table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('files', 'symbols', 'refs', 'calls')}
+        counts['bytes'] = os.path.getsize(self.path)
+        return counts
+
+    def clear(self):
+        for table in ('meta', 'files', 'symbols', 'refs', 'calls'):
+            self.conn.execute(f'DELETE FROM {table}')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Update a repo's symbol index and look up a name in it")
+    parser.add_argument('repo_path')
+    parser.add_argument('name', nargs='?')
+    parser.add_argument('--engine', choices=ENGINES, default='tree-sitter')
+    args = parser.parse_args()
+
+    index = SymbolIndex(args.repo_path, engine=args.engine)
+    start = time.perf_counter()
+    stats = index.update()
+    print(f"Updated {index.path} in {time.perf_counter() - start:.2f}s: "
+          f"{stats['indexed']} files indexed, {stats['unchanged']} unchanged, {stats['removed']} removed")
+    totals = index.stats()
+    print(f"{totals['files']} files, {totals['symbols']} symbols, {totals['refs']} references, "
+          f"{totals['calls']} call edges ({totals['bytes'] / 1024:.0f} KB)")
+
+    if args.name:
+        name = args.name
+        start = time.perf_counter()
+        found = index.lookup(name)
+        elapsed = time.perf_counter() - start
+        for symbol in found:
+            what = 'defined' if symbol['is_definition'] else 'declared'
+            print(f"{symbol['kind']} {name} {what} at {symbol['file']}:{symbol['line']}-{symbol['end_line']}")
+        print(f"{len(found)} results in {elapsed * 1000:.3f} ms")
+        print(f"Referenced {len(index.references(name))} times, "
+              f"called from {len(index.callers(name))} call sites, calls {len(index.callees(name))}")
+    index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import re
+import io
+import sys
+import time
+import contextlib
+import tree_sitter
+import tree_sitter_c
+
+'''
+Tree-sitter engine for function extraction. This does in-process what tree_parser.c does as a
+standalone binary: parse .c files with tree-sitter, without running the preprocessor. It finds
+function definitions, their signatures, storage class, line ranges and where their bodies
+start, plus the includes, typedefs and macros of each file, but it can't resolve types the way
+libclang does. That makes it the fast path for corpus-wide scanning.
+
+It is selected with CFunctionExtractor(engine='tree-sitter').
+
+To compare its throughput against libclang on the same files:
+python tree_sitter_engine.py <repo_path>
+'''
+
+# Preprocessor blocks whose bodies are still top-level code
+PREPROC_BLOCKS = {'preproc_if', 'preproc_ifdef', 'preproc_else', 'preproc_elif', 'preproc_elifdef'}
+TAG_KINDS = {'struct_specifier': 'struct', 'union_specifier': 'union', 'enum_specifier': 'enum'}
+STORAGE_CLASSES = {'static', 'extern', 'inline', '__inline', '__inline__', 'register', 'auto', '_Thread_local'}
+# Without a preprocessor, macros like MEM_STATIC or ZSTDLIB_API in front of the return type look
+# like part of it. A leading ALL_CAPS_WITH_UNDERSCORE token followed by more of the type is
+# taken to be one of those.
+DECORATOR_MACRO = re.compile(r'^[A-Z][A-Z0-9]*_[A-Z0-9_]*$')
+
+def normalize_type(text):
+    """Spell a type the way libclang does, e.g. 'const  char*' -> 'const char *', 'double ( * )( int )' -> 'double (*)(int)'"""
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'\s+([\[\]\),])', r'\1', text)
+    text = re.sub(r'([\(\[])\s+', r'\1', text)
+    text = re.sub(r'\*\s+(?=\*)', '*', text)
+    text = re.sub(r'(?<=[^\s*(])\*', ' *', text)
+    return re.sub(r'\*\s+(?=[),\]]|$)', '*', text)
+
+def declarator_name(node):
+    """The identifier a (possibly nested) declarator declares"""
+    while node is not None and node.type not in ('identifier', 'type_identifier', 'field_identifier'):
+        inner = node.child_by_field_name('declarator')
+        if inner is None:
+            # parenthesized_declarator has no declarator field
+            inner = next((c for c in node.named_children if c.type.endswith('declarator') or c.type == 'identifier'), None)
+        node = inner
+    return node
+
+class TreeSitterEngine:
+    def __init__(self):
+        self.language = tree_sitter.Language(tree_sitter_c.language())
+        self.parser = tree_sitter.Parser(self.language)
+
+    def top_level_nodes(self, root):
+        """Top-level nodes of a file, looking inside #if/#ifdef blocks since their contents are top-level too"""
+        stack = list(reversed(root.named_children))
+        while stack:
+            node = stack.pop()
+            if node.type in PREPROC_BLOCKS:
+                stack.extend(reversed(node.named_children))
+            else:
+                yield node
+
+    def function_info(self, node, content):
+        """Name, return type, parameter types and storage class of a function_definition node"""
+        declarator = node.child_by_field_name('declarator')
+        pointer_depth = 0
+        while declarator is not None and declarator.type in ('pointer_declarator', 'parenthesized_declarator'):
+            if declarator.type == 'pointer_declarator':
+                pointer_depth += 1
+            declarator = declarator.child_by_field_name('declarator') or (declarator.named_children or [None])[0]
+        if declarator is None or declarator.type != 'function_declarator':
+            return None
+
+        name = declarator_name(declarator.child_by_field_name('declarator'))
+        if name is None:
+            return None
+
+        # Everything between the start of the definition and its declarator is storage class or return type
+        prefix = content[node.start_byte:node.child_by_field_name('declarator').start_byte].decode(errors='replace')
+        tokens = re.findall(r'\w+', prefix)
+        storage_class = [t for t in tokens if t in STORAGE_CLASSES]
+        type_tokens = [t for t in tokens if t not in STORAGE_CLASSES]
+        while len(type_tokens) > 1 and DECORATOR_MACRO.match(type_tokens[0]):
+            macro = type_tokens.pop(0)
+            if 'STATIC' in macro:
+                storage_class.append('static')
+        return_type = normalize_type(' '.join(type_tokens) + (' ' + '*' * pointer_depth if pointer_depth else ''))
+
+        params = []
+        parameter_list = declarator.child_by_field_name('parameters')
+        for param in parameter_list.named_children if parameter_list is not None else []:
+            if param.type == 'variadic_parameter':
+                params.append('...')
+                continue
+            if param.type != 'parameter_declaration':
+                continue
+            # The parameter's type is its declaration minus the name
+            text = content[param.start_byte:param.end_byte]
+            param_name = declarator_name(param.child_by_field_name('declarator'))
+            if param_name is not None and param_name.type == 'identifier':
+                text = text[:param_name.start_byte - param.start_byte] + text[param_name.end_byte - param.start_byte:]
+            params.append(normalize_type(text.decode(errors='replace')))
+        if params == ['void']:
+            params = []
+
+        return {
+            'name': content[name.start_byte:name.end_byte].decode(errors='replace'),
+            'return_type': return_type,
+            'params': params,
+            'storage_class': storage_class,
+        }
+
+    def extract(self, source):
+        """
+        Walk a parsed file once, returning its context (includes, typedefs, macros) and
+        info on every function definition in it
+        """
+        content = source.content.encode()
+        tree = self.parser.parse(content)
+        context = {'includes': {}, 'typedefs': {}, 'macros': {}}
+        functions = []
+
+        for node in self.top_level_nodes(tree.root_node):
+            if node.type == 'preproc_include':
+                path = node.child_by_field_name('path')
+                if path is not None:
+                    context['includes'][content[path.start_byte:path.end_byte].decode(errors='replace')] = None
+            elif node.type == 'type_definition':
+                for declarator in node.children_by_field_name('declarator'):
+                    name = declarator_name(declarator)
+                    if name is not None:
+                        context['typedefs'][content[name.start_byte:name.end_byte].decode(errors='replace')] = None
+            elif node.type in ('preproc_def', 'preproc_function_def'):
+                name = node.child_by_field_name('name')
+                context['macros'][content[name.start_byte:name.end_byte].decode(errors='replace')] = None
+            elif node.type == 'function_definition':
+                info = self.function_info(node, content)
+                if info is not None:
+                    info['start_line'] = node.start_point[0] + 1
+                    info['end_line'] = node.end_point[0] + 1
+                    # 0-based line and byte column of the body's opening brace
+                    body = node.child_by_field_name('body')
+                    info['body_start'] = tuple(body.start_point) if body is not None else None
+                    functions.append(info)
+
+        return {key: list(values) for key, values in context.items()}, functions
+
+    def symbols(self, source):
+        """
+        Symbols a file defines or declares, the names it references and the calls each of its
+        functions makes, for the symbol index. Without a preprocessor, references are names:
+        locals and parameters are left out, but macro uses show up like any other identifier.
+        """
+        content = source.content.encode()
+        tree = self.parser.parse(content)
+        symbols, references, calls = [], [], []
+
+        def text(node):
+            return content[node.start_byte:node.end_byte].decode(errors='replace')
+
+        def add(name_node, kind, node, is_definition):
+            if name_node is not None:
+                # Preprocessor directives end at the start of the next line
+                end_line = node.end_point[0] + (1 if node.end_point[1] else 0)
+                symbols.append({'name': text(name_node), 'kind': kind, 'line': node.start_point[0] + 1,
+                                'end_line': max(end_line, node.start_point[0] + 1), 'is_definition': is_definition})
+                declared.add(name_node.start_byte)
+
+        def add_tag(node):
+            """struct/union/enum specifiers, with the constants of an enum"""
+            body = node.child_by_field_name('body')
+            add(node.child_by_field_name('name'), TAG_KINDS[node.type], node, body is not None)
+            if node.type == 'enum_specifier' and body is not None:
+                for enumerator in body.named_children:
+                    if enumerator.type == 'enumerator':
+                        add(enumerator.child_by_field_name('name'), 'enumerator', enumerator, True)
+
+        def add_references(node, local_names=()):
+            stack = [node]
+            while stack:
+                child = stack.pop()
+                if child.type in TAG_KINDS and child is not node:
+                    name = child.child_by_field_name('name')
+                    if name is not None and name.start_byte not in declared:
+                        references.append((text(name), child.start_point[0] + 1))
+                    stack.extend(c for c in child.named_children if c is not name)
+                    continue
+                if child.type in ('identifier', 'type_identifier') and child.start_byte not in declared:
+                    name = text(child)
+                    if name not in local_names:
+                        references.append((name, child.start_point[0] + 1))
+                stack.extend(child.named_children)
+
+        declared = set()
+        for node in self.top_level_nodes(tree.root_node):
+            if node.type in TAG_KINDS:
+                add_tag(node)
+                add_references(node)
+            elif node.type == 'type_definition':
+                if node.child_by_field_name('type').type in TAG_KINDS:
+                    add_tag(node.child_by_field_name('type'))
+                for declarator in node.children_by_field_name('declarator'):
+                    add(declarator_name(declarator), 'typedef', node, True)
+                add_references(node)
+            elif node.type == 'declaration':
+                type_node = node.child_by_field_name('type')
+                if type_node is not None and type_node.type in TAG_KINDS:
+                    add_tag(type_node)
+                is_extern = any(c.type == 'storage_class_specifier' and text(c) == 'extern' for c in node.children)
+                for declarator in node.children_by_field_name('declarator'):
+                    inner = declarator
+                    while inner is not None and inner.type not in ('function_declarator', 'identifier'):
+                        inner = inner.child_by_field_name('declarator')
+                    if inner is not None and inner.type == 'function_declarator':
+                        add(declarator_name(declarator), 'function', node, False)
+                    else:
+                        add(declarator_name(declarator), 'variable', node, not is_extern)
+                add_references(node)
+            elif node.type == 'function_definition':
+                info = self.function_info(node, content)
+                if info is None:
+                    continue
+                add(declarator_name(node.child_by_field_name('declarator')), 'function', node, True)
+                # Parameters and locals shadow globals of the same name
+                local_names = set()
+                for child in _descendants(node):
+                    if child.type in ('parameter_declaration', 'declaration') and child is not node:
+                        for declarator in child.children_by_field_name('declarator'):
+                            name = declarator_name(declarator)
+                            if name is not None:
+                                local_names.add(text(name))
+                    elif child.type == 'call_expression':
+                        function = child.child_by_field_name('function')
+                        if function is not None and function.type == 'identifier':
+                            calls.append((info['name'], text(function), child.start_point[0] + 1))
+                add_references(node, local_names)
+            elif node.type in ('preproc_def', 'preproc_function_def'):
+                add(node.child_by_field_name('name'), 'macro', node, True)
+
+        return {
+            'symbols': symbols,
+            'references': sorted(set(references)),
+            'calls': sorted(set(calls)),
+        }
+
+    def is_testable_function(self, info):
+        """Same rules as CFunctionExtractor.is_testable_function, on the syntactic signature"""
+        if 'static' in info['storage_class']:
+            return False
+        if not info['params']:
+            return False
+        if '*' in info['return_type'] or 'struct' in info['return_type']:
+            return False
+        return True
+
+def _descendants(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.named_children)
+
+def compare_engines(repo_path, num_tests=10**9):
+    """Extract every testable function of a repo with each engine and report throughput"""
+    from generate_self_equiv_tests import CFunctionExtractor
+
+    results = {}
+    for engine in ('tree-sitter', 'libclang'):
+        extractor = CFunctionExtractor(num_tests=num_tests, engine=engine)
+        num_files = len(extractor.find_source_files(repo_path))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            functions = extractor.extract_from_repo(repo_path)
+        elapsed = time.perf_counter() - start
+        results[engine] = {
+            'files': num_files,
+            'functions': len(functions),
+            'seconds': elapsed,
+            'files_per_second': num_files / elapsed if elapsed else 0.0,
+            'functions_per_second': len(functions) / elapsed if elapsed else 0.0,
+        }
+    return results
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python tree_sitter_engine.py <repo_path>")
+        sys.exit(1)
+
+    results = compare_engines(sys.argv[1])
+    for engine, res in results.items():
+        print(f"{engine}: {res['functions']} functions from {res['files']} files in {res['seconds']:.2f}s "
+              f"({res['files_per_second']:.1f} files/s, {res['functions_per_second']:.1f} functions/s)")
+    if results['tree-sitter']['seconds']:
+        print(f"Speedup: {results['libclang']['seconds'] / results['tree-sitter']['seconds']:.1f}x")
+
+if __name__ == "__main__":
+    main()
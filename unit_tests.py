@@ -4,9 +4,35 @@ python -m unittest test_build_systems.py -k test_curl_cmake_build
 '''
 import unittest
 import os
+import tempfile
+import shutil
+import subprocess
+import json
+from pathlib import Path
 from unittest.mock import Mock, patch
 from typing import List, Dict
 from install_repos import *
+from retry_install import StatsTracker, retry_build
+from generate_self_equiv_tests import SourceFile, compile_args_for_parse, CFunctionExtractor, llvm_library_path
+from extraction_cache import ExtractionCache
+from tree_sitter_engine import TreeSitterEngine
+from jsonl_store import StreamCheckpoint, JsonlFile, JsonlIndex, iter_jsonl
+from extract_corpus import CorpusScheduler
+from dependency_slicer import DependencySlicer, balance_unit_text
+from symbol_index import SymbolIndex
+from benchmark import generate_corpus, compare_results
+from harness_table import HARNESS_MARKER, type_kind, generate_inputs
+from generate_self_equiv_tests import SelfEquivalenceTester
+from coverage_minimizer import CoverageMinimizer, greedy_cover
+from harness_build import replace_function, function_prototype
+from output_digest import OutputDigest, digest_text, first_difference
+from differential_fuzzer import DifferentialFuzzer
+from perf_compare import PerformanceComparer, verdict
+import perf_compare
+from build_artifacts import BuildArtifacts
+from codeql_detect import CodeQLRunner, plan_jobs
+from run_self_equiv_tests import TestRunner, make_scratch_dir, pass_at_k, summarize
+import run_self_equiv_tests
 
 class BuildSystemTestCase:
     """Helper class to define expected test results for a repo"""
@@ -113,5 +139,991 @@ class TestBuildSystems(unittest.TestCase):
         '''
         pass
 
+class TestPhaseResume(unittest.TestCase):
+    """Retries should only re-run the build phases that newly installed packages can affect"""
+    def setUp(self):
+        self.mock_logger = Mock()
+        self.repo_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = tempfile.TemporaryDirectory()
+        self.repo_path = self.repo_dir.name
+        with open(os.path.join(self.repo_path, 'configure.ac'), 'w') as f:
+            f.write('AC_INIT([demo], [1.0])\nAC_CHECK_HEADERS([zlib.h])\n')
+        with open(os.path.join(self.repo_path, 'configure'), 'w') as f:
+            f.write('#!/bin/sh\n')
+
+        for patcher in (patch('install_repos.BUILD_CHECKPOINT_DIR', self.checkpoint_dir.name),
+                        patch('install_repos.shutil.which', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.repo_dir.cleanup)
+        self.addCleanup(self.checkpoint_dir.cleanup)
+
+    def run_build(self, system, resume_from=None, failing=()):
+        """Build with run_command mocked out, returning the result and the commands that ran"""
+        commands = []
+        def fake_run_command(command, cwd, logger):
+            commands.append(command)
+            if command in failing:
+                return {"success": False, "output": "foo.c:1:10: fatal error: zlib.h: No such file or directory"}
+            return {"success": True, "output": ""}
+
+        with patch.object(system, 'run_command', side_effect=fake_run_command):
+            res = system.build(self.repo_path, self.mock_logger, resume_from=resume_from)
+        return res, commands
+
+    def test_make_failure_resumes_from_make(self):
+        system = AutotoolsBuildSystem()
+        res, _ = self.run_build(system, failing=('make',))
+        self.assertEqual(res["failed_phase"], "make")
+
+        # zlib.h isn't a configure probe here, so only make needs to run again
+        resume_from = system.resume_phase(self.repo_path, res["failed_phase"], ["foo.h"])
+        self.assertEqual(resume_from, "make")
+        res, commands = self.run_build(system, resume_from=resume_from)
+        self.assertEqual(res["result"], "success")
+        self.assertEqual(commands, ['make'])
+
+    def test_probed_header_resumes_from_configure(self):
+        system = AutotoolsBuildSystem()
+        res, _ = self.run_build(system, failing=('make',))
+        resume_from = system.resume_phase(self.repo_path, res["failed_phase"], res["missing_headers"])
+        self.assertEqual(resume_from, "configure")
+
+        _, commands = self.run_build(system, resume_from=resume_from)
+        self.assertEqual(commands, ['./configure', 'make'])
+
+    def test_retried_make_failure_resumes_at_make(self):
+        # A Makefile too, so the alternative make build system is detected and would clean the tree
+        with open(os.path.join(self.repo_path, 'Makefile'), 'w') as f:
+            f.write('all:\n')
+        commands = []
+        def fake_run_command(system, command, cwd, logger):
+            commands.append(command)
+            if command == 'make' and commands.count('make') == 1:
+                return {"success": False, "output": "foo.c:1:10: fatal error: foo.h: No such file or directory"}
+            return {"success": True, "output": ""}
+
+        stats = StatsTracker()
+        with patch.object(BuildSystem, 'run_command', autospec=True, side_effect=fake_run_command), \
+                patch('retry_install.install_missing_headers', return_value=True), patch('builtins.print'):
+            retry_build(self.repo_path, self.mock_logger, stats)
+        self.assertEqual(stats.successes, 1)
+        # The first build runs every phase, the retry only make
+        self.assertEqual(commands[commands.index('./configure') + 1:], ['make', 'make'])
+        self.assertEqual(commands.count('make clean'), 1)
+
+    def test_probes_match_full_header_paths(self):
+        system = AutotoolsBuildSystem()
+        with open(os.path.join(self.repo_path, 'configure.ac'), 'w') as f:
+            f.write('AC_INIT([demo], [1.0])\nAC_CHECK_TYPES([time_t], [], [], [#include <time.h>])\n'
+                    'AC_CHECK_HEADERS([sys/types.h])\nPKG_CHECK_MODULES([ZLIB], [zlib])\n'
+                    'AC_MSG_CHECKING([for string functions])\n')
+        self.assertTrue(system.is_probed(self.repo_path, ['sys/types.h']))
+        self.assertTrue(system.is_probed(self.repo_path, ['time.h']))
+        self.assertTrue(system.is_probed(self.repo_path, ['zlib.h']))
+        # Stems that are only words elsewhere in the file aren't probes
+        self.assertFalse(system.is_probed(self.repo_path, ['types.h']))
+        self.assertFalse(system.is_probed(self.repo_path, ['string.h']))
+        self.assertFalse(system.is_probed(self.repo_path, ['linux/types.h']))
+
+    def test_unfinished_phases_are_not_skipped(self):
+        system = AutotoolsBuildSystem()
+        self.run_build(system, failing=('autoreconf -i',))
+        _, commands = self.run_build(system, resume_from="make")
+        self.assertEqual(commands[0], 'autoreconf -i')
+
+class TestSourceFile(unittest.TestCase):
+    def test_lines_match_splitlines(self):
+        content = "int a;\r\nint add(int x, int y) {\n    return x + y;\n}\n\nint b;"
+        with tempfile.NamedTemporaryFile('w', suffix='.c', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+
+        source = SourceFile(f.name)
+        expected_lines = content.splitlines()
+        for start in range(len(expected_lines)):
+            for end in range(start + 1, len(expected_lines) + 1):
+                self.assertEqual(source.lines(start, end), "\n".join(expected_lines[start:end]))
+
+    def test_body_offsets_from_the_definition(self):
+        content = ('struct pair { int a; int b; };\n'
+                   'int sum(struct pair p, const char *s /* { */)\n'
+                   '{\n'
+                   '    return p.a + p.b + (s[0] == \'{\');\n'
+                   '}\n'
+                   'int total(int n) /* \u00e9 { */ { return n; }\n')
+        with tempfile.NamedTemporaryFile('w', suffix='.c', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+
+        engines = ['tree-sitter'] + (['libclang'] if os.path.exists(llvm_library_path) else [])
+        for engine in engines:
+            with patch('builtins.print'):
+                records = CFunctionExtractor(engine=engine).extract_from_file(f.name)
+            prototypes = {r['function_name']: function_prototype(r['source'], r['body_offset']) for r in records}
+            self.assertEqual(prototypes, {'sum': 'int sum(struct pair p, const char *s /* { */);',
+                                          'total': 'int total(int n) /* \u00e9 { */;'}, engine)
+
+class TestCompileArgs(unittest.TestCase):
+    def test_output_flags_and_source_are_dropped(self):
+        arguments = ['-Iinc', '-DFOO=1', '-c', '-o', 'src/a.o', '-MD', '-MF', 'src/a.d', '-MTsrc/a.o', 'src/a.c']
+        args = compile_args_for_parse(arguments, '/repo', 'src/a.c')
+        self.assertEqual(args, ['-working-directory=/repo', '-Iinc', '-DFOO=1'])
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache = ExtractionCache(os.path.join(self.tmp_dir.name, 'cache.sqlite'))
+        self.addCleanup(self.cache.close)
+        self.header = os.path.join(self.tmp_dir.name, 'dep.h')
+        with open(self.header, 'w') as f:
+            f.write('typedef int word;\n')
+
+    def test_hit_miss_and_stale_header(self):
+        key = ExtractionCache.make_key('abc', {'args': ['-DFOO']}, 1)
+        self.assertNotEqual(key, ExtractionCache.make_key('abc', {'args': ['-DBAR']}, 1))
+        self.assertNotEqual(key, ExtractionCache.make_key('abc', {'args': ['-DFOO']}, 2))
+
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, [{'function_name': 'add'}], [self.header])
+        self.assertEqual(self.cache.get(key), [{'function_name': 'add'}])
+
+        with open(self.header, 'a') as f:
+            f.write('typedef long dword;\n')
+        self.assertIsNone(self.cache.get(key))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stale']), (1, 2, 1))
+
+    def test_eviction_keeps_cache_under_budget(self):
+        self.cache.max_bytes = 1000
+        for i in range(20):
+            self.cache.put(f'key{i}', [{'source': 'x' * 100}])
+        self.assertLessEqual(self.cache.stats()['bytes'], 1000)
+        self.assertIsNotNone(self.cache.get('key19'))
+        self.assertIsNone(self.cache.get('key0'))
+
+class TestTreeSitterEngine(unittest.TestCase):
+    def test_finds_definitions_without_preprocessing(self):
+        content = (
+            '#include <stdio.h>\n'
+            '#define SQ(x) ((x) * (x))\n'
+            'typedef unsigned long word;\n'
+            'static int hidden(int x) { return x; }\n'
+            '#ifdef FEATURE\n'
+            'MEM_STATIC unsigned helper(unsigned x) { return x; }\n'
+            'const char* name(const char *s, int n) {\n'
+            '    return s + n;\n'
+            '}\n'
+            '#endif\n'
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.c', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+
+        engine = TreeSitterEngine()
+        context, functions = engine.extract(SourceFile(f.name))
+        self.assertEqual(context, {'includes': ['<stdio.h>'], 'typedefs': ['word'], 'macros': ['SQ']})
+
+        by_name = {info['name']: info for info in functions}
+        self.assertEqual(set(by_name), {'hidden', 'helper', 'name'})
+        self.assertEqual(by_name['name']['return_type'], 'const char *')
+        self.assertEqual(by_name['name']['params'], ['const char *', 'int'])
+        self.assertEqual((by_name['name']['start_line'], by_name['name']['end_line']), (7, 9))
+        self.assertEqual(by_name['helper']['return_type'], 'unsigned')
+        # Neither static functions nor ones hidden behind a MEM_STATIC-style macro are testable
+        self.assertFalse(any(engine.is_testable_function(info) for info in functions))
+
+class TestStreamCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.outputs = {'functions': 'functions.jsonl'}
+
+    def test_restart_drops_uncheckpointed_records(self):
+        checkpoint = StreamCheckpoint(self.tmp_dir.name, self.outputs, every=2)
+        for c_file in ['a.c', 'b.c', 'c.c']:
+            checkpoint.write('functions', {'function_name': f'f_{c_file[0]}', 'file_path': c_file})
+            checkpoint.mark_done('files', c_file)
+        # c.c was written but the run dies before the next checkpoint
+        checkpoint.writers['functions'].sync()
+
+        restarted = StreamCheckpoint(self.tmp_dir.name, self.outputs, every=2)
+        self.assertTrue(restarted.is_done('files', 'b.c'))
+        self.assertFalse(restarted.is_done('files', 'c.c'))
+        restarted.write('functions', {'function_name': 'f_c', 'file_path': 'c.c'})
+        restarted.mark_done('files', 'c.c')
+        restarted.close()
+
+        functions_file = os.path.join(self.tmp_dir.name, 'functions.jsonl')
+        self.assertEqual([f['function_name'] for f in JsonlFile(functions_file)], ['f_a', 'f_b', 'f_c'])
+        index = JsonlIndex(functions_file, key='function_name')
+        self.addCleanup(index.close)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index['f_b']['file_path'], 'b.c')
+
+class TestCorpusScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        # One big repo and one small one
+        self.repos = []
+        for repo_id, num_files in [('big___repo', 8), ('small___repo', 1)]:
+            repo_path = os.path.join(self.tmp_dir.name, 'repos', repo_id)
+            os.makedirs(os.path.join(repo_path, 'src'))
+            for i in range(num_files):
+                with open(os.path.join(repo_path, 'src', f'file{i}.c'), 'w') as f:
+                    f.write(''.join(f'int f{i}_{j}(int x) {{ return x + {j}; }}\n' for j in range(5)))
+            self.repos.append(repo_path)
+
+    def run_corpus(self, output_name, workers=1):
+        extractor = CFunctionExtractor(engine='tree-sitter')
+        output_dir = os.path.join(self.tmp_dir.name, output_name)
+        scheduler = CorpusScheduler(extractor, output_dir, per_repo=7, per_file=2, workers=workers)
+        with patch('builtins.print'):
+            summary = scheduler.run(self.repos)
+        shards = {}
+        for repo_id in summary:
+            functions = JsonlFile(os.path.join(output_dir, repo_id, 'functions.jsonl'))
+            shards[repo_id] = [func['function_name'] for func in functions]
+        return summary, shards
+
+    def test_quotas_and_deterministic_shards(self):
+        summary, shards = self.run_corpus('out')
+        self.assertEqual(len(shards['big___repo']), 7)
+        self.assertEqual(len(shards['small___repo']), 2)
+        # No file gives more than per_file functions
+        per_file = {}
+        for name in shards['big___repo']:
+            per_file[name.split('_')[0]] = per_file.get(name.split('_')[0], 0) + 1
+        self.assertTrue(all(count <= 2 for count in per_file.values()))
+        self.assertEqual(summary['big___repo']['functions'], 7)
+
+        _, parallel_shards = self.run_corpus('out_parallel', workers=2)
+        self.assertEqual(parallel_shards, shards)
+
+    def test_finished_repos_are_skipped_on_rerun(self):
+        self.run_corpus('out')
+        with patch.object(CorpusScheduler, 'sample_files') as sample_files:
+            _, shards = self.run_corpus('out')
+        sample_files.assert_not_called()
+        self.assertEqual(len(shards['big___repo']), 7)
+
+    def test_parallel_extraction_stops_handing_out_files(self):
+        from concurrent.futures import ProcessPoolExecutor
+        submit = ProcessPoolExecutor.submit
+        extractor = CFunctionExtractor(engine='tree-sitter', num_tests=3)
+        with patch.object(ProcessPoolExecutor, 'submit', autospec=True, side_effect=submit) as submitted, \
+                patch('builtins.print'):
+            functions = extractor.extract_from_repo(self.repos[0], workers=2)
+        self.assertEqual([func['function_name'] for func in functions], ['f0_0', 'f0_1', 'f0_2'])
+        # The first file fills the budget, so at most one window of the 8 files is ever submitted
+        self.assertLessEqual(submitted.call_count, 4)
+
+class TestDependencySlicer(unittest.TestCase):
+    def test_unit_text_is_balanced(self):
+        text = '__attribute__((unused))\n#endif\n#define MARK 1 /* starts here\n'
+        self.assertEqual(balance_unit_text(text), '__attribute__((unused))\n#define MARK 1 /* starts here\n */')
+
+    @unittest.skipUnless(os.path.exists(llvm_library_path), "libclang not available")
+    def test_closure_of_a_long_call_chain(self):
+        slicer = DependencySlicer(tempfile.gettempdir())
+        # f0 calls f1 calls f2 ... far past the recursion limit, with f10 and f11 calling each other
+        length = 3000
+        for i in range(length):
+            deps = [f'f{i + 1}'] if i + 1 < length else []
+            slicer.units[f'f{i}'] = {'file': 'a.c', 'start_line': i + 1, 'deps': deps + (['f10'] if i == 11 else []),
+                                     'includes': {'<string.h>'} if i == length - 1 else set()}
+        slicer.finish()
+        order, includes = slicer.closure('f0')
+        self.assertEqual(order, [f'f{i}' for i in reversed(range(12, length))] + ['f10', 'f11'] +
+                         [f'f{i}' for i in reversed(range(10))])
+        self.assertEqual(includes, {'<string.h>'})
+        self.assertEqual(slicer.closure('f11')[0][-2:], ['f10', 'f11'])
+
+    @unittest.skipUnless(os.path.exists(llvm_library_path), "libclang not available")
+    def test_slice_is_minimal_and_self_contained(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        files = {
+            'util.h': (
+                '#include <string.h>\n'
+                '#define SCALE 3\n'
+                '#define TIMES_SCALE(x) ((x) * SCALE)\n'
+                '#define UNUSED_MACRO 7\n'
+                'typedef struct point { int x; int y; } point_t;\n'
+                'struct unused { int z; };\n'
+                'int helper(point_t p);\n'
+                'int unrelated(int a);\n'
+            ),
+            'a.c': (
+                '#include "util.h"\n'
+                'int target(int a) {\n'
+                '    point_t p = { a, TIMES_SCALE(a) };\n'
+                '    return helper(p) + (int)strlen("x");\n'
+                '}\n'
+            ),
+            'b.c': (
+                '#include "util.h"\n'
+                'static int offset = 1;\n'
+                'int helper(point_t p) { return p.x + p.y + offset; }\n'
+                'int unrelated(int a) { return a + UNUSED_MACRO; }\n'
+            ),
+        }
+        for name, content in files.items():
+            with open(os.path.join(tmp_dir.name, name), 'w') as f:
+                f.write(content)
+
+        with patch('builtins.print'):
+            slicer = DependencySlicer(tmp_dir.name).index_repo()
+        res = slicer.slice_function(os.path.join(tmp_dir.name, 'a.c'), 2)
+        code = res['code']
+        self.assertEqual(res['includes'], ['<string.h>'])
+        for needed in ['#define SCALE 3', 'TIMES_SCALE', 'typedef struct point', 'static int offset = 1;',
+                       'int helper(point_t p) {', 'int target(int a) {']:
+            self.assertIn(needed, code)
+        for unused in ['UNUSED_MACRO', 'struct unused', 'unrelated']:
+            self.assertNotIn(unused, code)
+        self.assertTrue(code.rstrip().endswith('}'))
+
+        if shutil.which('gcc'):
+            with tempfile.NamedTemporaryFile('w', suffix='.c', delete=False) as f:
+                f.write(code)
+            self.addCleanup(os.unlink, f.name)
+            self.assertEqual(subprocess.run(['gcc', '-fsyntax-only', f.name]).returncode, 0)
+
+        # A saved index is loaded instead of parsing the repo again, until one of its files changes
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_path = os.path.join(cache_dir.name, 'slice.json')
+        with patch('builtins.print'):
+            DependencySlicer(tmp_dir.name).index_repo(cache_path)
+            loaded = DependencySlicer(tmp_dir.name)
+            with patch.object(loaded.extractor, 'parse_file', side_effect=AssertionError('parsed')):
+                loaded.index_repo(cache_path)
+            self.assertEqual(loaded.slice_function(os.path.join(tmp_dir.name, 'a.c'), 2), res)
+            with open(os.path.join(tmp_dir.name, 'b.c'), 'a') as f:
+                f.write('int extra(void) { return 0; }\n')
+            changed = DependencySlicer(tmp_dir.name)
+            with patch.object(changed.extractor, 'parse_file', wraps=changed.extractor.parse_file) as parse_file:
+                changed.index_repo(cache_path)
+            self.assertEqual(parse_file.call_count, 2)
+
+class TestSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.repo = os.path.join(self.tmp_dir.name, 'repo')
+        os.makedirs(self.repo)
+        self.write('util.h', '#define LIMIT 10\ntypedef struct point { int x; } point_t;\nint helper(point_t p);\n')
+        self.write('a.c', '#include "util.h"\nint helper(point_t p) { return p.x < LIMIT; }\n')
+        self.write('b.c', '#include "util.h"\nint caller(int x) { point_t p = { x }; return helper(p); }\n')
+
+    def write(self, name, content):
+        with open(os.path.join(self.repo, name), 'w') as f:
+            f.write(content)
+
+    def test_lookups_and_incremental_update(self):
+        index = SymbolIndex(self.repo, path=os.path.join(self.tmp_dir.name, 'index.sqlite'))
+        self.addCleanup(index.close)
+        self.assertEqual(index.update(), {'indexed': 3, 'unchanged': 0, 'removed': 0})
+
+        self.assertEqual([(s['file'], s['line']) for s in index.definitions('helper')], [('a.c', 2)])
+        self.assertEqual([(s['file'], s['kind']) for s in index.declarations('helper')], [('util.h', 'function')])
+        self.assertEqual({s['kind'] for s in index.definitions('point')}, {'struct'})
+        self.assertEqual(index.definitions('LIMIT')[0]['kind'], 'macro')
+        self.assertEqual([c['caller'] for c in index.callers('helper')], ['caller'])
+        self.assertIn({'file': 'b.c', 'line': 2}, index.references('point_t'))
+
+        # Only the edited file is parsed again, and deleted files disappear
+        self.write('b.c', '#include "util.h"\nint other(int x) { return x; }\n')
+        os.unlink(os.path.join(self.repo, 'a.c'))
+        self.assertEqual(index.update(), {'indexed': 1, 'unchanged': 1, 'removed': 1})
+        self.assertEqual(index.definitions('helper'), [])
+        self.assertEqual(index.callers('helper'), [])
+        self.assertEqual(index.definitions('other')[0]['file'], 'b.c')
+
+    @unittest.skipUnless(os.path.exists(llvm_library_path), "libclang not available")
+    def test_libclang_rows_follow_included_headers(self):
+        self.write('config.h', '#define FEATURE 1\n')
+        self.write('feature.c', '#include "config.h"\n#ifdef FEATURE\nint f(void) { return 1; }\n#endif\n')
+        index = SymbolIndex(self.repo, path=os.path.join(self.tmp_dir.name, 'index.sqlite'), engine='libclang')
+        self.addCleanup(index.close)
+        self.assertEqual(index.update()['indexed'], 5)
+        self.assertEqual([(s['file'], s['line']) for s in index.definitions('f')], [('feature.c', 3)])
+
+        # feature.c didn't change, but what it includes did
+        self.write('config.h', '/* FEATURE is off */\n')
+        self.assertEqual(index.update(), {'indexed': 2, 'unchanged': 3, 'removed': 0})
+        self.assertEqual(index.definitions('f'), [])
+
+class TestBenchmark(unittest.TestCase):
+    def test_generated_corpus_is_deterministic(self):
+        with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+            sizes = {'small': 2}
+            generate_corpus(a, sizes, (0, 3))
+            generate_corpus(b, sizes, (0, 3))
+            files = sorted(str(p.relative_to(a)) for p in Path(a).rglob('*.[ch]'))
+            self.assertEqual(files, ['include/d3/h0.h', 'include/d3/h1.h', 'include/d3/h2.h', 'small_d0.c', 'small_d3.c'])
+            for name in files:
+                self.assertEqual(Path(a, name).read_text(), Path(b, name).read_text())
+            self.assertIn('BENCH_D3_SCALE2', Path(a, 'small_d3.c').read_text())
+
+    def test_compare_flags_regressions_by_direction(self):
+        old = {'metrics': {'parse_seconds_mean': 1.0, 'functions_per_second': 100.0, 'peak_rss_mb': 50.0}}
+        new = {'metrics': {'parse_seconds_mean': 1.5, 'functions_per_second': 200.0, 'peak_rss_mb': 52.0,
+                           'tests_per_second': 3.0}}
+        comparison = {entry['metric']: entry for entry in compare_results(old, new, threshold=0.1)}
+        # Only metrics both runs have are compared
+        self.assertEqual(set(comparison), {'parse_seconds_mean', 'functions_per_second', 'peak_rss_mb'})
+        self.assertTrue(comparison['parse_seconds_mean']['regression'])
+        self.assertFalse(comparison['functions_per_second']['regression'])
+        self.assertFalse(comparison['peak_rss_mb']['regression'])
+        self.assertAlmostEqual(comparison['functions_per_second']['change'], -1.0)
+
+class TestHarnessTable(unittest.TestCase):
+    FUNCTION = {
+        'function_name': 'scale',
+        'signature': 'long scale(unsigned char, double, const int *)',
+        'source': 'long scale(unsigned char c, double d, const int *p) { return p ? 0 : c * (long)d; }',
+        'body_offset': 52,
+        'includes': [],
+        'typedefs': [],
+    }
+
+    def test_type_aware_inputs(self):
+        self.assertEqual(type_kind('const unsigned char'), ('int', 8, False))
+        self.assertEqual(type_kind('int (*)(int)'), ('pointer',))
+        self.assertEqual(type_kind('struct point'), ('other',))
+        cases = generate_inputs(self.FUNCTION, 100)
+        self.assertEqual(cases, generate_inputs(self.FUNCTION, 100))
+        self.assertEqual(len(cases), 100)
+        self.assertTrue(all(0 <= c['inputs'][0] <= 255 for c in cases))
+        self.assertGreater(len({c['inputs'][0] for c in cases}), 50)
+        self.assertTrue(all(isinstance(c['inputs'][1], float) for c in cases))
+        self.assertEqual({c['inputs'][2] for c in cases}, {0})
+
+    def test_harness_runs_every_case_in_one_loop(self):
+        tester = SelfEquivalenceTester(num_cases=500)
+        harness = tester.create_test_harness(self.FUNCTION, tester.generate_test_cases(self.FUNCTION))
+        # One call site however many test cases there are
+        self.assertEqual(harness.count('scale('), 2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'harness.c')
+            with open(source, 'w') as f:
+                f.write(harness)
+            subprocess.run(['gcc', '-Wall', '-Wextra', '-Werror', source, '-o', source + '.exe'], check=True)
+            output = subprocess.run([source + '.exe'], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.count('Test case'), 500)
+        self.assertIn('Test case 2:\nInput: (1, -1, ?), Output: -1\n', output)
+
+class RunnerTestCase(unittest.TestCase):
+    """Base of tests that run a TestRunner on functions and tests files in a temporary directory"""
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write_inputs(self, functions, tests):
+        """Write the functions file and the tests file, a dict of each function's test record"""
+        for name, records in (('functions.json', functions), ('tests.json', tests)):
+            with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                json.dump(records, f)
+
+    def make_test_record(self, func, tester):
+        """A function's test cases and harness, generated by tester"""
+        test_cases = tester.generate_test_cases(func)
+        return {'test_cases': test_cases, 'harness': tester.create_test_harness(func, test_cases)}
+
+    def make_runner(self, count_runs=False, **kwargs):
+        """
+        A TestRunner on the written files, keeping its outputs and objects in the temporary
+        directory, with kwargs for the feature under test. count_runs wraps compile_and_run in a Mock.
+        """
+        settings = {
+            'output_dir': os.path.join(self.tmp_dir, 'results'),
+            'golden_cache_path': None,
+            'object_cache_dir': os.path.join(self.tmp_dir, 'objects'),
+        }
+        settings.update(kwargs)
+        runner = TestRunner(os.path.join(self.tmp_dir, 'functions.json'), os.path.join(self.tmp_dir, 'tests.json'),
+                            **settings)
+        self.addCleanup(runner.close)
+        if runner.golden is not None:
+            self.addCleanup(runner.golden.close)
+        if count_runs:
+            runner.compile_and_run = Mock(side_effect=runner.compile_and_run)
+        return runner
+
+class TestGoldenOutputs(RunnerTestCase):
+    def test_original_runs_once_across_candidates_and_runs(self):
+        func = TestHarnessTable.FUNCTION
+        self.write_inputs([func], {func['function_name']: self.make_test_record(func, SelfEquivalenceTester(num_cases=4))})
+        candidate = dict(func, source=func['source'].replace('c * (long)d', '(long)d * c'))
+        wrong = dict(func, source=func['source'].replace('c * (long)d', 'c + (long)d'))
+        golden_path = os.path.join(self.tmp_dir, 'golden.sqlite')
+
+        runner = self.make_runner(count_runs=True, golden_cache_path=golden_path)
+        self.assertTrue(runner.run_equivalence_test(func, candidate)[0])
+        self.assertFalse(runner.run_equivalence_test(func, wrong)[0])
+        # The original was compiled for the first candidate only, and run again with the wrong
+        # one to diff the test case that differs
+        self.assertEqual(runner.compile_and_run.call_count, 5)
+        self.assertEqual(runner.golden.stats()['hits'], 1)
+
+        # A later run reuses the stored output, unless asked to recompute it
+        runner = self.make_runner(count_runs=True, golden_cache_path=golden_path)
+        self.assertTrue(runner.run_equivalence_test(func, candidate)[0])
+        self.assertEqual(runner.compile_and_run.call_count, 1)
+        runner = self.make_runner(count_runs=True, golden_cache_path=golden_path, refresh_golden=True)
+        self.assertTrue(runner.run_equivalence_test(func, candidate)[0])
+        self.assertEqual(runner.compile_and_run.call_count, 2)
+
+        # Different flags are a different golden output
+        runner.gcc_flags = runner.gcc_flags + ['-O1']
+        self.assertTrue(runner.run_equivalence_test(func, candidate)[0])
+        self.assertEqual(runner.compile_and_run.call_count, 4)
+        self.assertEqual(runner.golden.invalidate(func['function_name']), 2)
+
+class TestParallelRunner(RunnerTestCase):
+    def test_results_in_order_with_timeouts(self):
+        tester = SelfEquivalenceTester(num_cases=2)
+        functions = [dict(TestHarnessTable.FUNCTION, function_name=f'scale{i}',
+                          signature=f'long scale{i}(unsigned char, double, const int *)',
+                          source=TestHarnessTable.FUNCTION['source'].replace('scale(', f'scale{i}('))
+                     for i in range(6)]
+        self.write_inputs(functions, {func['function_name']: self.make_test_record(func, tester) for func in functions})
+        generated = [dict(func) for func in functions]
+        generated[2]['source'] = generated[2]['source'].replace('{ return', '{ for (;;); return')
+
+        runner = self.make_runner(workers=3)
+        runner.timeout = 1
+        results = runner.run_all_tests(generated)
+        self.assertEqual([r['function_name'] for r in results], [f'scale{i}' for i in range(6)])
+        self.assertEqual([r['status'] for r in results], ['equivalent'] * 2 + ['different'] + ['equivalent'] * 3)
+        self.assertEqual(results[2]['details'], 'Generated function failed to compile/run')
+
+class TestSeparateCompilation(RunnerTestCase):
+    def test_candidates_link_against_cached_harness_object(self):
+        func = {
+            'function_name': 'next_id',
+            'signature': 'int next_id(int)',
+            'source': 'int next_id(int step) { counter += step; return twice(counter); }',
+            'body_offset': 22,
+            'slice': 'int counter = 1;\nint twice(int x) { return 2 * x; }\nint next_id(int step) { counter += step; return twice(counter); }',
+        }
+        record = self.make_test_record(func, SelfEquivalenceTester(num_cases=3))
+        harness = record['harness']
+        self.write_inputs([func], {'next_id': record})
+        runner = self.make_runner()
+        object_dir = runner.object_cache_dir
+
+        expected = runner.compile_and_run(harness, 'next_id')
+        self.assertEqual(runner.candidate_output(harness, func, func['source'], 'next_id'), expected)
+        self.assertEqual(len(os.listdir(object_dir)), 1)
+        # Built once: the next candidate reuses the object
+        candidate = 'int next_id(int step) { counter = counter + step; return counter * 2; }'
+        self.assertEqual(runner.candidate_output(harness, func, candidate, 'next_id'), expected)
+        self.assertEqual(len(os.listdir(object_dir)), 1)
+        # The harness object has no definition of the function itself, so a candidate without one can't pass
+        self.assertIsNone(runner.candidate_output(harness, func, 'int other(int x) { return x; }', 'next_id'))
+
+    def test_only_the_definition_is_replaced(self):
+        source = 'int next_id(int step) { return step; }'
+        harness = f'/* was: {source} */\n{source}\n\n{HARNESS_MARKER}\nint main(void) {{ return 0; }}\n'
+        replaced = replace_function(harness, source, 'int next_id(int step) { return 2 * step; }')
+        self.assertEqual(replaced.count(source), 1)
+        self.assertIn(f'/* was: {source} */\nint next_id(int step) {{ return 2 * step; }}\n', replaced)
+
+class TestForkServer(RunnerTestCase):
+    def test_fork_server_runs_match_executables(self):
+        func = TestHarnessTable.FUNCTION
+        record = self.make_test_record(func, SelfEquivalenceTester(num_cases=4))
+        harness = record['harness']
+        self.write_inputs([func], {func['function_name']: record})
+
+        expected = self.make_runner().compile_and_run(harness, 'scale')
+        runner = self.make_runner(fork_server=True)
+        runner.timeout = 1
+        self.assertEqual(runner.compile_and_run(harness, 'scale'), expected)
+        self.assertEqual(runner.candidate_output(harness, func, func['source'], 'scale'), expected)
+        # A hanging candidate is killed and the server keeps serving
+        hang = func['source'].replace('{ return', '{ for (;;); return')
+        self.assertIsNone(runner.candidate_output(harness, func, hang, 'scale'))
+        crash = func['source'].replace('{ return', '{ if (c == 1) *(volatile int *)0 = 0; return')
+        self.assertNotEqual(runner.candidate_output(harness, func, crash, 'scale'), expected)
+        self.assertEqual(runner.compile_and_run(harness, 'scale'), expected)
+        # Closing stdout doesn't get a harness past the timeout
+        closed = func['source'].replace('{ return', '{ fclose(stdout); for (;;); return')
+        self.assertIsNone(runner.candidate_output(harness, func, closed, 'scale'))
+        # A server that dies is replaced
+        server = runner._servers.get_nowait()
+        server.process.kill()
+        runner._servers.put(server)
+        self.assertIsNone(runner.compile_and_run(harness, 'scale'))
+        self.assertEqual(runner.compile_and_run(harness, 'scale'), expected)
+
+class TestScratchDir(unittest.TestCase):
+    def test_scratch_dirs_are_cleaned_up(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with patch.object(run_self_equiv_tests, 'SCRATCH_ROOTS', [root]):
+            # A directory of a runner that is no longer running
+            dead = subprocess.Popen(['true'])
+            dead.wait()
+            stale = os.path.join(root, f'r2e_harness_{dead.pid}_abc')
+            os.makedirs(stale)
+            live = make_scratch_dir()
+            self.assertFalse(os.path.exists(stale))
+            self.assertTrue(live.startswith(os.path.join(root, f'r2e_harness_{os.getpid()}_')))
+            # A directory of a live process is left alone
+            self.assertTrue(os.path.exists(live))
+            make_scratch_dir()
+            self.assertTrue(os.path.exists(live))
+
+class TestPassAtK(RunnerTestCase):
+    def test_pass_at_k(self):
+        self.assertAlmostEqual(pass_at_k(10, 3, 1), 0.3)
+        self.assertAlmostEqual(pass_at_k(4, 1, 2), 0.5)
+        self.assertEqual(pass_at_k(5, 0, 3), 0.0)
+        self.assertEqual(pass_at_k(5, 4, 2), 1.0)
+
+    def test_candidates_share_one_original_run(self):
+        func = TestHarnessTable.FUNCTION
+        self.write_inputs([func, dict(func, function_name='missing')],
+                          {'scale': self.make_test_record(func, SelfEquivalenceTester(num_cases=4))})
+        wrong = dict(func, source=func['source'].replace('c * (long)d', 'c + (long)d'))
+        generated = [wrong, dict(func), dict(func)]
+
+        def run(**kwargs):
+            runner = self.make_runner(count_runs=True, **kwargs)
+            return runner, runner.run_all_tests(generated)
+
+        runner, results = run()
+        self.assertEqual(results[1]['status'], 'skipped')
+        result = results[0]
+        self.assertEqual((result['status'], result['num_candidates'], result['num_evaluated'], result['num_passed']),
+                         ('equivalent', 3, 3, 2))
+        self.assertEqual([c['status'] for c in result['candidates']], ['different', 'equivalent', 'equivalent'])
+        # One run of the original plus one per candidate, and a run of both to diff the wrong one
+        self.assertEqual(runner.compile_and_run.call_count, 6)
+        self.assertAlmostEqual(summarize(results, (1, 2))['pass@1'], 2 / 3)
+        self.assertEqual(summarize(results, (1, 2))['pass@2'], 1.0)
+
+        runner, results = run(stop_at_first_pass=True)
+        self.assertEqual((results[0]['num_evaluated'], results[0]['num_passed']), (2, 1))
+        self.assertNotIn('pass@1', summarize(results, stop_at_first_pass=True))
+        self.assertEqual(summarize(results, stop_at_first_pass=True)['solved'], 1)
+
+    def test_failed_original_is_left_out_of_pass_at_k(self):
+        func = TestHarnessTable.FUNCTION
+        broken = dict(func, function_name='broken')
+        self.write_inputs([func, broken], {'scale': self.make_test_record(func, SelfEquivalenceTester(num_cases=4)),
+                                           'broken': {'harness': 'int main(void) { return missing(); }'}})
+        runner = self.make_runner()
+        wrong = dict(func, source=func['source'].replace('c * (long)d', 'c + (long)d'))
+        results = runner.run_all_tests([dict(func), wrong, dict(broken), dict(broken)])
+        self.assertTrue(results[1]['original_failed'])
+        summary = summarize(results, (1,))
+        self.assertEqual(summary['original_failed'], 1)
+        self.assertAlmostEqual(summary['pass@1'], 0.5)
+
+class TestPerformanceComparison(unittest.TestCase):
+    SLOW = 'unsigned long sum_to(unsigned int n) { unsigned long s = 0; for (unsigned int i = 1; i <= n; i++) s += i; return s; }'
+    FAST = 'unsigned long sum_to(unsigned int n) { return (unsigned long)n * (n + 1) / 2; }'
+
+    def test_verdict_needs_whole_interval_past_tolerance(self):
+        self.assertEqual(verdict(1.2, 1.5, 0.05), 'faster')
+        self.assertEqual(verdict(0.5, 0.9, 0.05), 'slower')
+        self.assertEqual(verdict(0.9, 1.3, 0.05), 'same')
+
+    def test_faster_candidate_is_detected(self):
+        func = {'function_name': 'sum_to', 'signature': 'unsigned long sum_to(unsigned int)',
+                'source': self.SLOW, 'body_offset': 37, 'includes': ['<stdio.h>'], 'typedefs': []}
+        tester = SelfEquivalenceTester(num_cases=8)
+        test_cases = tester.generate_test_cases(func)
+        harness = tester.create_test_harness(func, test_cases)
+        comparer = PerformanceComparer(repetitions=5, warmup=1, rounds=2)
+        result = comparer.compare(harness, func, test_cases, self.SLOW, self.FAST)
+        self.assertTrue(result['separate_compilation'])
+        self.assertEqual(result['original']['samples'], 10)
+        self.assertGreater(result['speedup'], 10)
+        self.assertEqual(result['verdict'], 'faster')
+        harness = harness.replace(self.SLOW, self.FAST)
+        self.assertEqual(comparer.compare(harness, func, test_cases, self.FAST, self.SLOW)['verdict'], 'slower')
+
+    def test_sides_fall_back_to_whole_builds_together(self):
+        func = {'function_name': 'sum_to', 'signature': 'unsigned long sum_to(unsigned int)',
+                'source': self.SLOW, 'body_offset': 37, 'includes': ['<stdio.h>'], 'typedefs': []}
+        tester = SelfEquivalenceTester(num_cases=8)
+        test_cases = tester.generate_test_cases(func)
+        harness = tester.create_test_harness(func, test_cases)
+        comparer = PerformanceComparer(repetitions=5, warmup=1, rounds=2)
+        real_split = perf_compare.split_harness
+
+        # Only the candidate's separately compiled code fails to build
+        def split(code):
+            return real_split(code) + ('\n#error no separate build' if self.FAST in code else '')
+
+        with patch('perf_compare.split_harness', side_effect=split):
+            result = comparer.compare(harness, func, test_cases, self.SLOW, self.FAST)
+        self.assertFalse(result['separate_compilation'])
+        self.assertEqual(result['verdict'], 'faster')
+
+class TestCoverageMinimizer(unittest.TestCase):
+    CLASSIFY = {
+        'function_name': 'classify',
+        'signature': 'int classify(int, int)',
+        'source': 'int classify(int x, int y) { if (x < 0) return -1; if (x == 0) return y > 100; return y % 2 ? 2 : 3; }',
+        'includes': [],
+        'typedefs': [],
+    }
+
+    def test_greedy_cover(self):
+        coverage = [frozenset('ab'), frozenset('abc'), frozenset('a'), frozenset('d'), frozenset('cd')]
+        self.assertEqual(greedy_cover(coverage), [1, 3])
+        self.assertEqual(greedy_cover([frozenset()]), [0])
+
+    def test_minimized_cases_keep_every_path(self):
+        minimizer = CoverageMinimizer(pool_size=64)
+        tester = SelfEquivalenceTester(minimizer=minimizer)
+        cases = tester.generate_test_cases(self.CLASSIFY)
+        self.assertLess(len(cases), 64)
+        self.assertEqual([c['inputs'] for c in cases], [generate_inputs(self.CLASSIFY, 64)[c['pool_index']]['inputs'] for c in cases])
+        paths = ['negative' if x < 0 else 'zero' if x == 0 else 'odd' if y % 2 else 'even'
+                 for x, y in (c['inputs'] for c in cases)]
+        # One case per path through the function
+        self.assertEqual(sorted(paths), ['even', 'negative', 'odd', 'zero'])
+
+        # An original that crashes can't be minimized, and the usual test cases are used
+        crash = dict(self.CLASSIFY, source=self.CLASSIFY['source'].replace('{ if', '{ if (x == 2) *(volatile int *)0 = 0; if'))
+        self.assertEqual(tester.generate_test_cases(crash), generate_inputs(crash))
+        self.assertEqual(minimizer.stats['failed'], 1)
+
+class TestDifferentialFuzzer(RunnerTestCase):
+    FUNCTION = {
+        'function_name': 'clamp_add',
+        'signature': 'int clamp_add(int, unsigned char)',
+        'source': 'int clamp_add(int a, unsigned char b) { int s = a + b; return s > 30000 ? 30000 : s; }',
+        'body_offset': 38,
+        'includes': ['<stdio.h>'],
+        'typedefs': [],
+    }
+
+    def test_diverging_input_becomes_a_test_case(self):
+        func = self.FUNCTION
+        self.write_inputs([func], {'clamp_add': self.make_test_record(func, SelfEquivalenceTester())})
+        # Wrong on one input in tens of thousands, which the harness's test cases miss
+        wrong = dict(func, source=func['source'].replace('{ int s', '{ if (a == 12345 && b > 3) return 0; int s'))
+        reproducers = os.path.join(self.tmp_dir, 'reproducers.jsonl')
+
+        def run(fuzzer):
+            runner = self.make_runner(fuzzer=fuzzer, reproducers_path=reproducers)
+            return runner.run_all_tests([wrong, dict(func)])[0]['candidates']
+
+        candidates = run(DifferentialFuzzer(budget=1))
+        self.assertEqual([c['status'] for c in candidates], ['different', 'equivalent'])
+        self.assertEqual(candidates[0]['fuzzing']['reproducer']['inputs'], [12345, 4])
+        self.assertEqual(candidates[1]['fuzzing']['status'], 'same')
+        self.assertGreater(candidates[1]['fuzzing']['executions'], 1000)
+        # The input is kept, so the next run catches the candidate without fuzzing
+        candidates = run(None)
+        self.assertEqual([c['status'] for c in candidates], ['different', 'equivalent'])
+        self.assertTrue(candidates[0]['details'].startswith('Outputs differ'))
+
+class TestOutputDigest(RunnerTestCase):
+    OUTPUT = 'preamble\nTest case 1:\nInput: (1), Output: 2\nTest case 2:\nInput: (2), Output: 4\n'
+
+    def test_digest_does_not_depend_on_chunks(self):
+        whole = digest_text(self.OUTPUT, keep_case=2)
+        pieces = OutputDigest(keep_case=2)
+        for byte in self.OUTPUT.encode():
+            pieces.feed(bytes([byte]))
+        pieces.finish()
+        self.assertEqual(pieces.summary(), whole.summary())
+        self.assertEqual(len(whole.cases), 3)
+        self.assertEqual(pieces.text(), 'Test case 2:\nInput: (2), Output: 4\n')
+        other = digest_text(self.OUTPUT.replace('Output: 4', 'Output: 5'))
+        self.assertEqual(first_difference(whole.cases, other.cases), 2)
+        self.assertEqual(first_difference(whole.cases, whole.cases[:2]), 2)
+        capped = OutputDigest(keep_case=0, limit=4)
+        capped.feed(self.OUTPUT.encode())
+        self.assertEqual((capped.finish().text(), capped.truncated), ('prea', True))
+
+    def test_diff_is_limited_to_first_differing_case(self):
+        func = TestHarnessTable.FUNCTION
+        self.write_inputs([func], {'scale': self.make_test_record(func, SelfEquivalenceTester(num_cases=200))})
+        runner = self.make_runner()
+        wrong = dict(func, source=func['source'].replace('c * (long)d', 'c + (long)d'))
+        passed, details = runner.run_equivalence_test(func, wrong)
+        self.assertFalse(passed)
+        # Most of the 200 test cases differ, but only the first one that does is shown
+        self.assertTrue(details.startswith('Outputs differ from test case 1 on:'))
+        self.assertEqual(details.count('Test case'), 1)
+
+class TestResumableResults(RunnerTestCase):
+    def test_resume_skips_candidates_with_results(self):
+        func = TestHarnessTable.FUNCTION
+        self.write_inputs([func], {'scale': self.make_test_record(func, SelfEquivalenceTester(num_cases=4))})
+        wrong = dict(func, source=func['source'].replace('c * (long)d', 'c + (long)d'))
+        reordered = dict(func, source=func['source'].replace('c * (long)d', '(long)d * c'))
+        results_file = os.path.join(self.tmp_dir, 'results', 'results.jsonl')
+
+        def run(generated, **kwargs):
+            runner = self.make_runner(count_runs=True, **kwargs)
+            return runner, runner.run_all_tests(generated)[0]
+
+        runner, result = run([wrong, dict(func)])
+        records = list(iter_jsonl(results_file))
+        self.assertEqual([r['status'] for r in records], ['different', 'equivalent'])
+        self.assertNotIn('source', json.dumps(records))
+        self.assertEqual(result['generated_hash'], records[1]['candidate_hash'])
+
+        # A run killed while writing a record leaves half a line, which resuming drops
+        with open(results_file, 'a') as f:
+            f.write('{"function_name": "sca')
+        runner, result = run([wrong, dict(func), reordered], resume=True)
+        self.assertEqual([c['status'] for c in result['candidates']], ['different', 'equivalent', 'equivalent'])
+        self.assertEqual([c.get('resumed', False) for c in result['candidates']], [True, True, False])
+        # Only the new candidate and the original it is compared with were run
+        self.assertEqual(runner.compile_and_run.call_count, 2)
+        self.assertEqual(len(list(iter_jsonl(results_file))), 3)
+
+        # Without resume the results file starts over
+        runner, result = run([dict(func)])
+        self.assertEqual(runner.compile_and_run.call_count, 2)
+        self.assertEqual(len(list(iter_jsonl(results_file))), 1)
+
+class TestBuildArtifacts(RunnerTestCase):
+    def test_harness_links_against_repo_objects(self):
+        tmp_dir = self.tmp_dir
+        repo = os.path.join(tmp_dir, 'repos', 'demo')
+        os.makedirs(os.path.join(repo, 'src'))
+        sources = {
+            'counter.c': 'int twice(int x);\nint counter = 1;\nint next_id(int step) { counter += step; return twice(counter); }\n',
+            # Built with a different definition than the one pasted into the harness below
+            'twice.c': 'int twice(int x) { return 2 * x + 1; }\n',
+            'main.c': 'int next_id(int step);\nint main(void) { return next_id(1); }\n',
+        }
+        commands = []
+        for name, code in sources.items():
+            with open(os.path.join(repo, 'src', name), 'w') as f:
+                f.write(code)
+            subprocess.run(['gcc', '-c', f'src/{name}', '-o', f'src/{name[:-2]}.o'], cwd=repo, check=True)
+            commands.append({'directory': repo, 'file': f'src/{name}', 'output': f'src/{name[:-2]}.o',
+                             'arguments': ['gcc', '-c', f'src/{name}', '-o', f'src/{name[:-2]}.o']})
+        with open(os.path.join(repo, 'compile_commands.json'), 'w') as f:
+            json.dump(commands, f)
+
+        func = {
+            'function_name': 'next_id',
+            'signature': 'int next_id(int)',
+            'file_path': os.path.join(repo, 'src', 'counter.c'),
+            'source': 'int next_id(int step) { counter += step; return twice(counter); }',
+            'body_offset': 22,
+            'slice': 'int counter = 1;\nint twice(int x) { return 2 * x; }\nint next_id(int step) { counter += step; return twice(counter); }',
+        }
+        record = self.make_test_record(func, SelfEquivalenceTester(num_cases=3))
+        harness = record['harness']
+        self.write_inputs([func], {'next_id': record})
+        artifacts = BuildArtifacts(repos_dir=os.path.join(tmp_dir, 'repos'), cache_dir=os.path.join(tmp_dir, 'artifacts'))
+        runner = self.make_runner(artifacts=artifacts)
+
+        artifact = runner.function_artifact(func)
+        self.assertIsNotNone(artifact)
+        self.assertEqual(artifacts.locate(func['file_path'], 'next_id'), (os.path.join(repo, 'src', 'counter.o'), None))
+        # The build's twice is the one called, not the copy pasted into the harness
+        linked, original_output = runner.original_with_fallback(harness, func)
+        self.assertIs(linked, artifact)
+        self.assertNotEqual(original_output['digest'], runner.compile_and_run(harness, 'next_id').digest)
+
+        # Candidates replace the build's function and call into the build too
+        candidate = {'function_name': 'next_id', 'source': 'int next_id(int step) { counter = counter + step; return twice(counter); }'}
+        self.assertEqual(runner.compare_candidate(harness, func, candidate, original_output, artifact),
+                         (True, "Outputs match exactly"))
+        pasted = {'function_name': 'next_id', 'source': 'int next_id(int step) { counter += step; return 2 * counter; }'}
+        self.assertFalse(runner.compare_candidate(harness, func, pasted, original_output, artifact)[0])
+
+        # A function the build didn't compile is compiled from source as before
+        self.assertIsNone(artifacts.function_artifact(func['file_path'], 'missing'))
+
+    def test_repo_root_in_nested_layout(self):
+        tmp_dir = self.tmp_dir
+        batch = os.path.join(tmp_dir, 'repos', 'repos_10')
+        checkpoint_dir = os.path.join(tmp_dir, 'checkpoints')
+        for name in ['with_db', 'with_checkpoint', 'unbuilt']:
+            os.makedirs(os.path.join(batch, name, 'src', 'lib'))
+            with open(os.path.join(batch, name, 'src', 'lib', 'a.c'), 'w') as f:
+                f.write('int a(void) { return 1; }\n')
+            # A sibling's object must never be linked in
+            subprocess.run(['gcc', '-c', 'src/lib/a.c', '-o', 'a.o'], cwd=os.path.join(batch, name), check=True)
+        with open(os.path.join(batch, 'with_db', 'compile_commands.json'), 'w') as f:
+            json.dump([], f)
+        BuildCheckpoint(os.path.join(batch, 'with_checkpoint'), 'MakefileBuildSystem', checkpoint_dir).mark_done('make')
+        artifacts = BuildArtifacts(repos_dir=os.path.join(tmp_dir, 'repos'), cache_dir=os.path.join(tmp_dir, 'artifacts'),
+                                   checkpoint_dir=checkpoint_dir)
+
+        for name in ['with_db', 'with_checkpoint']:
+            source = os.path.join(batch, name, 'src', 'lib', 'a.c')
+            self.assertEqual(artifacts.repo_root(source), os.path.realpath(os.path.join(batch, name)))
+            self.assertEqual(artifacts.locate(source, 'a'), (os.path.realpath(os.path.join(batch, name, 'a.o')), None))
+        # Without either marker, the top directory in repos_dir is the last resort
+        self.assertEqual(artifacts.repo_root(os.path.join(batch, 'unbuilt', 'src', 'lib', 'a.c')), os.path.realpath(batch))
+
+class TestCodeQLRunner(unittest.TestCase):
+    # Stands in for the codeql CLI: records its arguments and when it ran, then creates the database
+    STUB = """#!/bin/sh
+echo "start $(basename "$PWD") $*" >> "$CODEQL_STUB_LOG"
+sleep 0.5
+echo "end $(basename "$PWD")" >> "$CODEQL_STUB_LOG"
+case "$PWD" in *broken*) exit 1;; esac
+mkdir -p "$3"
+"""
+
+    def test_jobs_fit_budget_and_use_known_builds(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        stub = os.path.join(tmp_dir, 'codeql')
+        with open(stub, 'w') as f:
+            f.write(self.STUB)
+        os.chmod(stub, 0o755)
+        stub_log = os.path.join(tmp_dir, 'stub.log')
+        checkpoint_dir = os.path.join(tmp_dir, 'checkpoints')
+        repos = []
+        for name in ['built', 'unbuilt', 'broken']:
+            repo = os.path.join(tmp_dir, 'repos', name)
+            os.makedirs(repo)
+            with open(os.path.join(repo, 'Makefile'), 'w') as f:
+                f.write('all:\n')
+            repos.append(repo)
+        # Only the first repo's build finished
+        BuildCheckpoint(repos[0], 'MakefileBuildSystem', checkpoint_dir).mark_done('make')
+
+        runner = CodeQLRunner(stub, os.path.join(tmp_dir, 'databases'), threads=4, ram=3000, job_threads=2,
+                              job_ram=1000, log_dir=os.path.join(tmp_dir, 'logs'), checkpoint_dir=checkpoint_dir)
+        self.assertEqual((runner.workers, runner.job_threads, runner.job_ram), (2, 2, 1000))
+        with patch.dict(os.environ, {'CODEQL_STUB_LOG': stub_log}):
+            results = runner.run(repos)
+
+        self.assertEqual([r['status'] for r in results], ['success', 'success', 'failed'])
+        self.assertEqual([r['build'] for r in results], ['MakefileBuildSystem', 'autobuild', 'autobuild'])
+        self.assertTrue(os.path.isdir(os.path.join(tmp_dir, 'databases', 'built')))
+        with open(stub_log) as f:
+            lines = f.read().splitlines()
+        starts = {line.split()[1]: line for line in lines if line.startswith('start')}
+        self.assertIn('--command=make -B -j2', starts['built'])
+        self.assertNotIn('--command', starts['unbuilt'])
+        self.assertTrue(all('--threads=2 --ram=1000' in line for line in starts.values()))
+        # No more jobs ran at once than the budget allows
+        running, most = 0, 0
+        for line in lines:
+            running += 1 if line.startswith('start') else -1
+            most = max(most, running)
+        self.assertEqual(most, 2)
+
+    def test_oversized_jobs_are_cut_to_budget(self):
+        self.assertEqual(plan_jobs(1, 512, 4, 2048), (1, 1, 512))
+        self.assertEqual(plan_jobs(16, 8192, 2, 2048), (4, 2, 2048))
+
 if __name__ == '__main__':
     unittest.main()